@@ -0,0 +1,62 @@
+"""
+Benchmark export throughput and memory for 100k bills in every export format.
+
+Run from the repository root:
+
+    uv run python -m benchmarks.bench_export
+"""
+
+import asyncio
+import tempfile
+import time
+import tracemalloc
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from billparser.export import EXPORTERS
+from billparser.models import Bill, TransactionType
+from billparser.parsers.helpers import asset_helper, category_helper
+
+N_BILLS = 100_000
+
+
+async def generate_bills(n: int) -> AsyncIterator[Bill]:
+    category = category_helper.get_default_category()
+    asset = asset_helper.get_default_asset()
+    start = datetime(2025, 1, 1)
+    for i in range(n):
+        yield Bill(
+            transaction_type=TransactionType.EXPENSE,
+            amount=10 + i % 100,
+            time=start + timedelta(minutes=i),
+            catename=category,
+            remark=f"bill {i}",
+            accountname=asset,
+        )
+
+
+async def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for export_format, exporter_class in EXPORTERS.items():
+            path = Path(tmp_dir) / f"bills{exporter_class.suffix}"
+            exporter = exporter_class(path)
+            tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                count = await exporter.export(generate_bills(N_BILLS))
+            except RuntimeError as e:
+                tracemalloc.stop()
+                print(f"{export_format:<8} skipped: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{export_format:<8} {count / elapsed:10.0f} bills/s  peak {peak / 1024 / 1024:6.2f} MiB  "
+                f"file {path.stat().st_size / 1024 / 1024:6.2f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
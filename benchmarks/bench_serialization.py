@@ -0,0 +1,86 @@
+"""
+Benchmark CPU time and allocations of Bill serialization at a batch of 10k bills.
+
+Compares building default items per call with the interned defaults, and the per-bill
+`model_dump_json` path with the precompiled `billparser.serialization` path. Run from the repository root:
+
+    uv run python -m benchmarks.bench_serialization
+"""
+
+import json
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from billparser.models import Bill, CategoryItem, TransactionType
+from billparser.parsers.helpers import asset_helper, category_helper
+from billparser.serialization import dump_bill_json, dump_bills_json
+
+BATCH_SIZE = 10_000
+
+
+def make_bills(n: int) -> list[Bill]:
+    category = category_helper.get_default_category()
+    asset = asset_helper.get_default_asset()
+    start = datetime(2025, 1, 1)
+    return [
+        Bill(
+            transaction_type=TransactionType.EXPENSE,
+            amount=10 + i % 100,
+            time=start + timedelta(minutes=i),
+            catename=category,
+            remark=f"bill {i}",
+            accountname=asset,
+        )
+        for i in range(n)
+    ]
+
+
+def measure(label: str, func: Callable[[], object]) -> None:
+    func()  # warm up
+    tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<40} {elapsed * 1e6 / BATCH_SIZE:8.2f} us/bill  "
+        f"peak {peak / 1024:10.1f} KiB  ({peak / BATCH_SIZE:8.1f} B/bill)"
+    )
+
+
+def main() -> None:
+    bills = make_bills(BATCH_SIZE)
+    print(f"{BATCH_SIZE} bills")
+    measure(
+        "before: build default CategoryItem",
+        lambda: [
+            CategoryItem(
+                transaction_type=TransactionType.EXPENSE,
+                l1_name="其它",
+                l1_desc="其它",
+                l2_name="其它",
+                l2_desc="其它",
+                match_rules=[],
+            )
+            for _ in bills
+        ],
+    )
+    measure("after: interned get_default_category", lambda: [category_helper.get_default_category() for _ in bills])
+    measure("before: model_dump_json per bill", lambda: [bill.model_dump_json() for bill in bills])
+    measure(
+        "before: json.dumps(model_dump) list",
+        lambda: json.dumps([bill.model_dump(mode="json") for bill in bills], ensure_ascii=False),
+    )
+    measure("after: dump_bill_json per bill", lambda: [dump_bill_json(bill) for bill in bills])
+    measure("after: dump_bills_json list", lambda: dump_bills_json(bills))
+    measure(
+        "validation: Bill.model_validate",
+        lambda: [Bill.model_validate(bill.__dict__) for bill in bills],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import asyncio
+import hashlib
+import math
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import StrEnum
+from logging import getLogger
+
+from .config import settings
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+# Smoothing factor of the service time moving average used to estimate throughput
+_EWMA_ALPHA = 0.2
+
+
+class Priority(StrEnum):
+    INTERACTIVE = "interactive"  # a user waiting for the answer, e.g. an AutoTasker call
+    BULK = "bulk"  # background synchronization of many screenshots
+
+
+DEFAULT_PRIORITY_WEIGHTS = {Priority.INTERACTIVE: 4.0, Priority.BULK: 1.0}
+
+
+@dataclass
+class KeyPolicy:
+    """
+    Scheduling policy of an API key. `name` labels the key in metrics, so the key itself is never
+    exported.
+    """
+
+    name: str
+    weight: float = 1.0  # share of the capacity relative to the other keys
+    max_in_flight: int = 0  # requests executing at once for this key, 0 for the global limit only
+    priority: Priority = Priority.INTERACTIVE  # class used when the request does not give one
+
+
+@dataclass
+class _Waiter:
+    key: str
+    priority: Priority
+    start_tag: float
+    finish_tag: float
+    seq: int
+    future: asyncio.Future = field(repr=False)
+
+
+class AdmissionRejectedError(Exception):
+    """
+    Raised when a request cannot be admitted, either because the wait queue is full or because it
+    waited longer than the queue timeout.
+    """
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(f"Server is overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    An admitted request. Releasing the ticket frees its slot for the next queued request, releasing
+    it more than once has no effect.
+    """
+
+    def __init__(self, controller: "AdmissionController", key: str, priority: Priority, wait_seconds: float) -> None:
+        self.controller = controller
+        self.key = key
+        self.priority = priority
+        self.wait_seconds = wait_seconds
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        service_seconds = time.monotonic() - self.started
+        labels = {"api_key": self.controller.policy(self.key).name, "priority": self.priority.value}
+        metrics.inc("api_key_requests_total", **labels)
+        metrics.observe("api_key_service_seconds", service_seconds, **labels)
+        metrics.observe("api_key_latency_seconds", self.wait_seconds + service_seconds, **labels)
+        self.controller._release(self.key, service_seconds)
+
+
+class AdmissionController:
+    """
+    Bounds the number of requests executing at once and shares the slots fairly between API keys.
+
+    Requests beyond `max_in_flight` wait in a bounded queue, for at most `queue_timeout_seconds`,
+    and the others are rejected with a retry delay estimated from the current throughput. Queued
+    requests are served by start-time fair queuing: each (key, priority class) flow gets a share of
+    the slots proportional to the key weight times the class weight, so a key bulk-syncing hundreds
+    of screenshots cannot starve the interactive calls of the other keys. Per-key caps bound the
+    slots and queue entries a single key can hold.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int | None = None,
+        max_queue: int | None = None,
+        queue_timeout_seconds: float | None = None,
+        max_queue_per_key: int | None = None,
+        key_policies: dict[str, KeyPolicy] | None = None,
+        priority_weights: dict[Priority, float] | None = None,
+    ) -> None:
+        self._max_in_flight = max_in_flight
+        self._max_queue = max_queue
+        self._queue_timeout_seconds = queue_timeout_seconds
+        self._max_queue_per_key = max_queue_per_key
+        self._key_policies = key_policies
+        self._priority_weights = priority_weights
+        self._initialized = False
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        admission_settings = settings.get("admission", {}) or {}
+        if self._max_in_flight is None:
+            self._max_in_flight = int(admission_settings.get("max_in_flight", 0))
+        if self._max_queue is None:
+            self._max_queue = int(admission_settings.get("max_queue", 32))
+        if self._queue_timeout_seconds is None:
+            self._queue_timeout_seconds = float(admission_settings.get("queue_timeout_seconds", 30))
+        if self._max_queue_per_key is None:
+            self._max_queue_per_key = int(admission_settings.get("max_queue_per_key", 0) or self._max_queue)
+        if self._key_policies is None:
+            self._key_policies = {
+                key_cfg["api_key"]: KeyPolicy(
+                    name=key_cfg.get("name") or _anonymous_name(key_cfg["api_key"]),
+                    weight=float(key_cfg.get("weight", 1.0)),
+                    max_in_flight=int(key_cfg.get("max_in_flight", 0)),
+                    priority=Priority(key_cfg.get("priority", Priority.INTERACTIVE)),
+                )
+                for key_cfg in admission_settings.get("keys", [])
+            }
+        if self._priority_weights is None:
+            weights_cfg = admission_settings.get("priority_weights", {}) or {}
+            self._priority_weights = {
+                priority: float(weights_cfg.get(priority.value, default))
+                for priority, default in DEFAULT_PRIORITY_WEIGHTS.items()
+            }
+        self.in_flight = 0
+        self.in_flight_by_key: dict[str, int] = defaultdict(int)
+        self.waiters: list[_Waiter] = []
+        self.service_seconds: float | None = None
+        self.virtual_time = 0.0
+        self.last_finish_tags: dict[tuple[str, Priority], float] = {}
+        self._seq = 0
+        self._initialized = True
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return bool(self._max_in_flight)
+
+    def policy(self, key: str) -> KeyPolicy:
+        self._initialize()
+        policy = self._key_policies.get(key)
+        if policy is None:
+            policy = self._key_policies[key] = KeyPolicy(name=_anonymous_name(key))
+        return policy
+
+    @property
+    def throughput(self) -> float:
+        """
+        Estimated completed requests per second when all slots are busy.
+        """
+        self._initialize()
+        service_seconds = self.service_seconds or 1.0
+        return self._max_in_flight / max(service_seconds, 1e-3)
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the queue ahead of a new request is expected to drain.
+        """
+        return max(1, math.ceil((len(self.waiters) + 1) / self.throughput))
+
+    async def acquire(self, key: str = "", priority: Priority | None = None) -> AdmissionTicket:
+        """
+        Wait for a free slot.
+
+        Args:
+            key (str): API key of the request, requests of the same key share its weight and caps.
+            priority (Priority | None): Priority class of the request, defaults to the key class.
+
+        Raises:
+            AdmissionRejectedError: If the queue is full or the queue timeout expires.
+        """
+        policy = self.policy(key)
+        priority = priority or policy.priority
+        start = time.monotonic()
+        if not self.enabled:
+            self._admit(key)
+        else:
+            waiter = self._enqueue(key, priority, policy)
+            self._dispatch()
+            if not waiter.future.done():
+                self._check_queue_limits(waiter)
+                try:
+                    await asyncio.wait_for(waiter.future, self._queue_timeout_seconds)
+                except TimeoutError:
+                    self._discard(waiter)
+                    self._reject("timeout", key)
+                except BaseException:
+                    if waiter.future.done() and not waiter.future.cancelled():
+                        # The slot was handed over just before the cancellation, pass it on
+                        self._release(key, None)
+                    else:
+                        self._discard(waiter)
+                    raise
+        wait_seconds = time.monotonic() - start
+        metrics.observe("admission_queue_wait_seconds", wait_seconds, api_key=policy.name, priority=priority.value)
+        self._report()
+        return AdmissionTicket(self, key, priority, wait_seconds)
+
+    @asynccontextmanager
+    async def slot(self, key: str = "", priority: Priority | None = None) -> AsyncIterator[AdmissionTicket]:
+        ticket = await self.acquire(key, priority)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _enqueue(self, key: str, priority: Priority, policy: KeyPolicy) -> _Waiter:
+        # Start-time fair queuing: a flow idle for a while restarts at the current virtual time, so
+        # it neither accumulates credit nor waits behind the backlog of busier flows
+        flow = (key, priority)
+        start_tag = max(self.virtual_time, self.last_finish_tags.get(flow, 0.0))
+        finish_tag = start_tag + 1.0 / (policy.weight * self._priority_weights[priority])
+        self.last_finish_tags[flow] = finish_tag
+        self._seq += 1
+        waiter = _Waiter(key, priority, start_tag, finish_tag, self._seq, asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        return waiter
+
+    def _check_queue_limits(self, waiter: _Waiter) -> None:
+        if len(self.waiters) > self._max_queue:
+            reason = "queue_full"
+        elif sum(1 for item in self.waiters if item.key == waiter.key) > self._max_queue_per_key:
+            reason = "key_queue_full"
+        else:
+            return
+        self._discard(waiter)
+        # The rejected request does not count against the flow share
+        flow = (waiter.key, waiter.priority)
+        if self.last_finish_tags.get(flow) == waiter.finish_tag:
+            self.last_finish_tags[flow] = waiter.start_tag
+        self._reject(reason, waiter.key)
+
+    def _dispatch(self) -> None:
+        """
+        Hand free slots to the queued requests with the smallest finish tags, skipping keys at
+        their concurrency cap.
+        """
+        while self.waiters and self.in_flight < self._max_in_flight:
+            eligible = [waiter for waiter in self.waiters if self._below_key_cap(waiter.key)]
+            if not eligible:
+                break
+            waiter = min(eligible, key=lambda item: (item.finish_tag, item.seq))
+            self.waiters.remove(waiter)
+            self.virtual_time = max(self.virtual_time, waiter.start_tag)
+            self._admit(waiter.key)
+            waiter.future.set_result(None)
+
+    def _below_key_cap(self, key: str) -> bool:
+        cap = self.policy(key).max_in_flight
+        return not cap or self.in_flight_by_key[key] < cap
+
+    def _admit(self, key: str) -> None:
+        self.in_flight += 1
+        self.in_flight_by_key[key] += 1
+
+    def _release(self, key: str, service_seconds: float | None) -> None:
+        if service_seconds is not None:
+            if self.service_seconds is None:
+                self.service_seconds = service_seconds
+            else:
+                self.service_seconds += _EWMA_ALPHA * (service_seconds - self.service_seconds)
+        self.in_flight -= 1
+        self.in_flight_by_key[key] -= 1
+        self._dispatch()
+        self._report()
+
+    def _discard(self, waiter: _Waiter) -> None:
+        waiter.future.cancel()
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+
+    def _reject(self, reason: str, key: str) -> None:
+        retry_after = self.retry_after()
+        name = self.policy(key).name
+        logger.warning(
+            f"Rejecting request of '{name}' ({reason}), {self.in_flight} in flight, {len(self.waiters)} queued"
+        )
+        metrics.inc("admission_rejected_total", reason=reason, api_key=name)
+        raise AdmissionRejectedError(reason, retry_after)
+
+    def _report(self) -> None:
+        metrics.set("admission_in_flight", self.in_flight)
+        metrics.set("admission_queue_length", len(self.waiters))
+        metrics.set("admission_throughput", self.throughput)
+        for key, count in self.in_flight_by_key.items():
+            metrics.set("api_key_in_flight", count, api_key=self.policy(key).name)
+
+
+def _anonymous_name(key: str) -> str:
+    return f"key-{hashlib.sha256(key.encode()).hexdigest()[:8]}" if key else "anonymous"
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,260 @@
+import asyncio
+import itertools
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import Any
+
+import httpx
+
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+STRATEGIES = ("least_outstanding", "ewma")
+
+
+class EndpointError(Exception):
+    """
+    Raised by a parser when an endpoint answers with an error of its own (overload, exhausted
+    quota) rather than of the request, so that the balancer counts it against the endpoint.
+    """
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """
+    Whether an error says something about the health of the endpoint: transport errors, 5xx and
+    429 statuses. Cancellations (e.g. an exhausted deadline) and errors caused by the request do not.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, EndpointError | httpx.TransportError)
+
+
+class Endpoint:
+    """
+    A serving instance (or a set of credentials with its own quota) of a provider, with the
+    statistics the balancer picks endpoints by.
+    """
+
+    def __init__(self, name: str, target: Any) -> None:
+        self.name = name
+        self.target = target
+        self.outstanding = 0
+        self.ewma_seconds: float | None = None
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probing = False
+        # Since the last readmission, to tell a recovered endpoint from a flapping one
+        self.readmitted_at: float | None = None
+        self.successes_since_readmission = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until > now or self.probing
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "name": self.name,
+            "outstanding": self.outstanding,
+            "ewma_seconds": self.ewma_seconds,
+            "ejected": self.is_ejected(now),
+        }
+
+
+class EndpointBalancer:
+    """
+    Spreads the requests of a parser over several endpoints.
+
+    Strategies:
+        - `least_outstanding`: the endpoint with the fewest requests in flight, ties broken in turn.
+        - `ewma`: the endpoint with the lowest latency EWMA weighted by its requests in flight
+          (peak EWMA), so that a slow instance receives less traffic before it is ejected.
+
+    An endpoint failing `failure_threshold` times in a row, or whose latency EWMA exceeds
+    `slow_seconds`, is ejected for `ejection_seconds`, doubled on each new ejection up to 8 times.
+    When the period is over, the endpoint is readmitted once `health_check` succeeds on it (at once
+    if there is no health check). The doubling starts over only once a readmitted endpoint has
+    served `recovery_successes` requests or stayed up `recovery_seconds`, so that an endpoint
+    flapping between a few successes and new failures is ejected for longer and longer. If every
+    endpoint is ejected, the one readmitted first is used anyway: failing open keeps the parser
+    usable when the ejections are caused by the requests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        endpoints: list[Endpoint],
+        strategy: str = "least_outstanding",
+        failure_threshold: int = 3,
+        ejection_seconds: float = 30,
+        slow_seconds: float | None = None,
+        ewma_alpha: float = 0.3,
+        health_check: Callable[[Any], Awaitable[None]] | None = None,
+        recovery_successes: int = 10,
+        recovery_seconds: float = 300,
+    ) -> None:
+        assert endpoints, f"{name} needs at least one endpoint"
+        assert strategy in STRATEGIES, f"Unknown balancing strategy '{strategy}', available: {STRATEGIES}"
+        self.name = name
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self.slow_seconds = slow_seconds
+        self.ewma_alpha = ewma_alpha
+        self.health_check = health_check
+        self.recovery_successes = recovery_successes
+        self.recovery_seconds = recovery_seconds
+        self._turn = itertools.count()
+        self._probes: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_settings(
+        cls,
+        name: str,
+        targets: list[tuple[str, Any]],
+        balancer_settings: dict | None,
+        health_check: Callable[[Any], Awaitable[None]] | None = None,
+    ) -> "EndpointBalancer":
+        """
+        Build a balancer from the `balancer` section of the settings of a parser.
+        """
+        balancer_settings = balancer_settings or {}
+        slow_seconds = balancer_settings.get("slow_seconds")
+        return cls(
+            name,
+            [Endpoint(endpoint_name, target) for endpoint_name, target in targets],
+            strategy=balancer_settings.get("strategy", "least_outstanding"),
+            failure_threshold=int(balancer_settings.get("failure_threshold", 3)),
+            ejection_seconds=float(balancer_settings.get("ejection_seconds", 30)),
+            slow_seconds=float(slow_seconds) if slow_seconds else None,
+            health_check=health_check,
+            recovery_successes=int(balancer_settings.get("recovery_successes", 10)),
+            recovery_seconds=float(balancer_settings.get("recovery_seconds", 300)),
+        )
+
+    def pick(self) -> Endpoint:
+        now = time.monotonic()
+        available = []
+        for endpoint in self.endpoints:
+            if endpoint.probing:
+                continue
+            if endpoint.ejected_until:
+                if endpoint.ejected_until > now:
+                    continue
+                self._readmit(endpoint)
+                if endpoint.probing:
+                    continue
+            available.append(endpoint)
+        if not available:
+            metrics.inc("endpoint_fail_open_total", parser=self.name)
+            return min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)
+        # Rotating the candidates breaks ties in turn instead of always favoring the first endpoint
+        offset = next(self._turn) % len(available)
+        rotated = available[offset:] + available[:offset]
+        if self.strategy == "ewma":
+            known = [endpoint.ewma_seconds for endpoint in available if endpoint.ewma_seconds is not None]
+            # Endpoints without latency yet are assumed as fast as the fastest one, so they get tried
+            default = min(known) if known else 0.0
+
+            def cost(endpoint: Endpoint) -> float:
+                ewma = endpoint.ewma_seconds if endpoint.ewma_seconds is not None else default
+                return ewma * (endpoint.outstanding + 1)
+
+            return min(rotated, key=cost)
+        return min(rotated, key=lambda endpoint: endpoint.outstanding)
+
+    @asynccontextmanager
+    async def request(self) -> AsyncIterator[Endpoint]:
+        """
+        Pick an endpoint for a request, and record the outcome and latency of the request.
+        """
+        endpoint = self.pick()
+        endpoint.outstanding += 1
+        metrics.set("endpoint_outstanding", endpoint.outstanding, parser=self.name, endpoint=endpoint.name)
+        start = time.perf_counter()
+        try:
+            yield endpoint
+        except BaseException as e:
+            if is_endpoint_failure(e):
+                self._record_failure(endpoint, e)
+            raise
+        else:
+            self._record_success(endpoint, time.perf_counter() - start)
+        finally:
+            endpoint.outstanding -= 1
+            metrics.set("endpoint_outstanding", endpoint.outstanding, parser=self.name, endpoint=endpoint.name)
+
+    def _record_success(self, endpoint: Endpoint, seconds: float) -> None:
+        endpoint.consecutive_failures = 0
+        if endpoint.readmitted_at is not None and not endpoint.is_ejected(time.monotonic()):
+            endpoint.successes_since_readmission += 1
+            if (
+                endpoint.successes_since_readmission >= self.recovery_successes
+                or time.monotonic() - endpoint.readmitted_at >= self.recovery_seconds
+            ):
+                endpoint.ejections = 0
+                endpoint.readmitted_at = None
+        if endpoint.ewma_seconds is None:
+            endpoint.ewma_seconds = seconds
+        else:
+            endpoint.ewma_seconds += self.ewma_alpha * (seconds - endpoint.ewma_seconds)
+        metrics.inc("endpoint_requests_total", parser=self.name, endpoint=endpoint.name, outcome="ok")
+        metrics.observe("endpoint_seconds", seconds, parser=self.name, endpoint=endpoint.name)
+        if self.slow_seconds is not None and endpoint.ewma_seconds > self.slow_seconds:
+            self._eject(endpoint, "slow", f"latency EWMA {endpoint.ewma_seconds:.2f}s")
+
+    def _record_failure(self, endpoint: Endpoint, error: BaseException) -> None:
+        endpoint.consecutive_failures += 1
+        metrics.inc("endpoint_requests_total", parser=self.name, endpoint=endpoint.name, outcome="error")
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            self._eject(endpoint, "failing", f"{endpoint.consecutive_failures} failures in a row, last: {error!r}")
+
+    def _eject(self, endpoint: Endpoint, reason: str, detail: str) -> None:
+        if endpoint.ejected_until > time.monotonic():
+            return
+        endpoint.ejections += 1
+        endpoint.readmitted_at = None
+        period = self.ejection_seconds * 2 ** min(endpoint.ejections - 1, 3)
+        endpoint.ejected_until = time.monotonic() + period
+        logger.warning(f"Ejecting endpoint {endpoint.name} of {self.name} for {period:.0f}s: {detail}")
+        metrics.inc("endpoint_ejections_total", parser=self.name, endpoint=endpoint.name, reason=reason)
+        metrics.set("endpoint_up", 0, parser=self.name, endpoint=endpoint.name)
+
+    def _readmit(self, endpoint: Endpoint) -> None:
+        if self.health_check is None:
+            self._restore(endpoint)
+            return
+        # The endpoint stays out of rotation until the probe answers
+        endpoint.probing = True
+        task = asyncio.create_task(self._probe(endpoint))
+        self._probes.add(task)
+        task.add_done_callback(self._probes.discard)
+
+    async def _probe(self, endpoint: Endpoint) -> None:
+        assert self.health_check is not None
+        try:
+            await self.health_check(endpoint.target)
+        except Exception as e:
+            endpoint.probing = False
+            endpoint.ejected_until = 0
+            self._eject(endpoint, "health_check", f"health check failed: {e!r}")
+            return
+        endpoint.probing = False
+        self._restore(endpoint)
+
+    def _restore(self, endpoint: Endpoint) -> None:
+        logger.info(f"Readmitting endpoint {endpoint.name} of {self.name}")
+        endpoint.ejected_until = 0
+        endpoint.consecutive_failures = 0
+        endpoint.readmitted_at = time.monotonic()
+        endpoint.successes_since_readmission = 0
+        # The latency that got the endpoint ejected is forgotten, it is measured again
+        endpoint.ewma_seconds = None
+        metrics.set("endpoint_up", 1, parser=self.name, endpoint=endpoint.name)
+
+    def snapshot(self) -> list[dict]:
+        now = time.monotonic()
+        return [endpoint.to_dict(now) for endpoint in self.endpoints]
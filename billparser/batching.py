@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any
+from weakref import WeakKeyDictionary
+
+from .config import settings
+from .deadline import deadline_scope, get_deadline
+from .metrics import metrics
+from .shadow import is_shadow_run
+from .token_budget import Degradation, current_degradation
+from .usage import TokenUsage, current_usage, split_usage, track_usage
+from .warmup import is_dry_run
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class _Pending:
+    input_data: Any
+    future: asyncio.Future
+    deadline: float | None
+    usage: TokenUsage | None
+    queued_at: float
+
+
+class MicroBatcher:
+    """
+    Coalesces the concurrent single-input calls of a parser providing `parse_batch` into batches:
+    a batch is dispatched once `max_size` inputs are waiting, or `window_seconds` after its first
+    input arrived. Each caller gets the result (or the exception) of its own input.
+
+    A batch runs in its own task, under the latest deadline of its callers: a caller whose deadline
+    passes stops waiting, the others are still served. Warm-up dry runs, shadow runs and requests
+    degraded by the token budget are never batched with live requests, they call `parse` directly:
+    the batch task runs in a fresh context, where their flags would be lost.
+    """
+
+    def __init__(self, parser: Any, max_size: int = 8, window_seconds: float = 0.01) -> None:
+        assert hasattr(parser, "parse_batch"), f"Parser '{parser.name}' does not support batch parsing"
+        self.parser = parser
+        self.max_size = max_size
+        self.window_seconds = window_seconds
+        self._pending: list[_Pending] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, input_data: Any) -> Any:
+        if is_dry_run() or is_shadow_run() or current_degradation() is not Degradation.NONE:
+            return await self.parser.parse(input_data)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(_Pending(input_data, future, get_deadline(), current_usage(), time.perf_counter()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # Callers cancelled while waiting for the window (e.g. their deadline passed) are dropped
+        batch = [item for item in batch if not item.future.done()]
+        if not batch:
+            return
+        deadlines = [item.deadline for item in batch]
+        deadline = None if None in deadlines else max(deadlines)
+        # A fresh context: the batch must not inherit the deadline of the caller that filled it
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch, deadline), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: list[_Pending], deadline: float | None):
+        name = self.parser.name
+        now = time.perf_counter()
+        metrics.observe("micro_batch_size", len(batch), parser=name)
+        for item in batch:
+            metrics.observe("micro_batch_wait_seconds", now - item.queued_at, parser=name)
+        futures = [item.future for item in batch]
+        try:
+            try:
+                with track_usage() as usage:
+                    async with deadline_scope(None if deadline is None else deadline - time.monotonic(), name):
+                        results = await self.parser.parse_batch([item.input_data for item in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            # The tokens of the batch are charged to its callers
+            split_usage(usage, [item.usage for item in batch])
+            if len(results) != len(batch):
+                error = ValueError(f"{name} returned {len(results)} results for a batch of {len(batch)}")
+                results = [error] * len(batch)
+            for future, result in zip(futures, results, strict=True):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            # Only reached with futures pending if the batch itself was cancelled
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+
+
+_batchers: WeakKeyDictionary[Any, MicroBatcher | None] = WeakKeyDictionary()
+
+
+def micro_batcher(parser: Any) -> MicroBatcher | None:
+    """
+    The dispatcher shared by every pipeline using the parser, None if the parser has no
+    `parse_batch` or no `micro_batch` settings.
+    """
+    try:
+        return _batchers[parser]
+    except (KeyError, TypeError):
+        pass
+    batcher = None
+    if hasattr(parser, "parse_batch"):
+        parser_settings = (settings.get("parsers") or {}).get(parser.name) or {}
+        batch_settings = parser_settings.get("micro_batch")
+        if batch_settings:
+            batcher = MicroBatcher(
+                parser,
+                max_size=int(batch_settings.get("max_size", 8)),
+                window_seconds=float(batch_settings.get("window_ms", 10)) / 1000,
+            )
+            logger.info(f"Micro-batching {parser.name}: up to {batcher.max_size} inputs per batch")
+    try:
+        _batchers[parser] = batcher
+    except TypeError:
+        # Not weakly referenceable (e.g. a test double), looked up again on the next call
+        pass
+    return batcher
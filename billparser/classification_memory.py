@@ -0,0 +1,371 @@
+import json
+import math
+import os
+import re
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from .config import ROOT_DIR, settings
+from .metrics import metrics
+from .models import Bill, RawText, TransactionType
+from .parsers.helpers import asset_helper, category_helper
+from .shadow import is_shadow_run
+from .warmup import is_dry_run
+
+logger = getLogger(__name__)
+
+# Digits are left out: amounts, times, order numbers and card tails differ on every receipt of a merchant
+_TOKEN_RUN_PATTERN = re.compile(r"[A-Za-z\u4e00-\u9fff]+")
+
+
+def tokenize(text: str, ngram: int = 2) -> frozenset[str]:
+    """
+    Character n-grams of the letter and CJK runs of an OCR text, lowercased.
+    """
+    tokens: set[str] = set()
+    for run in _TOKEN_RUN_PATTERN.findall(text.lower()):
+        if len(run) <= ngram:
+            tokens.add(run)
+            continue
+        tokens.update(run[i : i + ngram] for i in range(len(run) - ngram + 1))
+    return frozenset(tokens)
+
+
+@dataclass(frozen=True)
+class Classification:
+    """
+    The part of a bill the LLM infers from the merchant rather than reads from the receipt.
+    """
+
+    transaction_type: TransactionType
+    catename: str | None
+    accountname: str
+    accountname2: str | None = None
+
+    @classmethod
+    def from_bill(cls, bill: Bill) -> "Classification":
+        return cls(
+            transaction_type=bill.transaction_type,
+            catename=bill.catename.serialized_name if bill.catename else None,
+            accountname=bill.accountname.account_name,
+            accountname2=bill.accountname2.account_name if bill.accountname2 else None,
+        )
+
+    def is_configured(self) -> bool:
+        """
+        Whether the category and accounts still exist in the configuration.
+        """
+        category_helper._initialize()
+        asset_helper._initialize()
+        if self.catename is not None and self.catename not in category_helper.categories.get(self.transaction_type, {}):
+            return False
+        if self.transaction_type in (TransactionType.TRANSFER, TransactionType.CREDIT_CARD_REPAYMENT):
+            if self.accountname2 not in asset_helper.assets:
+                return False
+        return self.accountname in asset_helper.assets
+
+    def to_bill(self, amount: float, time: datetime | str, remark: str | None = None, fee: float | None = None) -> Bill:
+        return Bill(
+            transaction_type=self.transaction_type,
+            amount=amount,
+            time=time,
+            catename=category_helper.get_category(self.transaction_type, self.catename) if self.catename else None,
+            remark=remark,
+            accountname=asset_helper.get_asset(self.accountname),
+            accountname2=asset_helper.get_asset(self.accountname2) if self.accountname2 else None,
+            fee=fee,
+        )
+
+
+@dataclass(frozen=True)
+class MemoryMatch:
+    classification: Classification
+    confidence: float
+    support: int
+
+
+class ClassificationCorrection(BaseModel):
+    amount: float = Field(gt=0, description="Amount of the bill as it was returned")
+    time: datetime = Field(description="Time of the bill as it was returned")
+    transaction_type: TransactionType = Field(description="Corrected transaction type")
+    catename: str | None = Field(None, description="Corrected category name")
+    accountname: str = Field(description="Corrected account name")
+    accountname2: str | None = Field(None, description="Corrected second account name, for transfers")
+    text: str | None = Field(
+        None, description="Merchant or remark text to learn from when the bill is no longer remembered"
+    )
+
+    def to_classification(self) -> Classification:
+        return Classification(self.transaction_type, self.catename, self.accountname, self.accountname2)
+
+
+class _Exemplar:
+    __slots__ = ("labels", "tokens")
+
+    def __init__(self, tokens: frozenset[str]) -> None:
+        self.tokens = tokens
+        self.labels: Counter[Classification] = Counter()
+
+
+class ClassificationMemory:
+    """
+    Classifications (transaction type, category, accounts) of the bills produced so far, indexed by
+    the character bigrams of their OCR text. Receipts of a merchant share most of their text once
+    digits are removed, so a new receipt is classified by a vote of its nearest exemplars
+    (IDF-weighted Jaccard similarity, boilerplate such as "支付时间" weighs little).
+
+    A match is trusted when the exemplars above `min_similarity` agree on a classification by at
+    least `min_agreement` with at least `min_support` bills behind it. The LLM parsers then only
+    ask the model for the amount and time, with a prompt free of the category and asset lists.
+
+    A correction replaces the labels of the exemplar of the corrected bill with the corrected
+    classification, weighted like `correction_weight` bills.
+
+    The memory is shared by all API keys, on purpose: the service keeps the books of one owner, whose
+    keys (phone, sync client, ...) classify against the same categories.yaml and assets.yaml, and
+    whose bills share the duplicate index and the ledger. A merchant learned or corrected from one
+    key is the same merchant on the others, and partitioning would split its support between them.
+    Keys of other people do not belong on the same service.
+    """
+
+    def __init__(
+        self,
+        enabled: bool | None = None,
+        min_similarity: float | None = None,
+        min_agreement: float | None = None,
+        min_support: int | None = None,
+        max_entries: int | None = None,
+        correction_weight: int | None = None,
+        local_extraction: bool | None = None,
+        path: Path | str | None = None,
+    ) -> None:
+        self._enabled = enabled
+        self._min_similarity = min_similarity
+        self._min_agreement = min_agreement
+        self._min_support = min_support
+        self._max_entries = max_entries
+        self._correction_weight = correction_weight
+        self._local_extraction = local_extraction
+        self._path = Path(path) if path is not None else None
+        self._initialized = False
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        memory_settings = settings.get("classification_memory", {}) or {}
+        if self._enabled is None:
+            self._enabled = bool(memory_settings.get("enabled", False))
+        if self._min_similarity is None:
+            self._min_similarity = float(memory_settings.get("min_similarity", 0.5))
+        if self._min_agreement is None:
+            self._min_agreement = float(memory_settings.get("min_agreement", 0.9))
+        if self._min_support is None:
+            self._min_support = int(memory_settings.get("min_support", 2))
+        if self._max_entries is None:
+            self._max_entries = int(memory_settings.get("max_entries", 5000))
+        if self._correction_weight is None:
+            self._correction_weight = int(memory_settings.get("correction_weight", 3))
+        if self._local_extraction is None:
+            self._local_extraction = bool(memory_settings.get("local_extraction", False))
+        if self._path is None and memory_settings.get("path"):
+            path = Path(memory_settings["path"])
+            self._path = path if path.is_absolute() else ROOT_DIR / path
+        self.exemplars: OrderedDict[frozenset[str], _Exemplar] = OrderedDict()
+        self.postings: dict[str, set[frozenset[str]]] = {}
+        # Tokens of the recently learned bills, by amount and time, so that a correction sent with
+        # the bill as it was returned finds the text it was parsed from
+        self.recent: OrderedDict[tuple[int, datetime], frozenset[str]] = OrderedDict()
+        self._initialized = True
+        if self._enabled and self._path is not None and self._path.exists():
+            self.load(self._path)
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return bool(self._enabled)
+
+    @property
+    def local_extraction(self) -> bool:
+        """Whether a bill whose text holds a single amount and time is built without the LLM."""
+        self._initialize()
+        return bool(self._local_extraction)
+
+    def _weight(self, token: str) -> float:
+        postings = self.postings.get(token)
+        return math.log(1 + len(self.exemplars) / (len(postings) if postings else 1))
+
+    def _neighbors(self, tokens: frozenset[str]) -> list[tuple[_Exemplar, float]]:
+        """
+        Exemplars whose weighted Jaccard similarity with the tokens reaches `min_similarity`.
+        """
+        weights = {token: self._weight(token) for token in tokens}
+        total = sum(weights.values())
+        # An exemplar can only reach the threshold if it shares this much weight with the tokens
+        threshold = self._min_similarity * total
+        shared: dict[frozenset[str], float] = {}
+        remaining = total
+        # Rare tokens first: once the weight left cannot bring a new exemplar to the threshold, the
+        # postings of the common (boilerplate) tokens are no longer walked, only the candidates checked
+        for token in sorted(tokens, key=weights.__getitem__, reverse=True):
+            weight = weights[token]
+            if remaining >= threshold:
+                for key in self.postings.get(token, ()):
+                    shared[key] = shared.get(key, 0.0) + weight
+            else:
+                for key in shared:
+                    if token in key:
+                        shared[key] += weight
+            remaining -= weight
+        neighbors = []
+        for key, shared_weight in shared.items():
+            if shared_weight < threshold:
+                continue
+            union = total + sum(self._weight(token) for token in key) - shared_weight
+            similarity = shared_weight / union if union else 0.0
+            if similarity >= self._min_similarity:
+                neighbors.append((self.exemplars[key], similarity))
+        return neighbors
+
+    def match(self, raw_text: RawText) -> MemoryMatch | None:
+        """
+        Classify an OCR text from the memory.
+
+        Returns:
+            MemoryMatch | None: The classification voted by the nearest exemplars, None if the memory
+            is disabled or the vote is not trusted.
+        """
+        if not self.enabled or not self.exemplars:
+            return None
+        match, outcome = self._vote(tokenize(raw_text))
+        metrics.inc("classification_memory_lookups_total", outcome=outcome)
+        return match
+
+    def _vote(self, tokens: frozenset[str]) -> tuple[MemoryMatch | None, str]:
+        votes: Counter[Classification] = Counter()
+        support: Counter[Classification] = Counter()
+        best_similarity: dict[Classification, float] = {}
+        for exemplar, similarity in self._neighbors(tokens):
+            for label, count in exemplar.labels.items():
+                votes[label] += similarity * count
+                support[label] += count
+                best_similarity[label] = max(best_similarity.get(label, 0.0), similarity)
+        if not votes:
+            return None, "miss"
+        label, score = votes.most_common(1)[0]
+        agreement = score / sum(votes.values())
+        if agreement < self._min_agreement or support[label] < self._min_support:
+            return None, "untrusted"
+        if not label.is_configured():
+            return None, "stale"
+        return MemoryMatch(label, agreement * best_similarity[label], support[label]), "hit"
+
+    def learn(self, bill: Bill, raw_text: RawText) -> None:
+        """
+        Learn the classification of a produced bill. Bills the memory would have classified the same
+        way with confidence add nothing, so that bills classified by the memory do not reinforce it.
+        """
+        if not self.enabled or bill.is_duplicate or is_dry_run() or is_shadow_run():
+            return
+        tokens = tokenize(raw_text)
+        if not tokens:
+            return
+        self._remember(bill.amount, bill.time, tokens)
+        label = Classification.from_bill(bill)
+        # Not a lookup: left out of classification_memory_lookups_total
+        known, _ = self._vote(tokens)
+        if known is not None and known.classification == label:
+            return
+        self._exemplar(tokens).labels[label] += 1
+        metrics.set("classification_memory_entries", len(self.exemplars))
+
+    def correct(self, correction: ClassificationCorrection) -> bool:
+        """
+        Apply a user correction to the exemplar of the corrected bill, found by its amount and time
+        among the recently learned bills, or built from the text of the correction.
+
+        Returns:
+            bool: False if the bill is not remembered and the correction has no text.
+        """
+        self._initialize()
+        tokens = self.recent.get((round(correction.amount * 100), correction.time))
+        if tokens is None and correction.text:
+            tokens = tokenize(correction.text)
+        if not tokens:
+            return False
+        exemplar = self._exemplar(tokens)
+        exemplar.labels = Counter({correction.to_classification(): self._correction_weight})
+        metrics.inc("classification_memory_corrections_total")
+        return True
+
+    def _remember(self, amount: float, time: datetime, tokens: frozenset[str]) -> None:
+        self.recent[(round(amount * 100), time)] = tokens
+        while len(self.recent) > self._max_entries:
+            self.recent.popitem(last=False)
+
+    def _exemplar(self, tokens: frozenset[str]) -> _Exemplar:
+        exemplar = self.exemplars.get(tokens)
+        if exemplar is None:
+            exemplar = self.exemplars[tokens] = _Exemplar(tokens)
+            for token in tokens:
+                self.postings.setdefault(token, set()).add(tokens)
+            while len(self.exemplars) > self._max_entries:
+                evicted, _ = self.exemplars.popitem(last=False)
+                for token in evicted:
+                    postings = self.postings[token]
+                    postings.discard(evicted)
+                    if not postings:
+                        del self.postings[token]
+        self.exemplars.move_to_end(tokens)
+        return exemplar
+
+    def save(self, path: Path | None = None) -> None:
+        """
+        Write the exemplars to `path` (the configured path by default) as JSON.
+        """
+        self._initialize()
+        path = path or self._path
+        if path is None or not self._enabled:
+            return
+        data = [
+            {
+                "tokens": sorted(exemplar.tokens),
+                "labels": [
+                    [label.transaction_type, label.catename, label.accountname, label.accountname2, count]
+                    for label, count in exemplar.labels.items()
+                ],
+            }
+            for exemplar in self.exemplars.values()
+        ]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(data)} classification exemplars to {path}")
+
+    def load(self, path: Path) -> None:
+        self._initialize()
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load the classification memory from {path}: {e}")
+            return
+        for item in data:
+            exemplar = self._exemplar(frozenset(item["tokens"]))
+            for transaction_type, catename, accountname, accountname2, count in item["labels"]:
+                label = Classification(TransactionType(transaction_type), catename, accountname, accountname2)
+                exemplar.labels[label] += count
+        logger.info(f"Loaded {len(data)} classification exemplars from {path}")
+
+    def clear(self) -> None:
+        self._initialize()
+        self.exemplars.clear()
+        self.postings.clear()
+        self.recent.clear()
+
+
+classification_memory = ClassificationMemory()
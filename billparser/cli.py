@@ -1,12 +1,16 @@
 import asyncio
+from collections.abc import AsyncIterator, Awaitable, Iterator
+from contextlib import contextmanager
 from pathlib import Path
 
 import typer
 import uvicorn
 
-from .models import Bill, RawImage
+from .models import Bill, BillList, ParserOutput, raw_file_input
 
 app = typer.Typer(help="BillParser 命令行工具")
+config_app = typer.Typer(help="配置管理")
+app.add_typer(config_app, name="config")
 
 
 @app.command()
@@ -30,6 +34,8 @@ def serve(
 def parse_file(
     filepath: Path = typer.Argument(..., help="图片或文本文件的路径", exists=True),
     pipeline: str = typer.Option("ocr_then_llm", help="使用的流水线名称"),
+    profile: Path | None = typer.Option(None, help="性能分析输出路径 (写入 .prof/.html 与 tracemalloc 摘要 .txt)"),
+    profile_engine: str = typer.Option("cprofile", help="性能分析引擎: cprofile/pyinstrument"),
 ):
     """
     解析单个文件 (支持本地图片测试)
@@ -41,29 +47,269 @@ def parse_file(
     assert pipeline_instance is not None, f"Pipeline '{pipeline}' not found"
 
     # 简单的文件类型判断
-    initial_type = RawImage
     with open(filepath, "rb") as f:
         data = f.read()
 
     try:
-        result = asyncio.run(pipeline_instance.run(initial_type(data)))
-        assert isinstance(result, Bill), "解析结果不是 Bill 类型"
-        typer.secho("Parsed Bill:", fg=typer.colors.GREEN)
-        typer.echo(result.model_dump_json(indent=4, ensure_ascii=False))
+        with _profiled(profile, profile_engine):
+            result = asyncio.run(_closing(pipeline_instance.run(raw_file_input(data))))
+        bills = result if isinstance(result, BillList) else [result]
+        for bill in bills:
+            assert isinstance(bill, Bill), "解析结果不是 Bill 类型"
+            typer.secho("Parsed Bill:", fg=typer.colors.GREEN)
+            typer.echo(bill.model_dump_json(indent=4, ensure_ascii=False))
 
     except Exception as e:
         typer.secho(f"Error: {e}", fg=typer.colors.RED)
 
 
+async def _closing[T](coroutine: Awaitable[T]) -> T:
+    """
+    Run a command coroutine, then release the worker processes and connections of the parsers.
+    """
+    from .parsers.manager import parser_manager
+
+    try:
+        return await coroutine
+    finally:
+        await parser_manager.aclose()
+
+
+@contextmanager
+def _profiled(profile: Path | None, engine: str) -> Iterator[None]:
+    if profile is None:
+        yield
+        return
+    from .profiling import profile_run
+
+    with profile_run(profile, engine):
+        yield
+    typer.echo(f"Profile written to {profile.parent}")
+
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".pdf"}
+
+
+async def _iter_folder_bills(
+    files: list[Path], pipeline_name: str, concurrency: int, batch_size: int
+) -> AsyncIterator[Bill]:
+    """
+    Run the pipeline on batches of `batch_size` files with at most `concurrency` batches in
+    flight, yielding bills in completion order. Failed files are reported and skipped.
+    """
+    from billparser.pipeline import pipeline_manager
+
+    pipeline_instance = pipeline_manager.get_pipeline(pipeline_name)
+    assert pipeline_instance is not None, f"Pipeline '{pipeline_name}' not found"
+
+    async def run_chunk(chunk: list[Path]) -> list[ParserOutput | Exception]:
+        if len(chunk) == 1:
+            try:
+                return [await pipeline_instance.run(raw_file_input(chunk[0].read_bytes()))]
+            except Exception as e:
+                return [e]
+        return await pipeline_instance.run_batch([raw_file_input(filepath.read_bytes()) for filepath in chunk])
+
+    chunks = iter([files[i : i + batch_size] for i in range(0, len(files), batch_size)])
+    pending: dict[asyncio.Task, list[Path]] = {}
+    while True:
+        for chunk in chunks:
+            pending[asyncio.create_task(run_chunk(chunk))] = chunk
+            if len(pending) >= concurrency:
+                break
+        if not pending:
+            return
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            chunk = pending.pop(task)
+            for filepath, result in zip(chunk, task.result(), strict=True):
+                if isinstance(result, BillList):
+                    for bill in result:
+                        yield bill
+                    continue
+                if not isinstance(result, Bill):
+                    typer.secho(f"Error processing {filepath}: {result}", fg=typer.colors.RED)
+                    continue
+                yield result
+
+
 @app.command()
 def process_folder(
     folder: Path = typer.Argument(..., help="文件夹路径", exists=True, file_okay=False),
-    output: Path = typer.Option(Path("output.csv"), help="导出 CSV 路径"),
+    output: Path = typer.Option(
+        Path("output.csv"),
+        help="导出路径，格式由后缀推断 (.csv/.jsonl/.parquet/.qianji.csv)",  # noqa: RUF001
+    ),
+    export_format: str | None = typer.Option(None, "--format", help="导出格式: csv/jsonl/parquet/qianji"),
+    pipeline: str = typer.Option("ocr_then_llm", help="使用的流水线名称"),
+    concurrency: int = typer.Option(4, help="同时处理的批次数"),
+    batch_size: int = typer.Option(1, help="每批文件数，大于 1 时 LLM 在一次请求中解析整批账单"),  # noqa: RUF001
+    profile: Path | None = typer.Option(None, help="性能分析输出路径 (写入 .prof/.html 与 tracemalloc 摘要 .txt)"),
+    profile_engine: str = typer.Option("cprofile", help="性能分析引擎: cprofile/pyinstrument"),
 ):
     """
-    (Placeholder) 批量处理文件夹中的图片并导出
+    批量处理文件夹中的图片并导出
     """
-    typer.echo(f"TODO: Scanning folder {folder} and exporting to {output}")
+    from .export import get_exporter
+
+    files = sorted(path for path in folder.rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES)
+    typer.echo(f"Processing {len(files)} files in {folder}, exporting to {output}")
+    exporter = get_exporter(output, export_format)
+    with _profiled(profile, profile_engine):
+        count = asyncio.run(_closing(exporter.export(_iter_folder_bills(files, pipeline, concurrency, batch_size))))
+    typer.secho(f"Exported {count} bills to {output}", fg=typer.colors.GREEN)
+
+
+def _start_mock_providers(
+    host: str, port: int, ocr_latency: str, llm_latency: str, ocr_error_rate: float, llm_error_rate: float
+):
+    from .loadtest import BackgroundServer, LatencyDistribution, MockProviders, create_mock_app, mock_env
+
+    mock = MockProviders(
+        ocr_latency=LatencyDistribution.parse(ocr_latency),
+        llm_latency=LatencyDistribution.parse(llm_latency),
+        ocr_error_rate=ocr_error_rate,
+        llm_error_rate=llm_error_rate,
+    )
+    server = BackgroundServer(create_mock_app(mock), host, port)
+    server.start()
+    typer.echo(f"Mock providers listening on http://{host}:{port}, start the server with:")
+    for key, value in mock_env(f"http://{host}:{port}").items():
+        typer.echo(f"  export {key}={value}")
+    return server
+
+
+MOCK_HELP = "模拟服务商延迟分布: 0.2 / uniform:a,b / normal:mean,std / lognormal:median,sigma / exp:mean"
+
+
+@app.command()
+def mock_providers(
+    host: str = typer.Option("127.0.0.1", help="模拟服务监听地址"),
+    port: int = typer.Option(9100, help="模拟服务端口"),
+    ocr_latency: str = typer.Option("lognormal:0.3,0.4", help=MOCK_HELP),
+    llm_latency: str = typer.Option("lognormal:1.5,0.3", help=MOCK_HELP),
+    ocr_error_rate: float = typer.Option(0.0, help="OCR 请求返回 500 的比例"),
+    llm_error_rate: float = typer.Option(0.0, help="LLM 请求返回 500 的比例"),
+):
+    """
+    启动模拟 OCR (PP-OCR 接口) 与 LLM (OpenAI 兼容接口) 服务, 用于压测
+    """
+    import time
+
+    server = _start_mock_providers(host, port, ocr_latency, llm_latency, ocr_error_rate, llm_error_rate)
+    try:
+        while server.thread.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+@app.command()
+def loadtest(
+    url: str = typer.Option("http://127.0.0.1:8878", help="被测服务地址"),
+    api_key: str = typer.Option(..., envvar="BILLPARSER_LOADTEST_API_KEY", help="被测服务的 API Key"),
+    images: Path | None = typer.Option(None, help="录制的截图文件或文件夹, 默认生成随机图片", exists=True),
+    pipeline: str = typer.Option("ocr_then_llm", help="使用的流水线名称"),
+    mode: str = typer.Option("closed", help="closed: 固定并发 / open: 固定到达速率"),
+    concurrency: int = typer.Option(8, help="闭环模式的并发数"),
+    rate: float = typer.Option(10.0, help="开环模式每秒请求数"),
+    duration: float = typer.Option(30.0, help="压测时长 (秒)"),
+    max_outstanding: int = typer.Option(1000, help="开环模式最大在途请求数, 超出的请求记为 client_saturated"),
+    timeout: float = typer.Option(60.0, help="单个请求超时 (秒)"),
+    sample_interval: float = typer.Option(1.0, help="统计与服务端 RSS 采样间隔 (秒)"),
+    output: Path | None = typer.Option(None, help="JSON 报告输出路径"),
+    mock: bool = typer.Option(False, help="压测期间启动模拟 OCR/LLM 服务"),
+    mock_host: str = typer.Option("127.0.0.1", help="模拟服务监听地址"),
+    mock_port: int = typer.Option(9100, help="模拟服务端口"),
+    ocr_latency: str = typer.Option("lognormal:0.3,0.4", help=MOCK_HELP),
+    llm_latency: str = typer.Option("lognormal:1.5,0.3", help=MOCK_HELP),
+    ocr_error_rate: float = typer.Option(0.0, help="OCR 请求返回 500 的比例"),
+    llm_error_rate: float = typer.Option(0.0, help="LLM 请求返回 500 的比例"),
+):
+    """
+    对运行中的 /parse_image 压测, 报告吞吐量、延迟分位数、错误分布与服务端内存
+    """
+    import json
+
+    from .loadtest import LoadConfig, LoadGenerator, format_report
+
+    recorded: list[bytes] = []
+    if images is not None:
+        files = [images] if images.is_file() else sorted(images.rglob("*"))
+        recorded = [path.read_bytes() for path in files if path.suffix.lower() in IMAGE_SUFFIXES]
+        assert recorded, f"No images found in {images}"
+    config = LoadConfig(
+        url=url,
+        api_key=api_key,
+        images=recorded,
+        pipeline=pipeline,
+        mode=mode,
+        concurrency=concurrency,
+        rate=rate,
+        duration=duration,
+        max_outstanding=max_outstanding,
+        timeout=timeout,
+        sample_interval=sample_interval,
+    )
+    server = None
+    if mock:
+        server = _start_mock_providers(mock_host, mock_port, ocr_latency, llm_latency, ocr_error_rate, llm_error_rate)
+    try:
+        typer.echo(f"Running a {duration:g}s {mode}-loop load test against {url}")
+        report = asyncio.run(LoadGenerator(config).run()).to_dict()
+    finally:
+        if server is not None:
+            server.stop()
+    typer.echo(format_report(report))
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        typer.secho(f"Report written to {output}", fg=typer.colors.GREEN)
+
+
+@config_app.command("compile")
+def compile_config(
+    output: Path | None = typer.Option(None, help="快照路径 (默认: settings.yaml 中的 config_snapshot.path)"),
+    check: bool = typer.Option(False, help="仅校验配置, 不写入快照"),
+):
+    """
+    校验配置并编译为二进制快照, 服务启动时直接加载
+    """
+    import time
+
+    from .compiled_config import ConfigError, read_snapshot, write_snapshot
+    from .compiled_config import compile_config as compile_settings
+    from .config import SNAPSHOT_PATH
+
+    start = time.perf_counter()
+    try:
+        compiled = compile_settings()
+    except ConfigError as e:
+        typer.secho(str(e), fg=typer.colors.RED)
+        raise typer.Exit(code=1) from e
+    for warning in compiled.warnings:
+        typer.secho(f"Warning: {warning}", fg=typer.colors.YELLOW)
+    n_categories = sum(len(categories) for categories in compiled.categories.values())
+    typer.echo(
+        f"Validated {n_categories} categories and {len(compiled.assets)} assets "
+        f"from {len(compiled.sources)} files in {time.perf_counter() - start:.3f}s"
+    )
+    if check:
+        return
+    output = output or SNAPSHOT_PATH
+    write_snapshot(compiled, output)
+    if output.resolve() != SNAPSHOT_PATH.resolve():
+        typer.secho(
+            f"Warning: the service loads {SNAPSHOT_PATH}, set config_snapshot.path to {output} to use this snapshot",
+            fg=typer.colors.YELLOW,
+        )
+    start = time.perf_counter()
+    read_snapshot(output)
+    typer.secho(
+        f"Snapshot written to {output}, loads in {(time.perf_counter() - start) * 1000:.1f}ms",
+        fg=typer.colors.GREEN,
+    )
 
 
 if __name__ == "__main__":
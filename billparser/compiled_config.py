@@ -0,0 +1,261 @@
+import os
+import pickle
+from dataclasses import dataclass, field
+from logging import getLogger
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import pydantic
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from . import config
+from .models import AssetItem, CategoryItem, TransactionType
+
+if TYPE_CHECKING:
+    from .parsers.helpers import LexicalIndex
+
+logger = getLogger(__name__)
+
+# Bumped whenever the layout of CompiledConfig changes, older snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+
+class ConfigError(ValueError):
+    """
+    Raised when the configuration does not validate, listing every problem found.
+    """
+
+    def __init__(self, errors: list[str]) -> None:
+        super().__init__("Invalid configuration:\n" + "\n".join(f"- {error}" for error in errors))
+        self.errors = errors
+
+
+class _StrictModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class CategoryL2Config(_StrictModel):
+    l2_name: str
+    description: str = ""
+    match_rules: list[str] = Field(default_factory=list)
+
+
+class CategoryL1Config(_StrictModel):
+    l1_name: str
+    description: str = ""
+    match_rules: list[str] = Field(default_factory=list)
+    items: list[CategoryL2Config] = Field(default_factory=list)
+
+
+class CategoryGroupConfig(_StrictModel):
+    transaction_type: TransactionType
+    items: list[CategoryL1Config] = Field(default_factory=list)
+
+
+class AssetConfig(_StrictModel):
+    account_name: str
+    description: str = ""
+    match_rules: list[str] = Field(default_factory=list)
+
+
+class PipelineConfig(BaseModel):
+    steps: list[str | dict[str, Any]]
+    timeout_seconds: float | None = None
+    ledger: bool = True
+
+
+@dataclass
+class CompiledConfig:
+    """
+    The validated categories and assets with their derived lookup indexes, as used by the helpers.
+    """
+
+    categories: dict[TransactionType, dict[str, CategoryItem]]
+    assets: dict[str, AssetItem]
+    category_index: "LexicalIndex"
+    asset_index: "LexicalIndex"
+    sources: dict[str, int]  # Source YAML path -> mtime in nanoseconds
+    # Problems that do not block the categories and assets, e.g. a pipeline naming an unknown parser
+    warnings: list[str] = field(default_factory=list)
+    version: int = SNAPSHOT_VERSION
+    pydantic_version: str = pydantic.VERSION
+
+
+def source_mtimes(files: list[str] | None = None) -> dict[str, int]:
+    files = config.to_load_yaml_files if files is None else files
+    return {file: os.stat(file).st_mtime_ns for file in sorted(files)}
+
+
+def _validate(section: str, model: type[BaseModel], items: Any, errors: list[str]) -> list:
+    if items is None:
+        errors.append(f"{section}: section not found")
+        return []
+    validated = []
+    for idx, item in enumerate(items):
+        try:
+            validated.append(model.model_validate(item))
+        except ValidationError as e:
+            for error in e.errors():
+                location = ".".join(str(part) for part in error["loc"])
+                errors.append(f"{section}[{idx}].{location}: {error['msg']}")
+    return validated
+
+
+def compile_config(settings: Any = None, sources: dict[str, int] | None = None) -> CompiledConfig:
+    """
+    Validate the categories, assets and pipelines of the settings into typed models, and build the
+    lookup indexes of the categories and assets.
+
+    Invalid pipelines are only reported as warnings: the pipeline manager skips them, and they must
+    not keep the helpers from loading the categories and assets every other pipeline uses.
+
+    Raises:
+        ConfigError: If the categories or assets are invalid.
+    """
+    # Imported here: the helpers load the compiled configuration
+    from .parsers.helpers import CategoryHelper, LexicalIndex
+
+    settings = config.settings if settings is None else settings
+    errors: list[str] = []
+    warnings: list[str] = []
+
+    categories: dict[TransactionType, dict[str, CategoryItem]] = {}
+    for group in _validate("categories", CategoryGroupConfig, settings.get("categories"), errors):
+        group_categories = categories.setdefault(group.transaction_type, {})
+        for l1_item in group.items:
+            l2_items = l1_item.items or [None]
+            for l2_item in l2_items:
+                name = l2_item.l2_name if l2_item else l1_item.l1_name
+                if name in group_categories:
+                    errors.append(f"categories: duplicate category '{name}' for '{group.transaction_type}'")
+                group_categories[name] = CategoryItem(
+                    transaction_type=group.transaction_type,
+                    l1_name=l1_item.l1_name,
+                    l1_desc=l1_item.description,
+                    l2_name=l2_item.l2_name if l2_item else None,
+                    l2_desc=l2_item.description if l2_item else None,
+                    match_rules=l2_item.match_rules if l2_item else l1_item.match_rules,
+                )
+
+    assets: dict[str, AssetItem] = {}
+    for asset in _validate("assets", AssetConfig, settings.get("assets"), errors):
+        if asset.account_name in assets:
+            errors.append(f"assets: duplicate account '{asset.account_name}'")
+        assets[asset.account_name] = AssetItem(
+            account_name=asset.account_name, account_desc=asset.description, match_rules=asset.match_rules
+        )
+
+    parser_names = {name.lower() for name in (settings.get("parsers") or {})}
+    for pipeline_name, pipeline_cfg in (settings.get("pipelines") or {}).items():
+        try:
+            pipeline = PipelineConfig.model_validate(pipeline_cfg)
+        except ValidationError as e:
+            warnings.extend(f"pipelines.{pipeline_name}: {error['msg']}" for error in e.errors())
+            continue
+        for step_name in _step_names(pipeline.steps):
+            if step_name.lower() not in parser_names:
+                warnings.append(f"pipelines.{pipeline_name}: parser '{step_name}' is not configured in parsers")
+    for warning in warnings:
+        logger.warning(f"Configuration: {warning}")
+
+    if errors:
+        raise ConfigError(errors)
+    category_index = LexicalIndex(
+        {
+            CategoryHelper._index_key(category.transaction_type, name): " ".join(
+                filter(None, [name, category.l1_name, category.l1_desc, category.l2_desc, *category.match_rules])
+            )
+            for group_categories in categories.values()
+            for name, category in group_categories.items()
+        }
+    )
+    asset_index = LexicalIndex(
+        {name: " ".join([name, asset.account_desc, *asset.match_rules]) for name, asset in assets.items()}
+    )
+    return CompiledConfig(
+        categories=categories,
+        assets=assets,
+        category_index=category_index,
+        asset_index=asset_index,
+        sources=source_mtimes() if sources is None else sources,
+        warnings=warnings,
+    )
+
+
+def _step_names(steps: list) -> list[str]:
+    names: list[str] = []
+    for step in steps:
+        if isinstance(step, str):
+            names.append(step)
+        elif isinstance(step, list):
+            names.extend(_step_names(step))
+        elif isinstance(step, dict) and "parallel" in step:
+            names.extend(_step_names(step["parallel"]))
+    return names
+
+
+def write_snapshot(compiled: CompiledConfig, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("wb") as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Atomic replace, workers starting concurrently never read a partial snapshot
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: Path) -> CompiledConfig | None:
+    """
+    Read a snapshot, returning None if it is missing, unreadable or from another snapshot or
+    pydantic version.
+    """
+    try:
+        with path.open("rb") as f:
+            compiled = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable config snapshot {path}: {e}")
+        return None
+    if (
+        not isinstance(compiled, CompiledConfig)
+        or compiled.version != SNAPSHOT_VERSION
+        or compiled.pydantic_version != pydantic.VERSION
+    ):
+        logger.info(f"Ignoring config snapshot {path} from another version")
+        return None
+    return compiled
+
+
+_compiled: CompiledConfig | None = None
+
+
+def load_compiled_config() -> CompiledConfig:
+    """
+    Load the compiled configuration. When a snapshot was written by `billparser config compile`,
+    it is loaded as is while the source YAML files are unchanged, and rebuilt otherwise. Without a
+    snapshot, the configuration is compiled in memory.
+
+    Raises:
+        ConfigError: If the configuration is invalid.
+    """
+    global _compiled
+    if _compiled is not None:
+        return _compiled
+    path = config.SNAPSHOT_PATH
+    if not config.snapshot_enabled or not path.exists():
+        _compiled = compile_config()
+        return _compiled
+    sources = source_mtimes()
+    compiled = read_snapshot(path)
+    if compiled is not None and compiled.sources == sources:
+        logger.debug(f"Loaded config snapshot {path}")
+        _compiled = compiled
+        return _compiled
+    logger.info(f"Config files changed since {path} was compiled, rebuilding it")
+    compiled = compile_config(sources=sources)
+    try:
+        write_snapshot(compiled, path)
+    except OSError as e:
+        logger.warning(f"Could not write config snapshot {path}: {e}")
+    _compiled = compiled
+    return _compiled
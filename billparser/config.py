@@ -15,6 +15,20 @@ settings = Dynaconf(
 )
 
 
+def _snapshot_path(settings) -> Path:
+    """
+    Path of the config snapshot, `config_snapshot.path` relative to the project root.
+    """
+    path = Path((settings.get("config_snapshot", {}) or {}).get("path") or "config/.compiled/config.snapshot")
+    return path if path.is_absolute() else ROOT_DIR / path
+
+
+# Written by `billparser config compile`, see compiled_config.py
+SNAPSHOT_PATH = _snapshot_path(settings)
+snapshot_enabled = True
+
+
 def _set_settings_for_tests(new_settings: Dynaconf) -> None:
-    global settings
+    global settings, snapshot_enabled
     settings.update(new_settings)
+    snapshot_enabled = False
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from .metrics import metrics
+
+# Absolute deadline of the current request on the `time.monotonic` clock. Tasks created while it is
+# set (parallel branches, batches of a multi-bill parser) inherit it through their context copy.
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Raised when the budget of a request is exhausted, before starting a step or while it runs.
+    """
+
+
+def get_deadline() -> float | None:
+    return _deadline.get()
+
+
+def remaining() -> float | None:
+    """
+    Seconds left before the deadline of the current request, None without a deadline.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(step_name: str) -> None:
+    """
+    Raises:
+        DeadlineExceededError: If the deadline has passed, so that the step is not started.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.inc("deadline_exceeded_total", step=step_name)
+        raise DeadlineExceededError(f"Deadline exceeded before step '{step_name}' by {-left:.3f}s")
+
+
+def step_timeout(default: float | None) -> float | None:
+    """
+    Timeout of a provider call: the parser default, capped by the remaining budget.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    left = max(left, 0.0)
+    return left if default is None else min(default, left)
+
+
+@asynccontextmanager
+async def deadline_scope(timeout: float | None, step_name: str = "pipeline") -> AsyncIterator[None]:
+    """
+    Run the block under a deadline `timeout` seconds from now, or the deadline already in effect
+    if it is earlier. The block is cancelled as soon as the deadline passes.
+
+    Raises:
+        DeadlineExceededError: If the deadline passes while the block runs.
+    """
+    current = _deadline.get()
+    deadline = current
+    if timeout is not None:
+        deadline = time.monotonic() + timeout if current is None else min(current, time.monotonic() + timeout)
+    if deadline is None:
+        yield
+        return
+    token = _deadline.set(deadline)
+    try:
+        async with asyncio.timeout(deadline - time.monotonic()) as scope:
+            yield
+    except TimeoutError as e:
+        if scope.expired():
+            metrics.inc("deadline_exceeded_total", step=step_name)
+            raise DeadlineExceededError(f"Deadline exceeded during '{step_name}'") from e
+        raise
+    finally:
+        _deadline.reset(token)
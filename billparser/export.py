@@ -0,0 +1,205 @@
+import csv
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterable
+from logging import getLogger
+from pathlib import Path
+from typing import IO, Any, ClassVar
+
+from .models import Bill
+from .serialization import BILL_ADAPTER
+
+logger = getLogger(__name__)
+
+BILL_COLUMNS = [
+    "transaction_type",
+    "amount",
+    "time",
+    "catename",
+    "remark",
+    "accountname",
+    "accountname2",
+    "fee",
+    "is_duplicate",
+]
+
+
+def bill_to_row(bill: Bill) -> dict[str, Any]:
+    """
+    Convert a bill to a flat row. Categories and accounts are exported by name, following the
+    `Bill` field serializers.
+    """
+    return BILL_ADAPTER.dump_python(bill, mode="json")
+
+
+class BillExporter(ABC):
+    """
+    Base class of the bill exporters. Bills are consumed from an async iterator and written
+    incrementally, so memory does not grow with the number of exported bills.
+    """
+
+    format: str  # Unique name of the export format
+    suffix: str  # File suffix used to infer the format
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    async def export(self, bills: AsyncIterable[Bill]) -> int:
+        """
+        Export all bills of the iterator.
+
+        Returns:
+            int: Number of exported bills.
+        """
+        count = 0
+        self.open()
+        try:
+            async for bill in bills:
+                self.write(bill)
+                count += 1
+        finally:
+            self.close()
+        logger.info(f"Exported {count} bills to {self.path} ({self.format})")
+        return count
+
+    @abstractmethod
+    def open(self) -> None:
+        pass
+
+    @abstractmethod
+    def write(self, bill: Bill) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class CsvExporter(BillExporter):
+    format = "csv"
+    suffix = ".csv"
+    columns: ClassVar[list[str]] = BILL_COLUMNS
+
+    def open(self) -> None:
+        self._file: IO[str] = self.path.open("w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=self.columns)
+        self._writer.writeheader()
+
+    def write(self, bill: Bill) -> None:
+        self._writer.writerow(self.to_row(bill))
+
+    def to_row(self, bill: Bill) -> dict[str, Any]:
+        return bill_to_row(bill)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JsonlExporter(BillExporter):
+    format = "jsonl"
+    suffix = ".jsonl"
+
+    def open(self) -> None:
+        self._file: IO[bytes] = self.path.open("wb")
+
+    def write(self, bill: Bill) -> None:
+        self._file.write(BILL_ADAPTER.dump_json(bill))
+        self._file.write(b"\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class QianjiExporter(CsvExporter):
+    """
+    Exports bills in the 钱迹 bulk-import layout (see https://docs.qianjiapp.com/).
+    """
+
+    format = "qianji"
+    suffix = ".qianji.csv"
+    columns: ClassVar[list[str]] = ["时间", "分类", "二级分类", "类型", "金额", "账户1", "账户2", "备注", "手续费"]
+
+    def to_row(self, bill: Bill) -> dict[str, Any]:
+        return {
+            "时间": bill.time.strftime("%Y-%m-%d %H:%M:%S"),
+            "分类": bill.catename.l1_name if bill.catename else "",
+            "二级分类": (bill.catename.l2_name or "") if bill.catename else "",
+            "类型": bill.transaction_type.value,
+            "金额": bill.amount,
+            "账户1": bill.accountname.account_name,
+            "账户2": bill.accountname2.account_name if bill.accountname2 else "",
+            "备注": bill.remark or "",
+            "手续费": bill.fee if bill.fee is not None else "",
+        }
+
+
+class ParquetExporter(BillExporter):
+    """
+    Exports bills to Parquet, buffering at most one row group in memory. Requires pyarrow.
+    """
+
+    format = "parquet"
+    suffix = ".parquet"
+    row_group_size = 10000
+
+    def open(self) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet export requires pyarrow, install it with `uv pip install pyarrow`") from e
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                ("transaction_type", pa.string()),
+                ("amount", pa.float64()),
+                ("time", pa.timestamp("s")),
+                ("catename", pa.string()),
+                ("remark", pa.string()),
+                ("accountname", pa.string()),
+                ("accountname2", pa.string()),
+                ("fee", pa.float64()),
+                ("is_duplicate", pa.bool_()),
+            ]
+        )
+        self._writer = pq.ParquetWriter(self.path, self._schema)
+        self._rows: list[dict[str, Any]] = []
+
+    def write(self, bill: Bill) -> None:
+        row = BILL_ADAPTER.dump_python(bill)
+        row["transaction_type"] = bill.transaction_type.value
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+EXPORTERS: dict[str, type[BillExporter]] = {
+    exporter.format: exporter for exporter in (CsvExporter, JsonlExporter, QianjiExporter, ParquetExporter)
+}
+
+
+def get_exporter(path: Path, export_format: str | None = None) -> BillExporter:
+    """
+    Get an exporter for the path, inferring the format from the file suffix if not given.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if export_format is None:
+        for exporter_class in sorted(EXPORTERS.values(), key=lambda item: len(item.suffix), reverse=True):
+            if path.name.endswith(exporter_class.suffix):
+                export_format = exporter_class.format
+                break
+        else:
+            raise ValueError(f"Cannot infer export format from '{path.name}', available: {list(EXPORTERS)}")
+    if export_format not in EXPORTERS:
+        raise ValueError(f"Unknown export format '{export_format}', available: {list(EXPORTERS)}")
+    return EXPORTERS[export_format](path)
@@ -0,0 +1,243 @@
+import re
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from logging import getLogger
+
+from .classification_memory import tokenize
+from .config import settings
+from .models import Bill, RawText
+from .shadow import is_shadow_run
+from .warmup import is_dry_run
+
+logger = getLogger(__name__)
+
+_AMOUNT_PATTERN = re.compile(r"(?<![\d.])(\d{1,3}(?:,\d{3})+|\d+)\.(\d{2})(?![\d.])")
+_FULL_TIME_PATTERN = re.compile(
+    r"(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*日?\s*(\d{1,2}):(\d{2})(?::(\d{2}))?"
+)
+_SHORT_TIME_PATTERN = re.compile(r"(?<!\d)(\d{1,2})月(\d{1,2})日\s*(\d{1,2}):(\d{2})(?::(\d{2}))?")
+# Amounts that are not the one paid: list prices, discounts, fees broken out of the total
+_SECONDARY_AMOUNT_PATTERN = re.compile(
+    r"(原价|优惠|立减|满减|折扣|红包|抵扣|抵用|券|积分|运费|配送费|打包费|包装费|手续费)[^\n\d]{0,6}$"
+)
+# Amounts announced as the one paid: signed or with a currency, after a total label, or in yuan
+_MAIN_AMOUNT_PREFIX_PATTERN = re.compile(r"([-+¥￥]|实付款?|合计|支付金额|付款金额|交易金额|消费|人民币)\s*$")
+_MAIN_AMOUNT_SUFFIX_PATTERN = re.compile(r"\s*元")
+# Labels shared by the receipts of every merchant: their tokens do not tell two merchants apart
+_GENERIC_WORDS = (
+    "账单详情 交易成功 支付成功 当前状态 支付时间 交易时间 创建时间 付款方式 支付方式 商品说明 订单号 商家订单号 "
+    "交易单号 收款方全称 账单管理 账单分类 标签和备注 添加 计入收支 联系商家 申请电子回单 对此订单有疑问 支付奖励 "
+    "已领取 服务详情 进入小程序 实付款 合计 金额 原价 优惠 您账户 您的账户 于 在 消费 人民币 元 尾号 余额 "
+    "银行 信用卡 储蓄卡 微信支付 支付宝 零钱"
+)
+_GENERIC_TOKENS = frozenset().union(*(tokenize(word) for word in _GENERIC_WORDS.split()))
+_CARD_TAIL_PATTERNS = (
+    re.compile(r"[(（](\d{4})[)）]"),  # noqa: RUF001
+    re.compile(r"尾号\s*[:：]?\s*(\d{4})"),  # noqa: RUF001
+)
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    """
+    Cheap, locally extracted identity of a transaction.
+    """
+
+    amount_cents: int
+    time: datetime
+    card_tail: str | None = None
+    # Character bigrams naming the merchant or the goods, see `merchant_tokens`
+    tokens: frozenset[str] = frozenset()
+
+
+def extract_amounts(raw_text: str) -> list[int]:
+    """
+    Extract candidate amounts (in cents) from OCR text. Only values with two decimal places are
+    considered, so order numbers, dates and clocks are not mistaken for amounts.
+    """
+    amounts: list[int] = []
+    for match in _AMOUNT_PATTERN.finditer(raw_text):
+        cents = int(match.group(1).replace(",", "")) * 100 + int(match.group(2))
+        if cents > 0 and cents not in amounts:
+            amounts.append(cents)
+    return amounts
+
+
+def extract_main_amount(raw_text: str) -> int | None:
+    """
+    Extract the amount paid (in cents) from OCR text: the first amount that is signed, has a
+    currency or follows a total label, else the first amount. List prices, discounts and fees
+    ("原价 25.00", "优惠 3.00") are never picked.
+    """
+    fallback: int | None = None
+    for match in _AMOUNT_PATTERN.finditer(raw_text):
+        cents = int(match.group(1).replace(",", "")) * 100 + int(match.group(2))
+        before = raw_text[max(0, match.start() - 12) : match.start()]
+        if cents <= 0 or _SECONDARY_AMOUNT_PATTERN.search(before):
+            continue
+        if _MAIN_AMOUNT_PREFIX_PATTERN.search(before) or _MAIN_AMOUNT_SUFFIX_PATTERN.match(raw_text, match.end()):
+            return cents
+        if fallback is None:
+            fallback = cents
+    return fallback
+
+
+def merchant_tokens(text: str) -> frozenset[str]:
+    """
+    Tokens of an OCR text (see `classification_memory.tokenize`) without the labels every receipt
+    has, so that what is left names the merchant or the goods.
+    """
+    return tokenize(text) - _GENERIC_TOKENS
+
+
+def extract_times(raw_text: str, now: datetime | None = None) -> list[datetime]:
+    """
+    Extract candidate transaction times from OCR text. Times without a year (e.g. bank SMS
+    "10月26日17:27") are assumed to be in the current year.
+    """
+    times: list[datetime] = []
+    for match in _FULL_TIME_PATTERN.finditer(raw_text):
+        year, month, day, hour, minute, second = match.groups()
+        try:
+            times.append(datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0)))
+        except ValueError:
+            continue
+    year = (now or datetime.now()).year
+    for match in _SHORT_TIME_PATTERN.finditer(raw_text):
+        month, day, hour, minute, second = match.groups()
+        try:
+            times.append(datetime(year, int(month), int(day), int(hour), int(minute), int(second or 0)))
+        except ValueError:
+            continue
+    return list(dict.fromkeys(times))
+
+
+def extract_card_tail(raw_text: str) -> str | None:
+    """
+    Extract the last four digits of the paying card, if present.
+    """
+    for pattern in _CARD_TAIL_PATTERNS:
+        match = pattern.search(raw_text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def extract_fingerprints(raw_text: RawText) -> list[Fingerprint]:
+    """
+    Extract the candidate fingerprints from OCR text: the amount paid at each candidate time.
+    """
+    amount = extract_main_amount(raw_text)
+    if amount is None:
+        return []
+    card_tail = extract_card_tail(raw_text)
+    tokens = merchant_tokens(raw_text)
+    return [Fingerprint(amount, time, card_tail, tokens) for time in extract_times(raw_text)]
+
+
+def fingerprint_bill(bill: Bill, raw_text: RawText | None = None) -> Fingerprint:
+    """
+    Build the fingerprint of a produced bill. The card tail is taken from the OCR text when
+    available, otherwise from the account description (e.g. "尾号 1564"). The merchant tokens
+    come from the OCR text and the remark, without those of the paying account, which every
+    bill paid with it shares.
+    """
+    card_tail = extract_card_tail(raw_text) if raw_text else None
+    if card_tail is None:
+        card_tail = extract_card_tail(bill.accountname.account_desc)
+    tokens = merchant_tokens(f"{raw_text or ''}\n{bill.remark or ''}") - tokenize(bill.accountname.account_name)
+    return Fingerprint(round(bill.amount * 100), bill.time, card_tail, tokens)
+
+
+class BillIndex:
+    """
+    In-memory store of previously produced bills, indexed by amount and matched by time within
+    a tolerance window. Used to skip the LLM for transactions that were already booked from a
+    different screenshot.
+
+    Only the amount paid of a text is matched, and the card tails must agree when both texts have
+    one. Otherwise the texts must also share a merchant token: a same amount a few minutes apart
+    is common between unrelated purchases.
+    """
+
+    def __init__(
+        self,
+        enabled: bool | None = None,
+        time_window_seconds: float | None = None,
+        max_entries: int | None = None,
+    ) -> None:
+        self._enabled = enabled
+        self._time_window_seconds = time_window_seconds
+        self._max_entries = max_entries
+        self._initialized = False
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        dedup_settings = settings.get("dedup", {}) or {}
+        if self._enabled is None:
+            self._enabled = bool(dedup_settings.get("enabled", False))
+        if self._time_window_seconds is None:
+            self._time_window_seconds = float(dedup_settings.get("time_window_seconds", 300))
+        if self._max_entries is None:
+            self._max_entries = int(dedup_settings.get("max_entries", 10000))
+        self.entries: deque[tuple[Fingerprint, Bill]] = deque()
+        self.by_amount: dict[int, list[tuple[Fingerprint, Bill]]] = {}
+        self._initialized = True
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return bool(self._enabled)
+
+    def add(self, bill: Bill, raw_text: RawText | None = None) -> None:
+        """
+        Index a produced bill.
+        """
+        if not self.enabled or bill.is_duplicate or is_dry_run() or is_shadow_run():
+            return
+        entry = (fingerprint_bill(bill, raw_text), bill)
+        self.entries.append(entry)
+        self.by_amount.setdefault(entry[0].amount_cents, []).append(entry)
+        while len(self.entries) > self._max_entries:
+            evicted = self.entries.popleft()
+            bucket = self.by_amount[evicted[0].amount_cents]
+            bucket.remove(evicted)
+            if not bucket:
+                del self.by_amount[evicted[0].amount_cents]
+
+    def lookup(self, raw_text: RawText) -> Bill | None:
+        """
+        Find a previously produced bill matching the OCR text. The returned bill is flagged as a
+        duplicate.
+
+        Returns:
+            Bill | None: The matched bill, or None if no indexed transaction matches.
+        """
+        # A shadow run would find the bill of its primary run
+        if not self.enabled or not self.entries or is_shadow_run():
+            return None
+        best: tuple[float, Bill] | None = None
+        for candidate in extract_fingerprints(raw_text):
+            for fingerprint, bill in self.by_amount.get(candidate.amount_cents, []):
+                if candidate.card_tail and fingerprint.card_tail:
+                    if candidate.card_tail != fingerprint.card_tail:
+                        continue
+                elif not candidate.tokens & fingerprint.tokens:
+                    continue
+                delta = abs((candidate.time - fingerprint.time).total_seconds())
+                if delta <= self._time_window_seconds and (best is None or delta < best[0]):
+                    best = (delta, bill)
+        if best is None:
+            return None
+        logger.info(f"OCR text matches an already booked transaction (time delta {best[0]:.0f}s)")
+        return best[1].model_copy(update={"is_duplicate": True})
+
+    def clear(self) -> None:
+        self._initialize()
+        self.entries.clear()
+        self.by_amount.clear()
+
+
+bill_index = BillIndex()
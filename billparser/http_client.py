@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+
+
+class LoopBoundClient:
+    """
+    A lazily created `httpx.AsyncClient` shared by the requests of a parser, so that TLS
+    connections are reused (and can be opened ahead of time by the warm-up) instead of being
+    established for every request. Connections belong to an event loop, a new client is created
+    when the parser is used from another loop (e.g. successive `asyncio.run` calls) and the client
+    of the previous loop is closed.
+    """
+
+    def __init__(self, **client_kwargs) -> None:
+        self.client_kwargs = client_kwargs
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is not None and self._loop is not loop:
+            self._discard()
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(**self.client_kwargs)
+            self._loop = loop
+        return self._client
+
+    def _discard(self) -> None:
+        """
+        Forget the client of another loop, closing it on that loop while it still runs. The
+        connections of a stopped loop can no longer be closed gracefully, they go with the client.
+        """
+        client, loop = self._client, self._loop
+        self._client = self._loop = None
+        if client is not None and loop is not None and loop.is_running() and not client.is_closed:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    async def preconnect(self, url: str, timeout: float = 10) -> None:
+        """
+        Open a connection to the host of `url`. The response status is irrelevant, only the TCP
+        and TLS handshakes matter.
+        """
+        response = await self.get().head(url, timeout=timeout)
+        await response.aclose()
+
+    async def aclose(self) -> None:
+        if self._client is None:
+            return
+        if self._loop is not asyncio.get_running_loop():
+            self._discard()
+            return
+        client, self._client, self._loop = self._client, None, None
+        await client.aclose()
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from datetime import date, datetime
+from logging import getLogger
+from pathlib import Path
+
+from .config import ROOT_DIR, settings
+from .metrics import metrics
+from .models import Bill, BillList, ParserOutput
+from .serialization import dump_bill_json
+from .shadow import is_shadow_run
+from .warmup import is_dry_run
+
+logger = getLogger(__name__)
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Length of the `day` prefix giving the period of an aggregate
+_PERIOD_PREFIX = {"day": 10, "month": 7, "year": 4}
+AGGREGATE_DIMENSIONS = ("transaction_type", "catename", "accountname")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    day TEXT NOT NULL,
+    transaction_type TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    fee_cents INTEGER NOT NULL,
+    catename TEXT NOT NULL,
+    accountname TEXT NOT NULL,
+    accountname2 TEXT,
+    remark TEXT,
+    pipeline TEXT,
+    recorded_at TEXT NOT NULL,
+    bill_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bills_time ON bills (time);
+CREATE INDEX IF NOT EXISTS bills_catename_time ON bills (catename, time);
+CREATE INDEX IF NOT EXISTS bills_accountname_time ON bills (accountname, time);
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    day TEXT NOT NULL,
+    transaction_type TEXT NOT NULL,
+    catename TEXT NOT NULL,
+    accountname TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    fee_cents INTEGER NOT NULL,
+    PRIMARY KEY (day, transaction_type, catename, accountname)
+) WITHOUT ROWID;
+"""
+
+_INSERT_BILL = """
+INSERT INTO bills (
+    time, day, transaction_type, amount_cents, fee_cents, catename, accountname, accountname2, remark,
+    pipeline, recorded_at, bill_json
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_UPSERT_ROLLUP = """
+INSERT INTO daily_rollups (day, transaction_type, catename, accountname, count, amount_cents, fee_cents)
+VALUES (?, ?, ?, ?, 1, ?, ?)
+ON CONFLICT (day, transaction_type, catename, accountname) DO UPDATE SET
+    count = count + 1,
+    amount_cents = amount_cents + excluded.amount_cents,
+    fee_cents = fee_cents + excluded.fee_cents
+"""
+
+
+class Ledger:
+    """
+    Embedded SQLite store of the parsed bills, indexed by time, category and account. Daily rollups
+    per (transaction type, category, account) are updated in the transaction inserting each bill,
+    so aggregates over any range read at most one row per day and key instead of the bills.
+
+    Amounts are stored in cents. Bills without a category (credit card repayments) are rolled up
+    under the empty category name.
+    """
+
+    def __init__(self, path: Path | str | None = None, enabled: bool | None = None) -> None:
+        self._path = Path(path) if path is not None else None
+        self._enabled = enabled
+        self._initialized = False
+        self._connection: sqlite3.Connection | None = None
+        # The connection is shared by the worker threads, sqlite3 serializes nothing by itself
+        self._lock = threading.Lock()
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        ledger_settings = settings.get("ledger", {}) or {}
+        if self._enabled is None:
+            self._enabled = bool(ledger_settings.get("enabled", False))
+        if self._path is None:
+            path = Path(ledger_settings.get("path") or "data/ledger.sqlite3")
+            self._path = path if path.is_absolute() else ROOT_DIR / path
+        self._initialized = True
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return bool(self._enabled)
+
+    def _connect(self) -> sqlite3.Connection:
+        self._initialize()
+        if self._connection is None:
+            assert self._path is not None
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+            # WAL lets the query endpoints read while a bill is being appended
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            connection.row_factory = sqlite3.Row
+            self._connection = connection
+        return self._connection
+
+    def append(self, bills: Iterable[Bill], pipeline: str | None = None) -> int:
+        """
+        Append bills and update their daily rollups in a single transaction.
+
+        Returns:
+            int: Number of bills appended.
+        """
+        recorded_at = datetime.now().strftime(_TIME_FORMAT)
+        bill_rows, rollup_rows = [], []
+        for bill in bills:
+            day = bill.time.strftime("%Y-%m-%d")
+            amount_cents = round(bill.amount * 100)
+            fee_cents = round((bill.fee or 0) * 100)
+            catename = bill.catename.serialized_name if bill.catename else ""
+            accountname = bill.accountname.account_name
+            bill_rows.append(
+                (
+                    bill.time.strftime(_TIME_FORMAT),
+                    day,
+                    bill.transaction_type.value,
+                    amount_cents,
+                    fee_cents,
+                    catename,
+                    accountname,
+                    bill.accountname2.account_name if bill.accountname2 else None,
+                    bill.remark,
+                    pipeline,
+                    recorded_at,
+                    dump_bill_json(bill).decode("utf-8"),
+                )
+            )
+            rollup_rows.append((day, bill.transaction_type.value, catename, accountname, amount_cents, fee_cents))
+        if not bill_rows:
+            return 0
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(_INSERT_BILL, bill_rows)
+                connection.executemany(_UPSERT_ROLLUP, rollup_rows)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return len(bill_rows)
+
+    async def record(self, result: ParserOutput, pipeline: str | None = None) -> None:
+        """
+        Append the bills of a pipeline result when the ledger is enabled. Duplicates of booked
+        transactions, warm-up dry runs and shadow runs are not recorded. Failures are logged, never raised, so
+        that the ledger cannot fail a parse.
+        """
+        if not self.enabled or is_dry_run() or is_shadow_run():
+            return
+        bills = result if isinstance(result, BillList) else [result] if isinstance(result, Bill) else []
+        bills = [bill for bill in bills if not bill.is_duplicate]
+        if not bills:
+            return
+        start = time.perf_counter()
+        try:
+            count = await asyncio.to_thread(self.append, bills, pipeline)
+        except Exception as e:
+            logger.error(f"Failed to record {len(bills)} bills in the ledger: {e}", exc_info=True)
+            metrics.inc("ledger_errors_total")
+            return
+        metrics.inc("ledger_bills_total", count, pipeline=pipeline or "")
+        metrics.observe("ledger_append_seconds", time.perf_counter() - start)
+
+    def query_bills(
+        self,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        catename: str | None = None,
+        accountname: str | None = None,
+        transaction_type: str | None = None,
+        limit: int = 100,
+        after_id: int | None = None,
+    ) -> list[dict]:
+        """
+        Bills whose time lies in [start, end), ordered by time. Pages are chained with `after_id`,
+        the id of the last bill of the previous page, so that deep pages do not rescan the
+        skipped ones.
+        """
+        conditions, params = self._filters(
+            "time",
+            start.strftime(_TIME_FORMAT) if start else None,
+            end.strftime(_TIME_FORMAT) if end else None,
+            catename=catename,
+            accountname=accountname,
+            transaction_type=transaction_type,
+        )
+        if after_id is not None:
+            conditions.append("(time, id) > (SELECT time, id FROM bills WHERE id = ?)")
+            params.append(after_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT id, pipeline, recorded_at, bill_json FROM bills {where} ORDER BY time, id LIMIT ?"
+        with self._lock:
+            rows = self._connect().execute(sql, [*params, limit]).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "pipeline": row["pipeline"],
+                "recorded_at": row["recorded_at"],
+                "bill": json.loads(row["bill_json"]),
+            }
+            for row in rows
+        ]
+
+    def aggregate(
+        self,
+        start: date | None = None,
+        end: date | None = None,
+        period: str = "month",
+        group_by: Iterable[str] = ("catename",),
+        catename: str | None = None,
+        accountname: str | None = None,
+        transaction_type: str | None = None,
+    ) -> list[dict]:
+        """
+        Totals per period and per combination of `group_by` dimensions over the days in
+        [start, end], read from the daily rollups.
+
+        Args:
+            period (str): "day", "month", "year", or "all" for a single period.
+            group_by (Iterable[str]): Dimensions among transaction_type, catename and accountname.
+
+        Returns:
+            list[dict]: One row per period and key with the bill count, amount and fee.
+        """
+        group_by = list(dict.fromkeys(group_by))
+        unknown = set(group_by) - set(AGGREGATE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown aggregate dimensions {sorted(unknown)}, available: {AGGREGATE_DIMENSIONS}")
+        if period != "all" and period not in _PERIOD_PREFIX:
+            raise ValueError(f"Unknown period '{period}', available: day, month, year, all")
+        conditions, params = self._filters(
+            "day",
+            start.isoformat() if start else None,
+            end.isoformat() if end else None,
+            end_inclusive=True,
+            catename=catename,
+            accountname=accountname,
+            transaction_type=transaction_type,
+        )
+        columns = [*([f"substr(day, 1, {_PERIOD_PREFIX[period]})"] if period != "all" else []), *group_by]
+        select = [*([f"{columns[0]} AS period"] if period != "all" else []), *group_by]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        group = f"GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}" if columns else ""
+        sql = (
+            f"SELECT {''.join(f'{column}, ' for column in select)}"
+            "SUM(count) AS count, SUM(amount_cents) AS amount_cents, SUM(fee_cents) AS fee_cents "
+            f"FROM daily_rollups {where} {group}"
+        )
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        aggregates = []
+        for row in rows:
+            item = dict(row)
+            if item["count"] is None:
+                continue
+            item["amount"] = item.pop("amount_cents") / 100
+            item["fee"] = item.pop("fee_cents") / 100
+            aggregates.append(item)
+        return aggregates
+
+    @staticmethod
+    def _filters(
+        time_column: str, start: str | None, end: str | None, end_inclusive: bool = False, **equals: str | None
+    ) -> tuple[list[str], list]:
+        conditions: list[str] = []
+        params: list = []
+        if start is not None:
+            conditions.append(f"{time_column} >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{time_column} {'<=' if end_inclusive else '<'} ?")
+            params.append(end)
+        for column, value in equals.items():
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        return conditions, params
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+ledger = Ledger()
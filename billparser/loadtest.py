@@ -0,0 +1,414 @@
+import asyncio
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from logging import getLogger
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+logger = getLogger(__name__)
+
+_BATCH_ID_PATTERN = re.compile(r"### 账单 id=(\d+)")
+_MERCHANTS = ["北京盒马", "滴滴出行", "美团外卖", "瑞幸咖啡", "中国石化", "京东商城"]
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """
+    Latency of a mock provider, parsed from a spec:
+        - `0.2` or `const:0.2`: always 0.2s.
+        - `uniform:0.1,0.5`: uniform between 0.1s and 0.5s.
+        - `normal:0.3,0.05`: normal with mean 0.3s and standard deviation 0.05s, clamped at 0.
+        - `lognormal:0.3,0.5`: log-normal with median 0.3s and shape 0.5 (long tail).
+        - `exp:0.3`: exponential with mean 0.3s.
+    """
+
+    kind: str
+    params: tuple[float, ...]
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, _, args = spec.partition(":") if ":" in spec else ("const", "", spec)
+        try:
+            params = tuple(float(arg) for arg in args.split(","))
+        except ValueError as e:
+            raise ValueError(f"Invalid latency spec '{spec}': {e}") from e
+        arity = {"const": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+        if kind not in arity:
+            raise ValueError(f"Unknown latency distribution '{kind}', available: {', '.join(arity)}")
+        if len(params) != arity[kind]:
+            raise ValueError(f"Latency distribution '{kind}' takes {arity[kind]} parameters, got '{spec}'")
+        return cls(kind, params)
+
+    def sample(self, rng: random.Random) -> float:
+        match self.kind:
+            case "uniform":
+                return rng.uniform(*self.params)
+            case "normal":
+                return max(rng.gauss(*self.params), 0.0)
+            case "lognormal":
+                median, sigma = self.params
+                return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+            case "exp":
+                return rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+            case _:
+                return self.params[0]
+
+
+@dataclass
+class MockProviders:
+    """
+    Settings of the mock OCR and LLM providers: latency distribution and error rate of each.
+    """
+
+    ocr_latency: LatencyDistribution = field(default_factory=lambda: LatencyDistribution("const", (0.3,)))
+    llm_latency: LatencyDistribution = field(default_factory=lambda: LatencyDistribution("const", (1.0,)))
+    ocr_error_rate: float = 0.0
+    llm_error_rate: float = 0.0
+    seed: int | None = None
+
+
+def create_mock_app(mock: MockProviders) -> FastAPI:
+    """
+    A server mimicking the providers, with the response formats the parsers expect:
+        - `POST /ocr`: the PP-OCR API, answering random bill detail texts so that no two requests
+          look like the same transaction to the duplicate index.
+        - `GET /v1/models` and `POST /v1/chat/completions`: an OpenAI-compatible LLM, answering
+          the default bill (a JSON array of them for multi-bill prompts).
+    """
+    from .parsers.ds_parsers import DRY_RUN_BILL_DATA
+
+    app = FastAPI(title="Bill Parser Mock Providers")
+    rng = random.Random(mock.seed)
+
+    def error_response() -> JSONResponse:
+        return JSONResponse({"error": {"message": "Injected mock provider error"}}, status_code=500)
+
+    @app.post("/ocr")
+    async def ocr() -> JSONResponse:
+        await asyncio.sleep(mock.ocr_latency.sample(rng))
+        if rng.random() < mock.ocr_error_rate:
+            return error_response()
+        texts = [
+            "账单详情",
+            rng.choice(_MERCHANTS),
+            f"-{rng.uniform(1, 500):.2f}",
+            "交易成功",
+            "支付时间",
+            f"2025-10-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00",
+            "订单号",
+            str(rng.randrange(10**17, 10**18)),
+        ]
+        boxes = [[20, 40 * idx, 300, 40 * idx + 30] for idx in range(len(texts))]
+        return JSONResponse({"result": {"ocrResults": [{"prunedResult": {"rec_texts": texts, "rec_boxes": boxes}}]}})
+
+    @app.get("/v1/models")
+    async def models() -> dict:
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> JSONResponse:
+        body = await request.json()
+        await asyncio.sleep(mock.llm_latency.sample(rng))
+        if rng.random() < mock.llm_error_rate:
+            return error_response()
+        prompt = body["messages"][-1]["content"]
+        bill = {**DRY_RUN_BILL_DATA, "amount": round(rng.uniform(1, 500), 2)}
+        if '"confidence"' in prompt:
+            bill["confidence"] = round(rng.uniform(0.5, 1.0), 2)
+        ids = _BATCH_ID_PATTERN.findall(prompt)
+        answer = [{**bill, "id": int(idx)} for idx in ids] if ids else bill
+        content = json.dumps(answer, ensure_ascii=False)
+        prompt_tokens, completion_tokens = len(prompt) // 2, len(content) // 2
+        return JSONResponse(
+            {
+                "id": f"mock-{rng.getrandbits(32):08x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        )
+
+    return app
+
+
+def mock_env(base_url: str) -> dict[str, str]:
+    """
+    Environment variables pointing `billparser serve` at the mock providers.
+    """
+    return {
+        "BILLPARSER_PARSERS__PP_OCRV5__URL": f"{base_url}/ocr",
+        "BILLPARSER_PARSERS__PP_OCRV5__TOKEN": "mock",
+        "BILLPARSER_PARSERS__DEEPSEEK_CHAT__BASE_URL": f"{base_url}/v1",
+        "BILLPARSER_PARSERS__DEEPSEEK_CHAT__API_KEY": "mock",
+    }
+
+
+class BackgroundServer:
+    """
+    Runs an ASGI app with uvicorn in a thread with its own event loop, so that the mock latencies
+    are not distorted by the load generator saturating its own loop.
+    """
+
+    def __init__(self, app: FastAPI, host: str, port: int):
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, name="mock-providers", daemon=True)
+
+    def start(self, timeout: float = 10) -> None:
+        self.thread.start()
+        end = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > end:
+                raise RuntimeError("Mock providers failed to start")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def synthetic_png(seed: int, size: int = 64) -> bytes:
+    """
+    A small grayscale PNG of random pixels, distinct for every seed.
+    """
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(size) for _ in range(size))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+@dataclass
+class LoadConfig:
+    url: str
+    api_key: str
+    images: list[bytes] = field(default_factory=list)  # Recorded screenshots, synthetic images when empty
+    pipeline: str = "ocr_then_llm"
+    mode: str = "closed"  # closed: fixed concurrency | open: fixed arrival rate
+    concurrency: int = 8
+    rate: float = 10.0  # Requests per second in open-loop mode
+    duration: float = 30.0
+    max_outstanding: int = 1000  # Open-loop arrivals beyond this many in-flight requests are dropped
+    timeout: float = 60.0
+    sample_interval: float = 1.0
+
+
+@dataclass
+class RequestResult:
+    start: float  # Scheduled start, in seconds since the beginning of the run
+    latency: float
+    outcome: str  # "ok", "http_<status>", "timeout", "client_saturated" or the exception name
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@dataclass
+class LoadReport:
+    config: LoadConfig
+    elapsed: float
+    results: list[RequestResult]
+    rss_samples: list[tuple[float, int]]  # (seconds since the beginning, server RSS in bytes)
+
+    def to_dict(self) -> dict:
+        latencies = sorted(result.latency for result in self.results if result.outcome == "ok")
+        errors = Counter(result.outcome for result in self.results if result.outcome != "ok")
+        interval = self.config.sample_interval
+        n_buckets = max(1, math.ceil(self.elapsed / interval))
+        buckets: list[list[RequestResult]] = [[] for _ in range(n_buckets)]
+        for result in self.results:
+            end = result.start + result.latency
+            buckets[min(n_buckets - 1, int(end / interval))].append(result)
+        rss_by_bucket = {min(n_buckets - 1, int(t / interval)): rss for t, rss in self.rss_samples}
+        timeline = []
+        for idx, bucket in enumerate(buckets):
+            ok = sorted(result.latency for result in bucket if result.outcome == "ok")
+            rss = rss_by_bucket.get(idx)
+            timeline.append(
+                {
+                    "t": round((idx + 1) * interval, 3),
+                    "throughput_rps": len(ok) / interval,
+                    "errors": len(bucket) - len(ok),
+                    "p95_seconds": _percentile(ok, 0.95),
+                    "server_rss_mib": None if rss is None else rss / 2**20,
+                }
+            )
+        return {
+            "mode": self.config.mode,
+            "pipeline": self.config.pipeline,
+            "concurrency": self.config.concurrency if self.config.mode == "closed" else None,
+            "offered_rate_rps": self.config.rate if self.config.mode == "open" else None,
+            "elapsed_seconds": self.elapsed,
+            "requests": len(self.results),
+            "ok": len(latencies),
+            "throughput_rps": len(latencies) / self.elapsed if self.elapsed else 0.0,
+            "error_rate": sum(errors.values()) / len(self.results) if self.results else 0.0,
+            "latency_seconds": {
+                "mean": sum(latencies) / len(latencies) if latencies else float("nan"),
+                "p50": _percentile(latencies, 0.5),
+                "p90": _percentile(latencies, 0.9),
+                "p95": _percentile(latencies, 0.95),
+                "p99": _percentile(latencies, 0.99),
+                "max": latencies[-1] if latencies else float("nan"),
+            },
+            "errors": dict(errors.most_common()),
+            "server_rss_mib": {
+                "start": self.rss_samples[0][1] / 2**20 if self.rss_samples else None,
+                "peak": max(rss for _, rss in self.rss_samples) / 2**20 if self.rss_samples else None,
+                "end": self.rss_samples[-1][1] / 2**20 if self.rss_samples else None,
+            },
+            "timeline": timeline,
+        }
+
+
+def format_report(report: dict) -> str:
+    latency = report["latency_seconds"]
+    load = (
+        f"concurrency {report['concurrency']}"
+        if report["mode"] == "closed"
+        else f"offered {report['offered_rate_rps']:g} req/s"
+    )
+    lines = [
+        f"Mode: {report['mode']}-loop, {load}, pipeline {report['pipeline']}",
+        f"Requests: {report['requests']} in {report['elapsed_seconds']:.1f}s, {report['ok']} ok, "
+        f"throughput {report['throughput_rps']:.2f} req/s, error rate {report['error_rate']:.1%}",
+        "Latency (s): "
+        + ", ".join(f"{name} {latency[name]:.3f}" for name in ("mean", "p50", "p90", "p95", "p99", "max")),
+    ]
+    if report["errors"]:
+        lines.append("Errors: " + ", ".join(f"{outcome} {count}" for outcome, count in report["errors"].items()))
+    rss = report["server_rss_mib"]
+    if rss["peak"] is not None:
+        lines.append(f"Server RSS (MiB): start {rss['start']:.1f}, peak {rss['peak']:.1f}, end {rss['end']:.1f}")
+    lines.append(f"{'t (s)':>8} {'req/s':>8} {'errors':>7} {'p95 (s)':>8} {'RSS (MiB)':>10}")
+    for row in report["timeline"]:
+        rss_text = "-" if row["server_rss_mib"] is None else f"{row['server_rss_mib']:.1f}"
+        lines.append(
+            f"{row['t']:>8.1f} {row['throughput_rps']:>8.2f} {row['errors']:>7} "
+            f"{row['p95_seconds']:>8.3f} {rss_text:>10}"
+        )
+    return "\n".join(lines)
+
+
+class LoadGenerator:
+    """
+    Drives `/parse_image` of a running server:
+        - Closed loop: `concurrency` clients each sending a request as soon as the previous one
+          completes, the throughput found at a given concurrency.
+        - Open loop: requests arriving at a fixed `rate` whatever the server does. Latencies are
+          measured from the scheduled arrival, so that a saturated server shows its queueing delay
+          instead of slowing the arrivals down (coordinated omission).
+
+    The server RSS is sampled from `/metrics` every `sample_interval` seconds.
+    """
+
+    def __init__(self, config: LoadConfig, transport: httpx.AsyncBaseTransport | None = None):
+        if config.mode not in ("closed", "open"):
+            raise ValueError(f"Unknown load mode '{config.mode}', available: closed, open")
+        self.config = config
+        self.transport = transport
+        self.results: list[RequestResult] = []
+        self.rss_samples: list[tuple[float, int]] = []
+        self._t0 = 0.0
+
+    async def run(self) -> LoadReport:
+        connections = self.config.concurrency if self.config.mode == "closed" else self.config.max_outstanding
+        async with httpx.AsyncClient(
+            base_url=self.config.url,
+            headers={"X-API-Key": self.config.api_key},
+            timeout=self.config.timeout,
+            limits=httpx.Limits(max_connections=connections + 1, max_keepalive_connections=connections + 1),
+            transport=self.transport,
+        ) as client:
+            self._t0 = time.monotonic()
+            sampler = asyncio.create_task(self._sample_rss(client))
+            try:
+                if self.config.mode == "closed":
+                    await self._closed_loop(client)
+                else:
+                    await self._open_loop(client)
+            finally:
+                sampler.cancel()
+        return LoadReport(self.config, time.monotonic() - self._t0, self.results, self.rss_samples)
+
+    def _image(self, idx: int) -> bytes:
+        if self.config.images:
+            return self.config.images[idx % len(self.config.images)]
+        return synthetic_png(idx)
+
+    async def _send(self, client: httpx.AsyncClient, idx: int, scheduled: float) -> None:
+        try:
+            response = await client.post(
+                "/parse_image",
+                params={"pipeline_name": self.config.pipeline},
+                files={"image": (f"loadtest-{idx}", self._image(idx), "application/octet-stream")},
+            )
+            outcome = "ok" if response.status_code == 200 else f"http_{response.status_code}"
+        except httpx.TimeoutException:
+            outcome = "timeout"
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        self.results.append(RequestResult(scheduled - self._t0, time.monotonic() - scheduled, outcome))
+
+    async def _closed_loop(self, client: httpx.AsyncClient) -> None:
+        end = self._t0 + self.config.duration
+
+        async def worker(idx: int) -> None:
+            while time.monotonic() < end:
+                await self._send(client, idx, time.monotonic())
+                idx += self.config.concurrency
+
+        await asyncio.gather(*(worker(idx) for idx in range(self.config.concurrency)))
+
+    async def _open_loop(self, client: httpx.AsyncClient) -> None:
+        interval = 1 / self.config.rate
+        in_flight: set[asyncio.Task] = set()
+        idx = 0
+        while (scheduled := self._t0 + idx * interval) < self._t0 + self.config.duration:
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(in_flight) >= self.config.max_outstanding:
+                self.results.append(RequestResult(scheduled - self._t0, 0.0, "client_saturated"))
+            else:
+                task = asyncio.create_task(self._send(client, idx, scheduled))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            idx += 1
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+    async def _sample_rss(self, client: httpx.AsyncClient) -> None:
+        while True:
+            try:
+                response = await client.get("/metrics")
+                rss = response.json()["gauges"].get("process_resident_memory_bytes")
+                if rss is not None:
+                    self.rss_samples.append((time.monotonic() - self._t0, int(rss)))
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                logger.debug(f"Could not sample the server RSS: {e}")
+            await asyncio.sleep(self.config.sample_interval)
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import defaultdict, deque
+
+_RESERVOIR_SIZE = 1024
+
+
+def _format_key(name: str, labels: dict[str, str]) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class _Summary:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.recent: deque[float] = deque(maxlen=_RESERVOIR_SIZE)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def to_dict(self) -> dict[str, float]:
+        values = sorted(self.recent)
+
+        def percentile(q: float) -> float:
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """
+    A minimal in-process metrics registry, including:
+        - Counters, incremented with `inc`.
+        - Gauges, set with `set`.
+        - Summaries (count/sum/min/max and percentiles over recent values), fed with `observe`.
+
+    Metrics are identified by name and optional string labels, and exported with `snapshot`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._gauges: dict[str, float] = {}
+        self._summaries: dict[str, _Summary] = defaultdict(_Summary)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        with self._lock:
+            self._counters[_format_key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._gauges[_format_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._summaries[_format_key(name, labels)].observe(value)
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {key: summary.to_dict() for key, summary in self._summaries.items()},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+
+def process_rss_bytes() -> int | None:
+    """
+    Resident memory of the current process, None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+metrics = MetricsRegistry()
@@ -1,3 +1,4 @@
+from collections.abc import Iterable
 from datetime import datetime
 from enum import StrEnum
 from typing import Self
@@ -5,7 +6,35 @@ from typing import Self
 from pydantic import BaseModel, ConfigDict, Field, field_serializer, model_validator
 
 RawImage = type("RawImage", (bytes,), {})
-RawText = type("RawText", (str,), {})
+RawPdf = type("RawPdf", (bytes,), {})
+
+
+class OcrLine(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    text: str = Field(description="识别出的文字")
+    left: int = Field(description="文字框左上角横坐标")
+    top: int = Field(description="文字框左上角纵坐标")
+    width: int = Field(description="文字框宽度")
+    height: int = Field(description="文字框高度")
+
+    @property
+    def bottom(self) -> int:
+        return self.top + self.height
+
+
+class RawText(str):
+    """
+    OCR text. Optionally carries the layout (coordinates) of the recognized lines when the OCR
+    provider returns them.
+    """
+
+    layout: tuple[OcrLine, ...]
+
+    def __new__(cls, text: str = "", layout: Iterable[OcrLine] = ()) -> Self:
+        obj = super().__new__(cls, text)
+        obj.layout = tuple(layout)
+        return obj
 
 
 class TransactionType(StrEnum):
@@ -25,6 +54,11 @@ class CategoryItem(BaseModel):
     l2_desc: str | None = Field(description="二级分类描述", default=None)
     match_rules: list[str] = Field(description="匹配规则列表", default=[])
 
+    @property
+    def serialized_name(self) -> str:
+        """Name used when serializing a bill, the second-level name if any."""
+        return self.l2_name or self.l1_name
+
 
 class AssetItem(BaseModel):
     model_config = ConfigDict(frozen=True)
@@ -51,27 +85,21 @@ class Bill(BaseModel):
         default=None,
         description="手续费",
     )
+    is_duplicate: bool = Field(default=False, description="是否与已记账的交易重复")
 
+    # A single validator runs the transfer, fee and money checks, one Python call per bill instead of three.
     @model_validator(mode="after")
-    def check_transfer_logic(self) -> Self:
-        if self.transaction_type in [
+    def check_bill_logic(self) -> Self:
+        if self.transaction_type in (
             TransactionType.TRANSFER,
             TransactionType.CREDIT_CARD_REPAYMENT,
-        ]:
+        ):
             if not self.accountname2:
                 raise ValueError(
                     "对于转账或者信用卡还款，必须提供 accountname2（转入账户名称）"  # noqa: RUF001
                 )
-        return self
-
-    @model_validator(mode="after")
-    def check_fee_logic(self) -> Self:
         if self.fee is not None and (self.fee < 0 or self.fee > self.amount):
             raise ValueError("手续费 fee 不能为负数且不能大于交易金额 amount")
-        return self
-
-    @model_validator(mode="after")
-    def check_money_logic(self) -> Self:
         if self.amount <= 0:
             raise ValueError("交易金额 amount 必须为正数")
         return self
@@ -80,9 +108,7 @@ class Bill(BaseModel):
     def serialize_catename(self, category: CategoryItem | None) -> str | None:
         if category is None:
             return None
-        if category.l2_name:
-            return category.l2_name
-        return category.l1_name
+        return category.serialized_name
 
     @field_serializer("accountname", "accountname2")
     def serialize_accountname(self, account: AssetItem | None) -> str | None:
@@ -91,5 +117,19 @@ class Bill(BaseModel):
         return account.account_name
 
 
-type ParserInput = RawImage | RawText
-type ParserOutput = Bill | RawText
+class BillList(list[Bill]):
+    """
+    Bills parsed from a single input holding several transactions, e.g. a bill list screenshot
+    or a statement.
+    """
+
+
+type ParserInput = RawImage | RawPdf | RawText
+type ParserOutput = Bill | BillList | RawText
+
+
+def raw_file_input(data: bytes) -> RawImage | RawPdf:
+    """
+    Wrap uploaded file content as a parser input, detecting PDF documents by their magic bytes.
+    """
+    return RawPdf(data) if data[:5] == b"%PDF-" else RawImage(data)
@@ -11,6 +11,15 @@ T_Output = TypeVar("T_Output", bound=ParserOutput)
 class BaseParser[T_Input, T_Output](ABC):
     """
     Generic Parser interface for bill parsing.
+
+    Besides `parse`, a parser may provide optional capabilities, looked up by name:
+        - `parse_batch(inputs) -> list[output | Exception]`: parse several inputs at once. Used by
+          `Pipeline.run_batch`, and by `Pipeline.run` to coalesce concurrent calls when the parser
+          settings have a `micro_batch` section (see `billparser.batching`).
+        - `parse_stream(input)`: yield the items of a multi-item output as they are produced.
+        - `warm_up()`: prepare connections or credentials before the first request.
+        - `aclose()`: release the worker processes and connections held by the parser, called by
+          `ParserManager.aclose` when the server or a CLI command stops.
     """
 
     name: str  # Unique name of the parser
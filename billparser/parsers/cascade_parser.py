@@ -0,0 +1,105 @@
+import time
+from logging import getLogger
+
+from ..classification_memory import classification_memory
+from ..config import settings
+from ..deadline import check_deadline, deadline_scope
+from ..fingerprint import bill_index
+from ..metrics import metrics
+from ..models import Bill, RawText
+from .base import BaseParser
+from .ds_parsers import NoBillFoundError
+
+logger = getLogger(__name__)
+
+
+class CascadeLLMParser(BaseParser[RawText, Bill]):
+    """
+    Tries LLM parsers from the cheapest to the strongest, escalating only when an answer is not
+    trusted. An answer of a tier but the last is accepted if:
+        - It validates like any LLM answer (known transaction type, category and account).
+        - It holds a bill (the models answer amount -1 when no bill is found).
+        - The confidence reported by the model reaches `min_confidence`.
+
+    The answer of the last tier is final. Escalations and the latency of each tier are recorded in
+    the metrics.
+    """
+
+    name = "llm_cascade"
+
+    def __init__(self):
+        logger.debug(f"Initializing {self.name}")
+        assert self.name in settings["parsers"] or self.name.upper() in settings["parsers"], (
+            f"Parser settings for {self.name} not found"
+        )
+        parser_cfg = settings["parsers"][self.name] or {}
+        self.tier_names: list[str] = list(parser_cfg.get("tiers") or ["groq", "deepseek_chat"])
+        assert len(self.tier_names) >= 2, f"{self.name} needs at least two tiers"
+        self.min_confidence: float = float(parser_cfg.get("min_confidence", 0.8))
+        # Seconds granted to each tier but the last, so that a slow cheap model escalates early
+        tier_timeout = parser_cfg.get("tier_timeout")
+        self.tier_timeout: float | None = float(tier_timeout) if tier_timeout else None
+        self._requests = 0
+        self._escalated = 0
+
+    @property
+    def tiers(self) -> list:
+        # Resolved lazily: the parser manager is still being built while parsers are instantiated
+        from .manager import parser_manager
+
+        tiers = [parser_manager.get_parser(name) for name in self.tier_names]
+        for tier in tiers[:-1]:
+            assert hasattr(tier, "parse_with_confidence"), (
+                f"Parser '{tier.name}' cannot be a cascade tier, it does not report a confidence"
+            )
+        return tiers
+
+    async def parse(self, input_data: RawText) -> Bill:
+        duplicate = bill_index.lookup(input_data)
+        if duplicate is not None:
+            logger.info(f"Skipping {self.name} cascade for an already booked transaction")
+            return duplicate
+        tiers = self.tiers
+        self._requests += 1
+        metrics.inc("cascade_requests_total", parser=self.name)
+        for tier in tiers[:-1]:
+            check_deadline(f"{self.name}:{tier.name}")
+            start = time.perf_counter()
+            try:
+                async with deadline_scope(self.tier_timeout, f"{self.name}:{tier.name}"):
+                    bill, confidence = await tier.parse_with_confidence(input_data)
+            except NoBillFoundError as e:
+                reason, detail = "no_bill", str(e)
+            except Exception as e:
+                reason, detail = "error", str(e)
+            else:
+                if confidence is None or confidence < self.min_confidence:
+                    reason, detail = "low_confidence", f"confidence {confidence}"
+                else:
+                    reason = detail = None
+            finally:
+                metrics.observe("cascade_tier_seconds", time.perf_counter() - start, parser=self.name, tier=tier.name)
+            if reason is None:
+                metrics.inc("cascade_accepted_total", parser=self.name, tier=tier.name)
+                self._record_escalation_rate()
+                bill_index.add(bill, input_data)
+                classification_memory.learn(bill, input_data)
+                return bill
+            logger.info(f"{self.name} escalating from {tier.name}: {detail}")
+            metrics.inc("cascade_escalations_total", parser=self.name, tier=tier.name, reason=reason)
+
+        final_tier = tiers[-1]
+        self._escalated += 1
+        self._record_escalation_rate()
+        check_deadline(f"{self.name}:{final_tier.name}")
+        start = time.perf_counter()
+        try:
+            # The last tier indexes the bill for dedup and the classification memory itself
+            bill = await final_tier.parse(input_data)
+        finally:
+            metrics.observe("cascade_tier_seconds", time.perf_counter() - start, parser=self.name, tier=final_tier.name)
+        metrics.inc("cascade_accepted_total", parser=self.name, tier=final_tier.name)
+        return bill
+
+    def _record_escalation_rate(self) -> None:
+        metrics.set("cascade_escalation_rate", self._escalated / self._requests, parser=self.name)
@@ -0,0 +1,118 @@
+import re
+from logging import getLogger
+
+from ..config import settings
+from ..metrics import metrics
+from ..models import OcrLine, RawText
+from .base import BaseParser
+from .helpers import LayoutHelper, TokenHelper
+
+logger = getLogger(__name__)
+
+# Status bar clocks (e.g. "10:291"), only looked for in the first lines when no layout is available
+_STATUS_BAR_CLOCK_PATTERN = re.compile(r"^\d{1,2}:\d{2}\d?$")
+_STATUS_BAR_LINES = 3
+# Signal/battery indicators and other tiny fragments (e.g. "l5G", "90", ">")
+DEFAULT_NOISE_PATTERNS = [
+    r"^[A-Za-z0-9]{1,3}$",
+    r"^[<>|/\\·•.,:;、。，]+$",  # noqa: RUF001
+]
+# Lines carrying amounts, dates or times are kept in priority when the token budget is tight.
+_KEY_LINE_PATTERN = re.compile(r"\d+\.\d{2}|\d{4}[-/年]\d{1,2}|\d{1,2}:\d{2}|尾号|\(\d{4}\)")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class TextCompactionParser(BaseParser[RawText, RawText]):
+    """
+    Removes app chrome from OCR text before it is sent to the LLM, including:
+        - Joining key-value rows (label on the left, value on the right) using the OCR layout.
+        - Dropping the status bar region and noise fragments.
+        - Dropping configurable boilerplate lines per source app.
+        - Collapsing whitespace and enforcing a token budget.
+    """
+
+    name = "text_compaction"
+
+    def __init__(self):
+        logger.debug(f"Initializing {self.name}")
+        assert self.name in settings["parsers"] or self.name.upper() in settings["parsers"], (
+            f"Parser settings for {self.name} not found"
+        )
+        parser_cfg = settings["parsers"][self.name] or {}
+        self.max_tokens: int = int(parser_cfg.get("max_tokens") or 0)
+        # Fraction of the screenshot height occupied by the status bar
+        self.status_bar_ratio: float = float(parser_cfg.get("status_bar_ratio", 0.04))
+        self.noise_patterns = [
+            re.compile(pattern) for pattern in [*DEFAULT_NOISE_PATTERNS, *parser_cfg.get("drop_patterns", [])]
+        ]
+        self.apps: dict[str, tuple[list[str], list[re.Pattern]]] = {}
+        for app_name, app_cfg in (parser_cfg.get("apps") or {}).items():
+            detect_keywords = list(app_cfg.get("detect", []))
+            drop_patterns = [re.compile(pattern) for pattern in app_cfg.get("drop", [])]
+            self.apps[app_name] = (detect_keywords, drop_patterns)
+
+    async def parse(self, input_data: RawText) -> RawText:
+        if input_data.layout:
+            lines = self._layout_lines(input_data.layout)
+        else:
+            lines = input_data.splitlines()
+            lines = [
+                line
+                for idx, line in enumerate(lines)
+                if idx >= _STATUS_BAR_LINES or not _STATUS_BAR_CLOCK_PATTERN.match(line.strip())
+            ]
+        drop_patterns = [*self.noise_patterns, *self._detect_app_patterns(input_data)]
+        compacted: list[str] = []
+        for line in lines:
+            line = _WHITESPACE_PATTERN.sub(" ", line).strip()
+            if not line or any(pattern.search(line) for pattern in drop_patterns):
+                continue
+            if compacted and compacted[-1] == line:
+                continue
+            compacted.append(line)
+        if self.max_tokens:
+            compacted = self._enforce_budget(compacted)
+        result = RawText("\n".join(compacted), layout=input_data.layout)
+
+        tokens_before = TokenHelper.estimate_tokens(input_data)
+        tokens_after = TokenHelper.estimate_tokens(result)
+        logger.info(f"{self.name} compacted OCR text from {tokens_before} to {tokens_after} estimated tokens")
+        metrics.observe("compaction_tokens_saved", tokens_before - tokens_after)
+        metrics.inc("compaction_tokens_before_total", tokens_before)
+        metrics.inc("compaction_tokens_after_total", tokens_after)
+        return result
+
+    def _detect_app_patterns(self, text: str) -> list[re.Pattern]:
+        patterns: list[re.Pattern] = []
+        for app_name, (detect_keywords, drop_patterns) in self.apps.items():
+            if any(keyword in text for keyword in detect_keywords):
+                logger.debug(f"Detected source app '{app_name}' in OCR text")
+                patterns.extend(drop_patterns)
+        return patterns
+
+    def _layout_lines(self, layout: tuple[OcrLine, ...]) -> list[str]:
+        """
+        Group OCR lines into visual rows by vertical overlap, so that a label and its value on the
+        same row become a single "label value" line. Lines inside the status bar band are dropped.
+        """
+        page_height = max(line.bottom for line in layout)
+        status_bar_bottom = page_height * self.status_bar_ratio
+        rows = LayoutHelper.group_rows(line for line in layout if line.bottom > status_bar_bottom)
+        return [LayoutHelper.row_text(row) for row in rows]
+
+    def _enforce_budget(self, lines: list[str]) -> list[str]:
+        """
+        Drop lines from the bottom until the text fits into the token budget, dropping lines
+        without amounts, dates or card numbers first.
+        """
+        costs = [TokenHelper.estimate_tokens(line) + 1 for line in lines]
+        total = sum(costs)
+        keep = [True] * len(lines)
+        for only_plain_lines in (True, False):
+            for idx in reversed(range(len(lines))):
+                if total <= self.max_tokens:
+                    break
+                if keep[idx] and (not only_plain_lines or not _KEY_LINE_PATTERN.search(lines[idx])):
+                    keep[idx] = False
+                    total -= costs[idx]
+        return [line for line, kept in zip(lines, keep, strict=True) if kept]
@@ -5,13 +5,42 @@ from logging import getLogger
 
 from openai import AsyncOpenAI
 
+from ..classification_memory import Classification, classification_memory
 from ..config import settings
+from ..deadline import step_timeout
+from ..fingerprint import bill_index, extract_amounts, extract_times
+from ..metrics import metrics
 from ..models import Bill, RawText, TransactionType
+from ..token_budget import Degradation, TokenBudgetExceededError, current_degradation
+from ..usage import record_usage
+from ..warmup import is_dry_run
 from .base import BaseParser
-from .helpers import PromptHelper, asset_helper, bill_helper, category_helper
+from .helpers import PromptHelper, TokenHelper, asset_helper, category_helper
 
 logger = getLogger(__name__)
 
+# Amount the prompts ask the models to answer when the text holds no bill
+NO_BILL_AMOUNT = -1
+
+
+class NoBillFoundError(ValueError):
+    pass
+
+
+# Answer of the LLM parsers during a warm-up dry run: the default bill
+DRY_RUN_BILL_DATA = {
+    "transaction_type": "支出",
+    "amount": 1.0,
+    "time": "2025-01-01 00:00:00",
+    "catename": "其它",
+    "remark": None,
+    "accountname": "无",
+    "accountname2": None,
+    "fee": None,
+}
+# Estimated tokens of a bill header in a multi-bill prompt plus its JSON object in the answer
+BATCH_ITEM_OVERHEAD_TOKENS = 80
+
 
 class OpenAICompatibleLLMParser(BaseParser[RawText, Bill]):
     """Base class for any OpenAI-compatible LLM parser."""
@@ -26,56 +55,301 @@ class OpenAICompatibleLLMParser(BaseParser[RawText, Bill]):
     def model(self) -> str:
         pass
 
+    @property
+    def parser_settings(self):
+        return settings["parsers"].get(self.name) or {}
+
+    @property
+    def batch_max_tokens(self) -> int:
+        """Estimated input token budget of a multi-bill request."""
+        return int(self.parser_settings.get("batch_max_tokens", 8000))
+
+    @property
+    def batch_max_size(self) -> int:
+        """Maximum number of bills packed into a multi-bill request."""
+        return int(self.parser_settings.get("batch_max_size", 16))
+
+    @property
+    def cheap_model(self) -> str | None:
+        """Model called instead of `model` once the token budget degrades to `cheap_model`."""
+        return self.parser_settings.get("cheap_model")
+
+    def _compact_prompt(self) -> bool:
+        """Whether the prompts of the current request keep only the best category and asset candidates."""
+        compact = current_degradation().rank >= Degradation.COMPACT_PROMPT.rank
+        if compact:
+            metrics.inc("llm_degraded_calls_total", parser=self.name, mode=Degradation.COMPACT_PROMPT.value)
+        return compact
+
+    async def warm_up(self) -> None:
+        """
+        Open the TLS connection to the provider with a cheap request listing the models.
+        """
+        await self.client.models.list(timeout=step_timeout(10))
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+    async def _complete(self, prompt: str, system_prompt: str, *, expect_array: bool = False) -> str:
+        if is_dry_run():
+            # Warm-up replay: exercise prompt building and validation without calling the provider
+            bill_json = json.dumps(DRY_RUN_BILL_DATA, ensure_ascii=False)
+            return "[]" if expect_array else bill_json
+        degradation = current_degradation()
+        if degradation is Degradation.LOCAL_ONLY:
+            metrics.inc("llm_degraded_calls_total", parser=self.name, mode=degradation.value)
+            raise TokenBudgetExceededError(f"Token budget exhausted, {self.name} is not called")
+        model = self.model
+        if degradation.rank >= Degradation.CHEAP_MODEL.rank and self.cheap_model:
+            metrics.inc("llm_degraded_calls_total", parser=self.name, mode=Degradation.CHEAP_MODEL.value)
+            model = self.cheap_model
+        # The configured timeout (or the client default) capped by the remaining budget of the request
+        timeout = step_timeout(self.parser_settings.get("timeout"))
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            **({"timeout": timeout} if timeout is not None else {}),
+        )
+        record_usage(getattr(response, "usage", None))
+        response_text = response.choices[0].message.content
+        if response_text is None:
+            raise ValueError(f"Received empty response from {self.name}")
+        # Strip <think>...</think> blocks produced by reasoning models (e.g. Qwen3)
+        response_text = re.sub(r"<think>.*?</think>", "", response_text, flags=re.DOTALL).strip()
+        if not response_text:
+            raise ValueError(f"Response from {self.name} is empty after stripping think tags")
+        return response_text
+
+    def _build_bill(self, raw_data: dict) -> Bill:
+        """
+        Validate the fields returned by the LLM against the configured categories and assets, and
+        build the bill.
+        """
+        transaction_type_str = raw_data.get("transaction_type")
+        if transaction_type_str != "信用卡还款":
+            catename_str = raw_data.get("catename")
+            accountname_str = raw_data.get("accountname")
+            assert transaction_type_str in TransactionType, (
+                f"Unknown transaction type '{transaction_type_str}' in {self.name} response"
+            )
+            # The default category ("其它") is an expense category, accepted for expenses only
+            default_category = category_helper.get_default_category()
+            assert catename_str in category_helper.categories.get(transaction_type_str, {}) or (
+                catename_str == default_category.l2_name and transaction_type_str == default_category.transaction_type
+            ), (
+                f"Unknown category name '{catename_str}' for "
+                f"transaction type '{transaction_type_str}' in {self.name} response"
+            )
+            assert (
+                accountname_str in asset_helper.assets
+                or accountname_str == asset_helper.get_default_asset().account_name
+            ), (
+                f"Unknown account name '{accountname_str}' for "
+                f"transaction type '{transaction_type_str}' in {self.name} response"
+            )
+            raw_data["transaction_type"] = TransactionType(transaction_type_str)
+            raw_data["catename"] = category_helper.get_category(raw_data["transaction_type"], catename_str)
+            raw_data["accountname"] = asset_helper.get_asset(accountname_str)
+            raw_data["accountname2"] = None
+        else:
+            raw_data["transaction_type"] = TransactionType.CREDIT_CARD_REPAYMENT
+            raw_data["accountname"] = asset_helper.get_asset(raw_data["accountname"])
+            raw_data["accountname2"] = asset_helper.get_asset(raw_data["accountname2"])
+            raw_data["catename"] = None
+        return Bill.model_validate(raw_data)
+
     async def parse(self, input_data: RawText) -> Bill:
         try:
-            prompt = PromptHelper.generate_text_to_bill_prompt(input_data)
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You must always end your response with a single valid JSON object and nothing else after it.",  # noqa: E501
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-            )
-            response_text = response.choices[0].message.content
-            if response_text is None:
-                raise ValueError(f"Received empty response from {self.name}")
-            # Strip <think>...</think> blocks produced by reasoning models (e.g. Qwen3)
-            response_text = re.sub(r"<think>.*?</think>", "", response_text, flags=re.DOTALL).strip()
-            if not response_text:
-                raise ValueError(f"Response from {self.name} is empty after stripping think tags")
-            raw_data = json.loads(response_text)
-            transaction_type_str = raw_data.get("transaction_type")
-            if transaction_type_str != "信用卡还款":
-                catename_str = raw_data.get("catename")
-                accountname_str = raw_data.get("accountname")
-                assert transaction_type_str in TransactionType, (
-                    f"Unknown transaction type '{transaction_type_str}' in {self.name} response"
-                )
-                assert catename_str in category_helper.categories[transaction_type_str], (
-                    f"Unknown category name '{catename_str}' for "
-                    f"transaction type '{transaction_type_str}' in {self.name} response"
-                )
-                assert accountname_str in asset_helper.assets, (
-                    f"Unknown account name '{accountname_str}' for "
-                    f"transaction type '{transaction_type_str}' in {self.name} response"
-                )
-                raw_data["transaction_type"] = TransactionType(transaction_type_str)
-                raw_data["catename"] = category_helper.get_category(raw_data["transaction_type"], catename_str)
-                raw_data["accountname"] = asset_helper.get_asset(accountname_str)
-                raw_data["accountname2"] = None
-            else:
-                raw_data["transaction_type"] = TransactionType.CREDIT_CARD_REPAYMENT
-                raw_data["accountname"] = asset_helper.get_asset(raw_data["accountname"])
-                raw_data["accountname2"] = asset_helper.get_asset(raw_data["accountname2"])
-                raw_data["catename"] = None
-            return Bill.model_validate(raw_data)
+            duplicate = bill_index.lookup(input_data)
+            if duplicate is not None:
+                logger.info(f"Skipping {self.name} call for an already booked transaction")
+                return duplicate
+            bill, _ = await self.parse_with_confidence(input_data, ask_confidence=False)
+            bill_index.add(bill, input_data)
+            classification_memory.learn(bill, input_data)
+            return bill
         except Exception as e:
             logger.error(f"Error during {self.name} parsing: {e}", exc_info=True)
             raise
 
+    async def parse_with_confidence(
+        self, input_data: RawText, ask_confidence: bool = True
+    ) -> tuple[Bill, float | None]:
+        """
+        Parse a bill, asking the model to also report its confidence. The duplicate index and the
+        classification memory are not updated, the caller decides whether the bill is kept.
+
+        When the classification memory recognizes the text, the model is only asked for the amount
+        and time, and the confidence is the one of the memory. If no valid bill comes out of that
+        answer (e.g. an amount of -1), the text is parsed with the full prompt.
+
+        Returns:
+            tuple[Bill, float | None]: The validated bill, and the confidence clamped to [0, 1], None
+            if it was not asked for or not reported as a number.
+
+        Raises:
+            AssertionError: If the transaction type, category or account is unknown.
+            NoBillFoundError: If the model answers that the text holds no bill.
+        """
+        match = classification_memory.match(input_data)
+        if match is not None:
+            try:
+                bill = await self._parse_classified(input_data, match.classification)
+                return bill, match.confidence if ask_confidence else None
+            except ValueError as e:
+                logger.warning(f"{self.name} could not complete the bill classified by the memory: {e}")
+                metrics.inc("classification_memory_bills_total", parser=self.name, extraction="fallback")
+        prompt = PromptHelper.generate_text_to_bill_prompt(
+            input_data, with_confidence=ask_confidence, compact=self._compact_prompt()
+        )
+        response_text = await self._complete(
+            prompt,
+            "You must always end your response with a single valid JSON object and nothing else after it.",
+        )
+        raw_data = json.loads(response_text)
+        if raw_data.get("amount") == NO_BILL_AMOUNT:
+            raise NoBillFoundError(f"{self.name} found no bill in the text")
+        confidence = raw_data.pop("confidence", None)
+        if isinstance(confidence, bool) or not isinstance(confidence, int | float):
+            confidence = None
+        else:
+            confidence = min(max(float(confidence), 0.0), 1.0)
+        return self._build_bill(raw_data), confidence
+
+    async def _parse_classified(self, input_data: RawText, classification: Classification) -> Bill:
+        """
+        Parse a bill whose classification is known: only the amount, time, remark and fee are
+        extracted, locally when the text holds a single amount and time and local extraction is on
+        (or the token budget only allows local results).
+        """
+        if classification_memory.local_extraction or current_degradation() is Degradation.LOCAL_ONLY:
+            amounts, times = extract_amounts(input_data), extract_times(input_data)
+            if len(amounts) == 1 and len(times) == 1:
+                metrics.inc("classification_memory_bills_total", parser=self.name, extraction="local")
+                return classification.to_bill(amount=amounts[0] / 100, time=times[0])
+        response_text = await self._complete(
+            PromptHelper.generate_text_to_amount_prompt(input_data),
+            "You must always end your response with a single valid JSON object and nothing else after it.",
+        )
+        raw_data = json.loads(response_text)
+        bill = classification.to_bill(
+            amount=raw_data.get("amount"),
+            time=raw_data.get("time"),
+            remark=raw_data.get("remark"),
+            fee=raw_data.get("fee"),
+        )
+        metrics.inc("classification_memory_bills_total", parser=self.name, extraction="llm")
+        return bill
+
+    async def parse_batch(self, inputs: list[RawText]) -> list[Bill | Exception]:
+        """
+        Parse several OCR texts, packing them into multi-bill requests so that the static prompt
+        prefix is paid once per request instead of once per bill.
+
+        Returns:
+            list[Bill | Exception]: One result per input, in input order. Inputs that could not be
+            parsed even on their own get the exception instead of a bill.
+        """
+        results: list[Bill | Exception | None] = [None] * len(inputs)
+        pending: list[int] = []
+        for idx, raw_text in enumerate(inputs):
+            duplicate = bill_index.lookup(raw_text)
+            if duplicate is not None:
+                results[idx] = duplicate
+            else:
+                pending.append(idx)
+        for chunk in self._plan_batches([inputs[idx] for idx in pending]):
+            chunk_indices = [pending[idx] for idx in chunk]
+            chunk_results = await self._parse_chunk([inputs[idx] for idx in chunk_indices])
+            for idx, result in zip(chunk_indices, chunk_results, strict=True):
+                results[idx] = result
+        return results
+
+    def _plan_batches(self, inputs: list[RawText]) -> list[list[int]]:
+        """
+        Group input indices into batches fitting the token budget and the maximum batch size.
+        """
+        prefix_tokens = TokenHelper.estimate_tokens(PromptHelper.generate_texts_to_bills_prompt([]))
+        batches: list[list[int]] = []
+        current: list[int] = []
+        current_tokens = prefix_tokens
+        for idx, raw_text in enumerate(inputs):
+            # Each bill also costs its header and, in the answer, a JSON object
+            cost = TokenHelper.estimate_tokens(raw_text) + BATCH_ITEM_OVERHEAD_TOKENS
+            if current and (current_tokens + cost > self.batch_max_tokens or len(current) >= self.batch_max_size):
+                batches.append(current)
+                current, current_tokens = [], prefix_tokens
+            current.append(idx)
+            current_tokens += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _parse_chunk(self, inputs: list[RawText]) -> list[Bill | Exception]:
+        """
+        Parse a batch in a single request. If the answer cannot be parsed, the batch is split in
+        halves; elements failing validation are retried in smaller batches down to single bills.
+        Elements answered without a bill (amount -1, e.g. a statement total row) get a
+        `NoBillFoundError` and are not retried. A failed request (provider or transport error, exhausted
+        deadline or token budget) fails the whole batch: splitting it would only multiply the calls.
+        """
+        if len(inputs) == 1:
+            try:
+                return [await self.parse(inputs[0])]
+            except Exception as e:
+                return [e]
+        try:
+            response_text = await self._complete(
+                PromptHelper.generate_texts_to_bills_prompt(inputs, compact=self._compact_prompt()),
+                "You must always end your response with a single valid JSON array and nothing else after it.",
+                expect_array=True,
+            )
+        except Exception as e:
+            logger.warning(f"Batch of {len(inputs)} bills failed in {self.name}: {e}")
+            return [e] * len(inputs)
+        try:
+            raw_items = json.loads(response_text)
+            if not isinstance(raw_items, list):
+                raise ValueError(f"Expected a JSON array from {self.name}, got {type(raw_items).__name__}")
+        except ValueError as e:
+            logger.warning(
+                f"Answer to a batch of {len(inputs)} bills could not be parsed in {self.name}, splitting: {e}"
+            )
+            metrics.inc("llm_batch_splits_total", parser=self.name)
+            middle = len(inputs) // 2
+            return [*await self._parse_chunk(inputs[:middle]), *await self._parse_chunk(inputs[middle:])]
+
+        results: list[Bill | Exception | None] = [None] * len(inputs)
+        for raw_data in raw_items:
+            idx = raw_data.pop("id", None) if isinstance(raw_data, dict) else None
+            if not isinstance(idx, int) or not 0 <= idx < len(inputs) or results[idx] is not None:
+                continue
+            if raw_data.get("amount") == NO_BILL_AMOUNT:
+                results[idx] = NoBillFoundError(f"{self.name} found no bill in batch item id={idx}")
+                continue
+            try:
+                results[idx] = self._build_bill(raw_data)
+                bill_index.add(results[idx], inputs[idx])
+                classification_memory.learn(results[idx], inputs[idx])
+            except Exception as e:
+                logger.warning(f"Bill id={idx} of a batch failed validation in {self.name}: {e}")
+        failed = [idx for idx, result in enumerate(results) if result is None]
+        metrics.inc("llm_batch_requests_total", parser=self.name)
+        metrics.observe("llm_batch_size", len(inputs), parser=self.name)
+        if failed:
+            metrics.inc("llm_batch_retried_items_total", len(failed), parser=self.name)
+            middle = (len(failed) + 1) // 2
+            retried: list[Bill | Exception] = []
+            for part in (failed[:middle], failed[middle:]):
+                if part:
+                    retried.extend(await self._parse_chunk([inputs[idx] for idx in part]))
+            for idx, result in zip(failed, retried, strict=True):
+                results[idx] = result
+        return results
+
 
 class DeepSeekParser(OpenAICompatibleLLMParser):
     name = "deepseek_chat"
@@ -1,16 +1,97 @@
+import math
+import re
+from collections import Counter
+from collections.abc import Iterable
 from datetime import datetime
 from logging import getLogger
 
+from ..compiled_config import load_compiled_config
 from ..config import settings
-from ..models import AssetItem, Bill, CategoryItem, RawText, TransactionType
+from ..models import AssetItem, Bill, CategoryItem, OcrLine, RawText, TransactionType
 
 logger = getLogger(__name__)
 
+# Default items are interned: every lookup miss returns these same instances.
+DEFAULT_CATEGORY = CategoryItem(
+    transaction_type=TransactionType.EXPENSE,
+    l1_name="其它",
+    l1_desc="其它",
+    l2_name="其它",
+    l2_desc="其它",
+    match_rules=[],
+)
+DEFAULT_ASSET = AssetItem(
+    account_name="无",
+    account_desc="无",
+    match_rules=[],
+)
+
+
+class LexicalIndex:
+    """
+    A small BM25 index over character n-grams, suited to short Chinese texts without a word
+    segmenter. Documents are identified by string keys.
+    """
+
+    _TOKEN_RUN_PATTERN = re.compile(r"[0-9A-Za-z\u4e00-\u9fff]+")
+
+    def __init__(self, documents: dict[str, str], ngram: int = 2, k1: float = 1.5, b: float = 0.75) -> None:
+        self.ngram = ngram
+        self.k1 = k1
+        self.b = b
+        self.term_freqs: dict[str, Counter[str]] = {
+            key: Counter(self.tokenize(text)) for key, text in documents.items()
+        }
+        self.doc_lens = {key: sum(freqs.values()) for key, freqs in self.term_freqs.items()}
+        self.avg_doc_len = sum(self.doc_lens.values()) / len(self.doc_lens) if self.doc_lens else 0.0
+        doc_freqs: Counter[str] = Counter()
+        for freqs in self.term_freqs.values():
+            doc_freqs.update(freqs.keys())
+        n_docs = len(self.term_freqs)
+        self.idf = {term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def tokenize(self, text: str) -> list[str]:
+        tokens: list[str] = []
+        for run in self._TOKEN_RUN_PATTERN.findall(text.lower()):
+            if len(run) <= self.ngram:
+                tokens.append(run)
+                continue
+            tokens.extend(run[i : i + self.ngram] for i in range(len(run) - self.ngram + 1))
+        return tokens
+
+    def search(
+        self, query: str, top_k: int | None = None, keys: Iterable[str] | None = None
+    ) -> list[tuple[str, float]]:
+        """
+        Score documents against the query.
+
+        Args:
+            query :str: The query text, e.g. OCR text of a bill.
+            top_k :int | None: Maximum number of results, all matching documents if None.
+            keys :Iterable[str] | None: Restrict the search to these documents.
+
+        Returns:
+            list[tuple[str, float]]: Document keys and scores, best first, zero scores excluded.
+        """
+        query_terms = set(self.tokenize(query))
+        scores: list[tuple[str, float]] = []
+        for key in keys if keys is not None else self.term_freqs:
+            freqs = self.term_freqs[key]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lens[key] / (self.avg_doc_len or 1))
+            score = 0.0
+            for term in query_terms & freqs.keys():
+                tf = freqs[term]
+                score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((key, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:top_k] if top_k is not None else scores
+
 
 class CategoryHelper:
     """
     A helper class for category-related operations, including:
-        - Loading category mappings from settings.
+        - Loading category mappings from the compiled configuration.
         - Getting category by transaction type and name.
         - Dumping categories to text prompt format.
     """
@@ -21,48 +102,15 @@ class CategoryHelper:
     def _initialize(self):
         if self._initialized:
             return
-        assert "categories" in settings, "Category settings not found"
-        self.categories: dict[TransactionType, dict[str, CategoryItem]] = {}
-        for category_group in settings["categories"]:
-            transaction_type_str = category_group.get("transaction_type")
-            if not transaction_type_str:
-                logger.warning("Transaction type missing in category settings")
-                continue
-            if transaction_type_str not in TransactionType:
-                logger.warning(f"Unknown transaction type '{transaction_type_str}' in category settings")
-                continue
-            transaction_type_enum = TransactionType(transaction_type_str)
-            self.categories[transaction_type_enum] = {}
-            l1_items = category_group.get("items", [])
-            for l1_item in l1_items:
-                l1_name = l1_item["l1_name"]
-                l1_desc = l1_item.get("description", "")
-                l2_items = l1_item.get("items", [])
-                if len(l2_items) == 0:
-                    category_item = CategoryItem(
-                        transaction_type=transaction_type_enum,
-                        l1_name=l1_name,
-                        l1_desc=l1_desc,
-                        l2_name=None,
-                        l2_desc=None,
-                        match_rules=l1_item.get("match_rules", []),
-                    )
-                    self.categories[transaction_type_enum][l1_name] = category_item
-                else:
-                    for l2_item in l2_items:
-                        l2_name = l2_item["l2_name"]
-                        l2_desc = l2_item.get("description", "")
-                        category_item = CategoryItem(
-                            transaction_type=transaction_type_enum,
-                            l1_name=l1_name,
-                            l1_desc=l1_desc,
-                            l2_name=l2_name,
-                            l2_desc=l2_desc,
-                            match_rules=l2_item.get("match_rules", []),
-                        )
-                        self.categories[transaction_type_enum][l2_name] = category_item
+        compiled = load_compiled_config()
+        self.categories: dict[TransactionType, dict[str, CategoryItem]] = compiled.categories
+        self.index = compiled.category_index
         self._initialized = True
 
+    @staticmethod
+    def _index_key(transaction_type: TransactionType, name: str) -> str:
+        return f"{transaction_type.value}/{name}"
+
     def get_category(self, transaction_type: TransactionType, name: str) -> CategoryItem:
         """
         Get category item by transaction type and name.
@@ -75,18 +123,72 @@ class CategoryHelper:
         if name not in self.categories[transaction_type]:
             logger.warning(f"Category name '{name}' not found under transaction type '{transaction_type}'")
             return self.get_default_category()
-        return self.categories[transaction_type].get(name, self.get_default_category())
+        return self.categories[transaction_type][name]
 
-    def dump_categories_to_prompt(self) -> str:
+    def select_categories(
+        self, raw_text: str, top_k: int, always_include: Iterable[str] = ()
+    ) -> dict[TransactionType, dict[str, CategoryItem]]:
+        """
+        Select the categories most relevant to the OCR text.
+
+        Args:
+            raw_text :str: OCR text of the bill.
+            top_k :int: Number of candidates kept per transaction type.
+            always_include :Iterable[str]: Category names kept regardless of their score.
+
+        Returns:
+            dict[TransactionType, dict[str, CategoryItem]]: Selected categories, in configuration order.
+        """
+        self._initialize()
+        always_include = set(always_include)
+        selected: dict[TransactionType, dict[str, CategoryItem]] = {}
+        for transaction_type, categories in self.categories.items():
+            keys = [self._index_key(transaction_type, name) for name in categories]
+            hits = {key for key, _ in self.index.search(raw_text, top_k=top_k, keys=keys)}
+            selected[transaction_type] = {
+                name: category
+                for name, category in categories.items()
+                if name in always_include or self._index_key(transaction_type, name) in hits
+            }
+        return selected
+
+    def prompt_categories(
+        self, raw_text: str | None = None, top_k: int = 0
+    ) -> dict[TransactionType, dict[str, CategoryItem]]:
+        """
+        Get the categories offered to the LLM: the selected ones plus the default category.
+
+        Args:
+            raw_text :str | None: OCR text used to select relevant categories.
+            top_k :int: Number of candidates kept per transaction type, 0 to offer all categories.
+
+        Returns:
+            dict[TransactionType, dict[str, CategoryItem]]: Candidate categories.
+        """
+        self._initialize()
+        if raw_text is None or top_k <= 0:
+            return self.categories
+        prompt_settings = settings.get("prompt", {}) or {}
+        selected = self.select_categories(raw_text, top_k, prompt_settings.get("always_include_categories", []))
+        default_category = self.get_default_category()
+        selected.setdefault(default_category.transaction_type, {}).setdefault(
+            default_category.l2_name, default_category
+        )
+        return selected
+
+    def dump_categories_to_prompt(self, raw_text: str | None = None, top_k: int = 0) -> str:
         """
         Dump categories to text prompt format.
 
+        Args:
+            raw_text :str | None: OCR text used to select relevant categories.
+            top_k :int: Number of candidates kept per transaction type, 0 to dump all categories.
+
         Returns:
             str: Categories in text prompt format.
         """
-        self._initialize()
         prompt_lines = []
-        for transaction_type, categories in self.categories.items():
+        for transaction_type, categories in self.prompt_categories(raw_text, top_k).items():
             for category in categories.values():
                 if category.l2_name:
                     line = (
@@ -113,20 +215,13 @@ class CategoryHelper:
         """
         Get default category item for a given transaction type.
         """
-        return CategoryItem(
-            transaction_type=TransactionType.EXPENSE,
-            l1_name="其它",
-            l1_desc="其它",
-            l2_name="其它",
-            l2_desc="其它",
-            match_rules=[],
-        )
+        return DEFAULT_CATEGORY
 
 
 class AssetHelper:
     """
     A helper class for asset-related operations, including:
-        - Loading asset mappings from settings.
+        - Loading asset mappings from the compiled configuration.
         - Getting asset by account name.
         - Dumping assets to text prompt format.
     """
@@ -137,19 +232,9 @@ class AssetHelper:
     def _initialize(self):
         if self._initialized:
             return
-        assert "assets" in settings, "Asset settings not found"
-        self.assets: dict[str, AssetItem] = {}
-        asset_items = settings.get("assets", [])
-        for asset_item in asset_items:
-            account_name = asset_item["account_name"]
-            account_desc = asset_item.get("description", "")
-            match_rules = asset_item.get("match_rules", [])
-            asset = AssetItem(
-                account_name=account_name,
-                account_desc=account_desc,
-                match_rules=match_rules,
-            )
-            self.assets[account_name] = asset
+        compiled = load_compiled_config()
+        self.assets: dict[str, AssetItem] = compiled.assets
+        self.index = compiled.asset_index
         self._initialized = True
 
     def get_asset(self, account_name: str) -> AssetItem:
@@ -161,18 +246,58 @@ class AssetHelper:
         if account_name not in self.assets:
             logger.warning(f"Account name '{account_name}' not found in assets")
             return self.get_default_asset()
-        return self.assets.get(account_name, self.get_default_asset())
+        return self.assets[account_name]
+
+    def select_assets(self, raw_text: str, top_k: int, always_include: Iterable[str] = ()) -> dict[str, AssetItem]:
+        """
+        Select the assets most relevant to the OCR text.
+
+        Args:
+            raw_text :str: OCR text of the bill.
+            top_k :int: Number of candidates kept.
+            always_include :Iterable[str]: Account names kept regardless of their score.
+
+        Returns:
+            dict[str, AssetItem]: Selected assets, in configuration order.
+        """
+        self._initialize()
+        always_include = set(always_include)
+        hits = {key for key, _ in self.index.search(raw_text, top_k=top_k)}
+        return {name: asset for name, asset in self.assets.items() if name in hits or name in always_include}
 
-    def dump_assets_to_prompt(self) -> str:
+    def prompt_assets(self, raw_text: str | None = None, top_k: int = 0) -> dict[str, AssetItem]:
+        """
+        Get the assets offered to the LLM: the selected ones plus the default asset.
+
+        Args:
+            raw_text :str | None: OCR text used to select relevant assets.
+            top_k :int: Number of candidates kept, 0 to offer all assets.
+
+        Returns:
+            dict[str, AssetItem]: Candidate assets.
+        """
+        self._initialize()
+        if raw_text is None or top_k <= 0:
+            return self.assets
+        prompt_settings = settings.get("prompt", {}) or {}
+        selected = self.select_assets(raw_text, top_k, prompt_settings.get("always_include_assets", []))
+        default_asset = self.get_default_asset()
+        selected.setdefault(default_asset.account_name, default_asset)
+        return selected
+
+    def dump_assets_to_prompt(self, raw_text: str | None = None, top_k: int = 0) -> str:
         """
         Dump assets to text prompt format.
 
+        Args:
+            raw_text :str | None: OCR text used to select relevant assets.
+            top_k :int: Number of candidates kept, 0 to dump all assets.
+
         Returns:
             str: Assets in text prompt format.
         """
-        self._initialize()
         prompt_lines = []
-        for asset in self.assets.values():
+        for asset in self.prompt_assets(raw_text, top_k).values():
             line = (
                 f"- 账户名称: {asset.account_name}, 账户描述: {asset.account_desc}, 强制匹配规则: {asset.match_rules}"
             )
@@ -183,29 +308,11 @@ class AssetHelper:
         """
         Get default asset item.
         """
-        return AssetItem(
-            account_name="无",
-            account_desc="无",
-            match_rules=[],
-        )
-
-
-class PromptHelper:
-    """
-    A helper class for generating prompts using category and asset helpers.
-    """
+        return DEFAULT_ASSET
 
-    @classmethod
-    def generate_text_to_bill_prompt(cls, raw_text: RawText) -> str:
-        category_prompt = category_helper.dump_categories_to_prompt()
-        asset_prompt = asset_helper.dump_assets_to_prompt()
 
-        prompt = f"""
-You are an expert accounting assistant.
-Analyze the provided bill text and extract the fields into a valid JSON object.
-You must only return a single, minified JSON object and nothing else.
-The JSON must conform to this Pydantic schema:
-{{
+BILL_SCHEMA_AND_RULES = """
+{
             "transaction_type": "'支出' | '收入' | '转账' | '信用卡还款'",
     "amount": "float",
     "time": "string" (format: 'YYYY-MM-DD HH:MM:SS'),
@@ -214,7 +321,7 @@ The JSON must conform to this Pydantic schema:
     "accountname": "string" (The merchant or person),
     "accountname2": "string|null" (See rules below),
     "fee": "float | null"
-}}
+}
 
 Here are the detailed rules:
 - transaction_type
@@ -235,6 +342,74 @@ Here are the detailed rules:
     账户名称2。当且仅当 transaction_type 为 '转账' 或 '信用卡还款' 时，该字段必须是一个非空字符串，表示资金的流入方。
 - fee
     交易手续费。可以是一个浮点数或 null，表示交易的手续费，绝大多数情况为 null。
+""".strip()  # noqa: RUF001
+
+
+AMOUNT_SCHEMA_AND_RULES = """
+{
+    "amount": "float",
+    "time": "string" (format: 'YYYY-MM-DD HH:MM:SS'),
+    "remark": "string|null",
+    "fee": "float | null"
+}
+
+Here are the detailed rules:
+- amount
+    交易金额。必须是一个正数，表示实际支付或收到的金额。
+- time
+    交易时间。必须是一个字符串，格式为 'YYYY-MM-DD HH:MM:SS'。
+- remark
+    交易备注。简短词汇备注交易商品或服务内容，没有识别到有效备注信息时设为 null。
+- fee
+    交易手续费。可以是一个浮点数或 null，绝大多数情况为 null。
+""".strip()  # noqa: RUF001
+
+
+CONFIDENCE_RULE = """
+另外，JSON 对象还必须包含一个额外的 "confidence" 字段（0 到 1 之间的浮点数），
+表示你对交易类型、分类和账户判断的把握程度；OCR 文字模糊、信息缺失或难以确定分类时请给出较低的值。
+"""  # noqa: RUF001
+
+
+class PromptHelper:
+    """
+    A helper class for generating prompts using category and asset helpers.
+    """
+
+    @classmethod
+    def _dump_candidates(cls, raw_text: str, top_k_scale: int = 1, compact: bool = False) -> tuple[str, str]:
+        """
+        Category and asset lists of a prompt. Compact prompts keep at most `compact_top_k`
+        candidates of each list.
+        """
+        prompt_settings = settings.get("prompt", {}) or {}
+        category_top_k = int(prompt_settings.get("category_top_k", 0))
+        asset_top_k = int(prompt_settings.get("asset_top_k", 0))
+        if compact:
+            compact_top_k = int(prompt_settings.get("compact_top_k", 5))
+            category_top_k = min(category_top_k, compact_top_k) if category_top_k > 0 else compact_top_k
+            asset_top_k = min(asset_top_k, compact_top_k) if asset_top_k > 0 else compact_top_k
+        category_prompt = category_helper.dump_categories_to_prompt(raw_text, top_k=category_top_k * top_k_scale)
+        asset_prompt = asset_helper.dump_assets_to_prompt(raw_text, top_k=asset_top_k * top_k_scale)
+        return category_prompt, asset_prompt
+
+    @classmethod
+    def generate_text_to_bill_prompt(
+        cls, raw_text: RawText, with_confidence: bool = False, compact: bool = False
+    ) -> str:
+        """
+        Generate the prompt extracting a single bill. With `with_confidence`, the model is also asked
+        for a "confidence" field, used by the LLM cascade to decide whether to escalate. With
+        `compact`, only the best category and asset candidates are listed.
+        """
+        category_prompt, asset_prompt = cls._dump_candidates(raw_text, compact=compact)
+
+        prompt = f"""
+You are an expert accounting assistant.
+Analyze the provided bill text and extract the fields into a valid JSON object.
+You must only return a single, minified JSON object and nothing else.
+The JSON must conform to this Pydantic schema:
+{BILL_SCHEMA_AND_RULES}
 
 以下为交易类别列表:
 {category_prompt}
@@ -252,9 +427,119 @@ Here are the detailed rules:
 再次强调，你的回复必须仅包含一个符合上述 Pydantic 模式的 JSON 对象，且不能包含任何其他文本。
 如果没有识别到有效信息，请将amount字段设为-1，并将其他字段设为null或合适的空值。
 """  # noqa: RUF001
+        if with_confidence:
+            prompt += CONFIDENCE_RULE
 
         return prompt.strip()
 
+    @classmethod
+    def generate_text_to_amount_prompt(cls, raw_text: RawText) -> str:
+        """
+        Generate the prompt extracting only the amount, time, remark and fee of a bill whose
+        classification is already known, without the category and asset lists.
+        """
+        prompt = f"""
+You are an expert accounting assistant.
+Analyze the provided bill text and extract the fields into a valid JSON object.
+You must only return a single, minified JSON object and nothing else.
+The JSON must conform to this schema:
+{AMOUNT_SCHEMA_AND_RULES}
+
+以下为 OCR 文字内容:
+{raw_text}
+
+账单内容到此结束
+
+再次强调，你的回复必须仅包含一个符合上述模式的 JSON 对象，且不能包含任何其他文本。
+如果没有识别到有效信息，请将amount字段设为-1，并将其他字段设为null。
+"""  # noqa: RUF001
+
+        return prompt.strip()
+
+    @classmethod
+    def generate_texts_to_bills_prompt(cls, raw_texts: list[RawText], compact: bool = False) -> str:
+        """
+        Generate a single prompt classifying several bills, answered with a JSON array whose
+        elements carry the id of their bill text.
+        """
+        category_prompt, asset_prompt = cls._dump_candidates(
+            "\n".join(raw_texts), top_k_scale=len(raw_texts), compact=compact
+        )
+        bill_texts = "\n\n".join(f"### 账单 id={idx}\n{raw_text}" for idx, raw_text in enumerate(raw_texts))
+
+        prompt = f"""
+You are an expert accounting assistant.
+Analyze each of the {len(raw_texts)} provided bill texts and extract the fields of each bill into a JSON object.
+You must only return a single, minified JSON array containing one object per bill and nothing else.
+Each object must have an extra "id" field (integer) equal to the id of its bill text,
+and otherwise conform to this Pydantic schema:
+{BILL_SCHEMA_AND_RULES}
+
+以下为交易类别列表:
+{category_prompt}
+
+以下为资产列表:
+{asset_prompt}
+
+请根据每张账单截图的 OCR 文字内容，分别提取符合上述 Pydantic 模式的 JSON 对象，并按 id 顺序组成 JSON 数组返回。
+
+以下为 {len(raw_texts)} 张账单的 OCR 文字内容:
+{bill_texts}
+
+账单内容到此结束
+
+再次强调，你的回复必须仅包含一个 JSON 数组，数组中每个元素对应一张账单并包含其 id，且不能包含任何其他文本。
+如果某张账单没有识别到有效信息，请将该元素的amount字段设为-1，并将其他字段设为null或合适的空值。
+"""  # noqa: RUF001
+
+        return prompt.strip()
+
+
+class LayoutHelper:
+    """
+    A helper class for working with the OCR layout of recognized lines.
+    """
+
+    @classmethod
+    def group_rows(cls, layout: Iterable[OcrLine]) -> list[list[OcrLine]]:
+        """
+        Group OCR lines into visual rows: lines overlapping vertically by more than half of the
+        smaller height are on the same row. Rows are ordered top to bottom, lines left to right.
+        """
+        rows: list[list[OcrLine]] = []
+        for line in sorted(layout, key=lambda item: (item.top, item.left)):
+            if rows:
+                row = rows[-1]
+                row_top = min(item.top for item in row)
+                row_bottom = max(item.bottom for item in row)
+                overlap = min(row_bottom, line.bottom) - max(row_top, line.top)
+                if overlap > min(line.height, row_bottom - row_top) / 2:
+                    row.append(line)
+                    continue
+            rows.append([line])
+        return [sorted(row, key=lambda item: item.left) for row in rows]
+
+    @classmethod
+    def row_text(cls, row: list[OcrLine]) -> str:
+        return " ".join(item.text for item in row)
+
+
+class TokenHelper:
+    """
+    A helper class for estimating LLM token counts without a tokenizer.
+    """
+
+    # Ratios published by DeepSeek: one CJK character is about 0.6 token, one other character about 0.3 token.
+    CJK_TOKEN_RATIO = 0.6
+    OTHER_TOKEN_RATIO = 0.3
+    _CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        cjk_count = len(cls._CJK_PATTERN.findall(text))
+        other_count = sum(1 for char in text if not char.isspace()) - cjk_count
+        return math.ceil(cjk_count * cls.CJK_TOKEN_RATIO + other_count * cls.OTHER_TOKEN_RATIO)
+
 
 class BillHelper:
     @classmethod
@@ -270,6 +555,40 @@ class BillHelper:
             fee=None,
         )
 
+    @classmethod
+    def retrieval_recall(
+        cls, cases: Iterable[tuple[RawText, Bill]], *, category_top_k: int, asset_top_k: int
+    ) -> dict[str, float]:
+        """
+        Measure how often the expected category and account are among the prompt candidates,
+        the default category and account included.
+
+        Args:
+            cases :Iterable[tuple[RawText, Bill]]: OCR texts with their expected bills.
+            category_top_k :int: Number of category candidates kept per transaction type.
+            asset_top_k :int: Number of asset candidates kept.
+
+        Returns:
+            dict[str, float]: Recall of categories and of accounts, between 0 and 1.
+        """
+        category_hits = category_total = asset_hits = asset_total = 0
+        for raw_text, bill in cases:
+            if bill.catename is not None:
+                category_total += 1
+                candidates = category_helper.prompt_categories(raw_text, category_top_k)
+                category_hits += bill.catename in candidates.get(bill.transaction_type, {}).values()
+            for account in (bill.accountname, bill.accountname2):
+                if account is None:
+                    continue
+                asset_total += 1
+                asset_hits += account in asset_helper.prompt_assets(raw_text, asset_top_k).values()
+        recall = {
+            "category_recall": category_hits / category_total if category_total else 1.0,
+            "asset_recall": asset_hits / asset_total if asset_total else 1.0,
+        }
+        logger.info(f"Prompt candidate retrieval recall: {recall}")
+        return recall
+
     @classmethod
     def compare_bill(
         cls,
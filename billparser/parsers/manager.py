@@ -88,6 +88,13 @@ class ParserManager:
                 continue
         return registry
 
+    @property
+    def parsers(self) -> dict[str, BaseParser]:
+        """
+        The instantiated parsers by name.
+        """
+        return dict(self._registry)
+
     def get_parser(self, name: str) -> BaseParser:
         """
         Returns an instance of the parser with the given name.
@@ -100,5 +107,18 @@ class ParserManager:
             raise KeyError(f"Parser '{name}' not found in registry. Available parsers: {list(self._registry.keys())}")
         return self._registry[name]
 
+    async def aclose(self) -> None:
+        """
+        Release the resources of the parsers that hold some (see `BaseParser`).
+        """
+        for name, parser in self._registry.items():
+            aclose = getattr(parser, "aclose", None)
+            if aclose is None:
+                continue
+            try:
+                await aclose()
+            except Exception as e:
+                logger.warning(f"Failed to close parser '{name}': {e}")
+
 
 parser_manager = ParserManager()
@@ -0,0 +1,122 @@
+import asyncio
+import re
+from collections.abc import AsyncIterator
+from logging import getLogger
+
+from ..config import settings
+from ..fingerprint import extract_card_tail
+from ..metrics import metrics
+from ..models import Bill, BillList, RawText
+from .base import BaseParser
+from .ds_parsers import NoBillFoundError
+from .helpers import LayoutHelper
+
+logger = getLogger(__name__)
+
+# A transaction row is anchored by its amount, e.g. "-53.70", "+1,200.00", "¥53.70"
+_AMOUNT_PATTERN = re.compile(r"[-+¥￥]?\s*(?:\d{1,3}(?:,\d{3})+|\d+)\.\d{2}(?![\d.])")
+_TIME_PATTERN = re.compile(r"\d{1,2}[-/月]\d{1,2}|\d{1,2}:\d{2}")
+
+
+def segment_rows(raw_text: RawText) -> tuple[list[RawText], list[str]]:
+    """
+    Split the OCR text of a bill list screenshot or a statement into one text per transaction.
+
+    With a layout, lines are grouped into visual rows and every row holding an amount starts a
+    new transaction; the rows below it (date, category...) are attached to it. Without a layout,
+    a transaction starts at the line preceding an amount line when that line is a description.
+
+    Returns:
+        tuple[list[RawText], list[str]]: Transaction texts, and the header lines found before the
+        first transaction.
+    """
+    if raw_text.layout:
+        lines = [LayoutHelper.row_text(row) for row in LayoutHelper.group_rows(raw_text.layout)]
+        starts = [idx for idx, line in enumerate(lines) if _AMOUNT_PATTERN.search(line)]
+    else:
+        lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
+        starts = []
+        for idx, line in enumerate(lines):
+            if not _AMOUNT_PATTERN.search(line):
+                continue
+            previous = lines[idx - 1] if idx > 0 else None
+            is_description = (
+                previous is not None
+                and not _AMOUNT_PATTERN.search(previous)
+                and not _TIME_PATTERN.search(previous)
+                and (not starts or idx - 1 > starts[-1])
+            )
+            starts.append(idx - 1 if is_description else idx)
+    if not starts:
+        return [], lines
+    rows = [RawText("\n".join(lines[start:end])) for start, end in zip(starts, [*starts[1:], len(lines)], strict=True)]
+    return rows, lines[: starts[0]]
+
+
+class MultiBillParser(BaseParser[RawText, BillList]):
+    """
+    Parses OCR text holding several transactions (Alipay/WeChat bill list screenshots, credit card
+    statements) into many bills. Rows are segmented locally and classified in batches by the
+    configured LLM parser.
+    """
+
+    name = "multi_bill"
+
+    def __init__(self):
+        logger.debug(f"Initializing {self.name}")
+        assert self.name in settings["parsers"] or self.name.upper() in settings["parsers"], (
+            f"Parser settings for {self.name} not found"
+        )
+        parser_cfg = settings["parsers"][self.name] or {}
+        self.llm_name: str = parser_cfg.get("llm") or "deepseek_chat"
+        self.rows_per_batch: int = int(parser_cfg.get("rows_per_batch", 10))
+        self.concurrency: int = int(parser_cfg.get("concurrency", 2))
+
+    @property
+    def llm(self):
+        # Resolved lazily: the parser manager is still being built while parsers are instantiated
+        from .manager import parser_manager
+
+        llm = parser_manager.get_parser(self.llm_name)
+        assert hasattr(llm, "parse_batch"), f"Parser '{self.llm_name}' does not support batch parsing"
+        return llm
+
+    async def parse(self, input_data: RawText) -> BillList:
+        return BillList([bill async for bill in self.parse_stream(input_data)])
+
+    async def parse_stream(self, input_data: RawText) -> AsyncIterator[Bill]:
+        """
+        Parse the transactions of the text, yielding bills as soon as their batch is classified.
+        Rows that do not validate as a bill (e.g. monthly totals) are skipped.
+        """
+        rows, header = segment_rows(input_data)
+        logger.info(f"{self.name} segmented {len(rows)} transaction rows")
+        metrics.observe("multi_bill_rows", len(rows))
+        card_tail = extract_card_tail("\n".join(header))
+        if card_tail:
+            rows = [RawText(f"{row}\n付款卡尾号 {card_tail}") for row in rows]
+        llm = self.llm
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def classify(batch: list[RawText]) -> list[Bill | Exception]:
+            async with semaphore:
+                return await llm.parse_batch(batch)
+
+        tasks = [
+            asyncio.create_task(classify(rows[i : i + self.rows_per_batch]))
+            for i in range(0, len(rows), self.rows_per_batch)
+        ]
+        try:
+            for future in asyncio.as_completed(tasks):
+                for result in await future:
+                    if isinstance(result, Bill):
+                        yield result
+                    elif isinstance(result, NoBillFoundError):
+                        # Total and header rows hold an amount but no transaction
+                        logger.debug(f"Row without a transaction in {self.name}: {result}")
+                    else:
+                        logger.warning(f"Skipping a row that could not be parsed by {self.name}: {result}")
+                        metrics.inc("multi_bill_skipped_rows_total")
+        finally:
+            for task in tasks:
+                task.cancel()
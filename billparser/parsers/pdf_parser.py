@@ -0,0 +1,148 @@
+import asyncio
+import importlib.util
+import io
+import os
+import tempfile
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+
+from ..config import settings
+from ..metrics import metrics
+from ..models import Bill, BillList, RawPdf, RawText
+from .base import BaseParser
+
+logger = getLogger(__name__)
+
+
+def count_pdf_pages(path: str) -> int:
+    """
+    Count the pages of a PDF file. Runs in a worker process.
+    """
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def split_pdf_pages(path: str, start: int, end: int) -> list[bytes]:
+    """
+    Split pages [start, end) of a PDF file into single-page PDF documents. Runs in a worker
+    process, so only the requested pages are ever held in memory by the server process.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(path)
+    pages: list[bytes] = []
+    for page in reader.pages[start:end]:
+        writer = PdfWriter()
+        writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages.append(buffer.getvalue())
+    return pages
+
+
+class PdfStatementParser(BaseParser[RawPdf, BillList]):
+    """
+    Parses PDF bank and credit card statements into bills. Pages are split in a process pool,
+    OCRed concurrently within the provider limit, and the text of each page is streamed into the
+    multi-bill parser as soon as it is recognized.
+    """
+
+    name = "pdf_statement"
+
+    def __init__(self):
+        logger.debug(f"Initializing {self.name}")
+        assert self.name in settings["parsers"] or self.name.upper() in settings["parsers"], (
+            f"Parser settings for {self.name} not found"
+        )
+        parser_cfg = settings["parsers"][self.name] or {}
+        self.ocr_name: str = parser_cfg.get("ocr") or "PP_OCRv5"
+        self.bill_parser_name: str = parser_cfg.get("bill_parser") or "multi_bill"
+        self.pages_per_task: int = int(parser_cfg.get("pages_per_task", 4))
+        # Concurrent OCR requests, keep it within the provider QPS limit
+        self.max_concurrency: int = int(parser_cfg.get("max_concurrency", 4))
+        self.workers: int = int(parser_cfg.get("workers", 2))
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def aclose(self) -> None:
+        """
+        Shut the worker processes down. The pool is started again by the next statement.
+        """
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, cancel_futures=True)
+
+    def _get_parsers(self) -> tuple[BaseParser, BaseParser]:
+        # Resolved lazily: the parser manager is still being built while parsers are instantiated
+        from .manager import parser_manager
+
+        ocr = parser_manager.get_parser(self.ocr_name)
+        bill_parser = parser_manager.get_parser(self.bill_parser_name)
+        assert hasattr(ocr, "parse_pdf"), f"Parser '{self.ocr_name}' does not support PDF input"
+        assert hasattr(bill_parser, "parse_stream"), f"Parser '{self.bill_parser_name}' does not stream bills"
+        return ocr, bill_parser
+
+    async def parse(self, input_data: RawPdf) -> BillList:
+        return BillList([bill async for bill in self.parse_stream(input_data)])
+
+    async def parse_stream(self, input_data: RawPdf) -> AsyncIterator[Bill]:
+        """
+        Parse the statement page by page, yielding bills as soon as each group of pages is parsed.
+        At most `max_concurrency` groups of `pages_per_task` pages are split and in flight at a
+        time, bounding memory for long statements, and at most `max_concurrency` OCR requests run
+        concurrently.
+        """
+        if importlib.util.find_spec("pypdf") is None:
+            raise RuntimeError("PDF statements require pypdf, install the pdf extra with `uv sync --extra pdf`")
+        ocr, bill_parser = self._get_parsers()
+        loop = asyncio.get_running_loop()
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(input_data)
+            path = f.name
+        try:
+            n_pages = await loop.run_in_executor(self.executor, count_pdf_pages, path)
+            logger.info(f"{self.name} parsing a statement of {n_pages} pages")
+            metrics.observe("pdf_statement_pages", n_pages)
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def ocr_page(page: bytes) -> RawText:
+                async with semaphore:
+                    return await ocr.parse_pdf(page)
+
+            async def parse_pages(start: int) -> list[Bill]:
+                end = min(start + self.pages_per_task, n_pages)
+                pages = await loop.run_in_executor(self.executor, split_pdf_pages, path, start, end)
+                texts = await asyncio.gather(*(ocr_page(page) for page in pages))
+                del pages
+                bills: list[Bill] = []
+                for text in texts:
+                    # Passed as is: the layout of the page lets the bill parser group the rows
+                    bills.extend([bill async for bill in bill_parser.parse_stream(text)])
+                return bills
+
+            starts = iter(range(0, n_pages, self.pages_per_task))
+            pending: set[asyncio.Task] = set()
+            try:
+                while True:
+                    for start in starts:
+                        pending.add(asyncio.create_task(parse_pages(start)))
+                        if len(pending) >= self.max_concurrency:
+                            break
+                    if not pending:
+                        break
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        for bill in task.result():
+                            yield bill
+            finally:
+                for task in pending:
+                    task.cancel()
+        finally:
+            os.unlink(path)
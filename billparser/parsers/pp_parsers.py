@@ -1,48 +1,101 @@
+import asyncio
 import base64
 from abc import abstractmethod
+from dataclasses import dataclass
 from logging import getLogger
 
 import httpx
 
+from ..balancer import EndpointBalancer
 from ..config import settings
-from ..models import RawImage, RawText
+from ..deadline import step_timeout
+from ..http_client import LoopBoundClient
+from ..models import OcrLine, RawImage, RawText
 from .base import BaseParser
 
 logger = getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class PpEndpoint:
+    url: str
+    token: str
+
+
 class PpParserBase(BaseParser[RawImage, RawText]):
+    """
+    Base class of the PP-OCR serving parsers. Several serving instances can be listed under
+    `endpoints` (each with a `url`, and a `token` defaulting to the one of the parser), requests are
+    then balanced over them according to the `balancer` settings.
+    """
+
     def __init__(self):
         logger.debug(f"Initializing {self.name}")
         assert self.name in settings["parsers"] or self.name.upper() in settings["parsers"], (
             f"Parser settings for {self.name} not found"
         )
-        self.url = settings["parsers"][self.name]["url"]
-        self.token = settings["parsers"][self.name]["token"]
+        parser_cfg = settings["parsers"][self.name]
+        endpoints = parser_cfg.get("endpoints") or [{"url": parser_cfg["url"]}]
+        targets = []
+        for endpoint in endpoints:
+            token = endpoint.get("token") or parser_cfg["token"]
+            targets.append((endpoint.get("name") or str(endpoint["url"]), PpEndpoint(endpoint["url"], token)))
+        self.balancer = EndpointBalancer.from_settings(
+            self.name, targets, parser_cfg.get("balancer"), health_check=self._health_check
+        )
+        self.http = LoopBoundClient()
 
     async def parse(self, input_data: RawImage) -> RawText:
+        return await self._ocr(input_data, file_type=1)
+
+    async def parse_pdf(self, input_data: bytes) -> RawText:
+        """
+        OCR a PDF document, usually a single page split from a statement.
+        """
+        return await self._ocr(input_data, file_type=0)
+
+    async def _ocr(self, input_data: bytes, file_type: int) -> RawText:
         logger.debug(f"Parsing input data with {self.name}")
         data_b64: str = base64.b64encode(input_data).decode("ascii")
 
-        headers = {
-            "Authorization": f"token {self.token}",
-            "Content-Type": "application/json",
-        }
-
         payload = {
             "file": data_b64,
-            "fileType": 1,  # 1 for image, 0 for PDF
+            "fileType": file_type,  # 1 for image, 0 for PDF
         }
-        timeout_config = httpx.Timeout(timeout=10, write=30)
+        # Capped by the remaining budget of the request
+        timeout_config = httpx.Timeout(timeout=step_timeout(10), write=step_timeout(30))
 
-        async with httpx.AsyncClient(timeout=timeout_config) as client:
-            response: httpx.Response = await client.post(
-                url=self.url,
+        async with self.balancer.request() as endpoint:
+            headers = {
+                "Authorization": f"token {endpoint.target.token}",
+                "Content-Type": "application/json",
+            }
+            response: httpx.Response = await self.http.get().post(
+                url=endpoint.target.url,
                 json=payload,
                 headers=headers,
+                timeout=timeout_config,
             )
             response.raise_for_status()
-            return self._post_process_ocr_response(response.json())
+        return self._post_process_ocr_response(response.json())
+
+    async def _health_check(self, endpoint: PpEndpoint) -> None:
+        # Any HTTP answer shows the instance is serving again
+        await self.http.preconnect(endpoint.url, timeout=5)
+
+    async def warm_up(self) -> None:
+        """
+        Open the TLS connections to the OCR service instances ahead of the first request.
+        """
+        await asyncio.gather(
+            *(
+                self.http.preconnect(endpoint.target.url, timeout=step_timeout(10))
+                for endpoint in self.balancer.endpoints
+            )
+        )
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
 
     @abstractmethod
     def _post_process_ocr_response(self, response_json: dict) -> RawText:
@@ -57,8 +110,14 @@ class PPOCRV5Parser(PpParserBase):
             ocr_results = response_json["result"]["ocrResults"]
             if not ocr_results:
                 raise ValueError("ocrResults is empty in PP-OCR response")
-            datatext_list = ocr_results[0]["prunedResult"]["rec_texts"]
+            # One result per page: a single one for images, one per page for PDFs
+            datatext_list = [text for page in ocr_results for text in page["prunedResult"]["rec_texts"]]
+            rec_boxes = (ocr_results[0]["prunedResult"].get("rec_boxes") or []) if len(ocr_results) == 1 else []
         except (KeyError, IndexError) as e:
             raise ValueError(f"Unexpected PP-OCR response structure: {e}") from e
+        layout = [
+            OcrLine(text=text, left=x1, top=y1, width=x2 - x1, height=y2 - y1)
+            for text, (x1, y1, x2, y2) in zip(datatext_list, rec_boxes, strict=False)
+        ]
         detected_text = "\n".join(datatext_list)
-        return RawText(detected_text)
+        return RawText(detected_text, layout=layout)
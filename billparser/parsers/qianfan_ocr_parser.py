@@ -1,84 +1,160 @@
+import asyncio
 import base64
 import datetime
+from dataclasses import dataclass
 from logging import getLogger
 
 import httpx
 
+from ..balancer import EndpointBalancer, EndpointError
 from ..config import settings
-from ..models import RawImage, RawText
+from ..deadline import step_timeout
+from ..http_client import LoopBoundClient
+from ..models import OcrLine, RawImage, RawText
 from .base import BaseParser
 
 logger = getLogger(__name__)
 
 
+# Error codes answered with a 200 status when the quota of the credentials is exhausted
+QUOTA_ERROR_CODES = {4, 17, 18, 19}
+# Error codes of an invalid or expired access token
+TOKEN_ERROR_CODES = {110, 111}
+
+
+@dataclass
+class QianfanCredential:
+    api_key: str
+    secret_key: str
+    access_token: str | None = None
+    access_token_last_updated: datetime.datetime | None = None
+
+
 class QianfanOcrParser(BaseParser[RawImage, RawText]):
+    """
+    Baidu Qianfan OCR. Several app credentials, each with its own QPS quota, can be listed under
+    `credentials` (each with an `api_key` and a `secret_key`); requests are then balanced over them
+    according to the `balancer` settings, and credentials out of quota are ejected for a while.
+    """
+
     name = "Qianfan_OCR"
 
     def __init__(self):
         logger.debug(f"Initializing {self.name}")
-        self.url = "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic"
         try:
-            self.api_key = settings["parsers"][self.name]["api_key"]
-            self.secret_key = settings["parsers"][self.name]["secret_key"]
+            parser_cfg = settings["parsers"][self.name]
+            credentials = parser_cfg.get("credentials") or [
+                {"api_key": parser_cfg["api_key"], "secret_key": parser_cfg["secret_key"]}
+            ]
+            targets = [
+                (item.get("name") or f"app{idx}", QianfanCredential(item["api_key"], item["secret_key"]))
+                for idx, item in enumerate(credentials)
+            ]
+            # general_basic returns text only, general/accurate also return the location of each line
+            endpoint = parser_cfg.get("endpoint") or "general_basic"
+            self.url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/{endpoint}"
         except KeyError:
             logger.error(f"API key or secret key for {self.name} not found in settings")
             raise
-        self.access_token = None
-        self.access_token_last_updated: datetime.datetime | None = None
+        # An exhausted quota is only seen on a real request, ejected credentials are readmitted
+        # when their ejection period is over
+        self.balancer = EndpointBalancer.from_settings(self.name, targets, parser_cfg.get("balancer"))
+        self.http = LoopBoundClient()
 
-    async def _update_access_token(self, force=True) -> None:
-        if self.access_token_last_updated is not None:
-            elapsed = datetime.datetime.now() - self.access_token_last_updated
+    async def _update_access_token(self, credential: QianfanCredential, force=True) -> None:
+        if credential.access_token_last_updated is not None:
+            elapsed = datetime.datetime.now() - credential.access_token_last_updated
             if elapsed.total_seconds() < 3600 * 24 and not force:
                 return
         url = "https://aip.baidubce.com/oauth/2.0/token"
         params = {
             "grant_type": "client_credentials",
-            "client_id": self.api_key,
-            "client_secret": self.secret_key,
+            "client_id": credential.api_key,
+            "client_secret": credential.secret_key,
         }
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, data=params, headers=headers, timeout=10)
-            response.raise_for_status()
+        response = await self.http.get().post(url, data=params, headers=headers, timeout=step_timeout(10))
+        response.raise_for_status()
         data = response.json()
-        self.access_token = data["access_token"]
-        self.access_token_last_updated = datetime.datetime.now()
+        credential.access_token = data["access_token"]
+        credential.access_token_last_updated = datetime.datetime.now()
 
     async def parse(self, input_data: RawImage) -> RawText:
-        logger.debug(f"Parsing input data with {self.name}")
-        await self._update_access_token(force=False)
-        data_b64: str = base64.b64encode(input_data).decode("ascii")
+        return await self._ocr({"image": base64.b64encode(input_data).decode("ascii")})
 
+    async def parse_pdf(self, input_data: bytes) -> RawText:
+        """
+        OCR the first page of a PDF document, usually a single page split from a statement.
+        """
+        return await self._ocr({"pdf_file": base64.b64encode(input_data).decode("ascii"), "pdf_file_num": "1"})
+
+    async def _ocr(self, file_payload: dict[str, str]) -> RawText:
+        logger.debug(f"Parsing input data with {self.name}")
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
             "Accept": "application/json",
         }
-        params = {"access_token": self.access_token}
-
         payload = {
-            "image": data_b64,
+            **file_payload,
             "paragraph": "true",
         }
-        timeout_config = httpx.Timeout(timeout=10, write=30)
+        # Capped by the remaining budget of the request
+        timeout_config = httpx.Timeout(timeout=step_timeout(10), write=step_timeout(30))
 
-        async with httpx.AsyncClient(timeout=timeout_config) as client:
-            response: httpx.Response = await client.post(
+        async with self.balancer.request() as endpoint:
+            credential: QianfanCredential = endpoint.target
+            await self._update_access_token(credential, force=False)
+            response: httpx.Response = await self.http.get().post(
                 url=self.url,
                 data=payload,
                 headers=headers,
-                params=params,
+                params={"access_token": credential.access_token},
+                timeout=timeout_config,
             )
             response.raise_for_status()
-            return self._post_process_ocr_response(response.json())
+            response_json = response.json()
+            self._check_error(response_json, credential)
+        return self._post_process_ocr_response(response_json)
+
+    def _check_error(self, response_json: dict, credential: QianfanCredential) -> None:
+        """
+        Raises:
+            EndpointError: If the quota of the credentials is exhausted.
+            ValueError: For any other error answered by the API.
+        """
+        error_code = response_json.get("error_code")
+        if error_code is None:
+            return
+        message = f"{self.name} error {error_code}: {response_json.get('error_msg')}"
+        if error_code in QUOTA_ERROR_CODES:
+            raise EndpointError(message)
+        if error_code in TOKEN_ERROR_CODES:
+            # Fetched again on the next request with these credentials
+            credential.access_token_last_updated = None
+        raise ValueError(message)
+
+    async def warm_up(self) -> None:
+        """
+        Fetch the access tokens, which also opens the TLS connection reused by the OCR requests.
+        """
+        await asyncio.gather(
+            *(self._update_access_token(endpoint.target, force=False) for endpoint in self.balancer.endpoints)
+        )
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
 
     def _post_process_ocr_response(self, response_json: dict) -> RawText:
         datatext_list = []
+        layout = []
         for item in response_json.get("words_result", []):
             datatext_list.append(item.get("words", ""))
+            location = item.get("location")
+            if location:
+                layout.append(OcrLine(text=item.get("words", ""), **location))
         paragraph_str_list = []
         for item in response_json.get("paragraphs_result", []):
             idx: list[int] = item.get("words_result_idx", [])
             paragraph_str_list.append("".join([datatext_list[i] for i in idx if i < len(datatext_list)]))
         detected_text = "\n".join(paragraph_str_list)
-        return RawText(detected_text)
+        return RawText(detected_text, layout=layout)
@@ -1,7 +1,15 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from enum import StrEnum
+from itertools import pairwise
 from logging import getLogger
 
+from .batching import micro_batcher
 from .config import settings
-from .models import ParserInput, ParserOutput
+from .deadline import check_deadline, deadline_scope
+from .ledger import ledger
+from .models import OcrLine, ParserInput, ParserOutput, RawText
 from .parsers.base import BaseParser
 from .parsers.manager import ParserManager, parser_manager
 
@@ -13,28 +21,233 @@ class Pipeline:
     input_type: type[ParserInput]
     output_type: type[ParserOutput]
 
-    def __init__(self, name: str, steps: list[BaseParser]):
+    def __init__(self, name: str, steps: list[BaseParser], timeout: float | None = None, record: bool = False):
         self.name = name
         self.steps = steps
+        # Default time budget of a run in seconds, None for no deadline
+        self.timeout = timeout
+        # Append the bills produced to the ledger (when it is enabled)
+        self.record = record
         if not steps:
             raise ValueError("Pipeline must have at least one step")
+        for prev_step, next_step in pairwise(steps):
+            if not issubclass(prev_step.output_type, next_step.input_type):
+                raise TypeError(
+                    f"Step '{next_step.name}' expects input of type {next_step.input_type.__name__}, "
+                    f"but step '{prev_step.name}' produces {prev_step.output_type.__name__}"
+                )
         self.input_type = steps[0].input_type
         self.output_type = steps[-1].output_type
 
-    async def run(self, input_data: ParserInput) -> ParserOutput:
-        data = input_data
-        for step in self.steps:
-            if not isinstance(data, step.input_type):
-                raise TypeError(
-                    f"Step '{step.name}' expected input of type "
-                    f"{step.input_type.__name__}, but got {type(data).__name__}"
-                )
-            data = await step.parse(data)
+    async def run(self, input_data: ParserInput, timeout: float | None = None) -> ParserOutput:
+        """
+        Run the pipeline. The run is cancelled once `timeout` seconds (default: the pipeline
+        timeout) have elapsed or the deadline of the caller has passed, whichever comes first;
+        parsers derive the timeouts of their provider calls from the remaining budget.
+
+        Raises:
+            DeadlineExceededError: If the deadline passes before the pipeline completes.
+        """
+        async with deadline_scope(timeout if timeout is not None else self.timeout, self.name):
+            data = await self._run_steps(self.steps, input_data)
         assert isinstance(data, self.output_type), (
             f"Final output type mismatch: expected {self.output_type.__name__}, got {type(data).__name__}"
         )
+        if self.record:
+            await ledger.record(data, self.name)
+        return data
+
+    async def stream(self, input_data: ParserInput, timeout: float | None = None) -> AsyncIterator[ParserOutput]:
+        """
+        Run the pipeline, yielding results as they are produced. When the last step provides
+        `parse_stream` (e.g. a multi-bill parser), its items are yielded one by one, otherwise the
+        single result of the pipeline is yielded. The deadline is handled as in `run`.
+        """
+        last_step = self.steps[-1]
+        parse_stream = getattr(last_step, "parse_stream", None)
+        if parse_stream is None:
+            yield await self.run(input_data, timeout)
+            return
+        timeout = timeout if timeout is not None else self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        async with deadline_scope(timeout, self.name):
+            data = await self._run_steps(self.steps[:-1], input_data)
+            self._check_input(last_step, data)
+            check_deadline(last_step.name)
+        # The deadline only applies while the next item is produced, not while the consumer holds
+        # the generator suspended at a yield
+        items = parse_stream(data)
+        try:
+            while True:
+                async with deadline_scope(None if deadline is None else deadline - time.monotonic(), self.name):
+                    try:
+                        item = await anext(items)
+                    except StopAsyncIteration:
+                        break
+                if self.record:
+                    await ledger.record(item, self.name)
+                yield item
+        finally:
+            await items.aclose()
+
+    @staticmethod
+    def _check_input(step: BaseParser, data: ParserInput | ParserOutput) -> None:
+        if not isinstance(data, step.input_type):
+            raise TypeError(
+                f"Step '{step.name}' expected input of type {step.input_type.__name__}, but got {type(data).__name__}"
+            )
+
+    async def _run_steps(self, steps: list[BaseParser], input_data: ParserInput) -> ParserOutput:
+        data = input_data
+        for step in steps:
+            self._check_input(step, data)
+            check_deadline(step.name)
+            data = await self._parse(step, data)
         return data
 
+    @staticmethod
+    async def _parse(step: BaseParser, data: ParserInput) -> ParserOutput:
+        # Steps configured for micro-batching coalesce the concurrent runs of every pipeline using them
+        batcher = micro_batcher(step)
+        if batcher is None:
+            return await step.parse(data)
+        return await batcher.submit(data)
+
+    async def run_batch(self, inputs: list[ParserInput], concurrency: int = 4) -> list[ParserOutput | Exception]:
+        """
+        Run the pipeline on several inputs step by step. Steps providing `parse_batch` (e.g. LLM
+        parsers packing several bills into one request) receive all inputs at once, the other steps
+        run with at most `concurrency` inputs in flight.
+
+        Returns:
+            list[ParserOutput | Exception]: One result per input, in input order. Inputs failing at
+            any step get the exception and skip the remaining steps.
+        """
+        results: list = list(inputs)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def parse_one(step: BaseParser, data: ParserInput) -> ParserOutput:
+            self._check_input(step, data)
+            async with semaphore:
+                check_deadline(step.name)
+                return await step.parse(data)
+
+        for step in self.steps:
+            active = [idx for idx, result in enumerate(results) if not isinstance(result, Exception)]
+            if not active:
+                break
+            step_inputs = [results[idx] for idx in active]
+            parse_batch = getattr(step, "parse_batch", None)
+            if parse_batch is not None:
+                check_deadline(step.name)
+                outputs = await parse_batch(step_inputs)
+            else:
+                outputs = await asyncio.gather(*(parse_one(step, data) for data in step_inputs), return_exceptions=True)
+            for idx, output in zip(active, outputs, strict=True):
+                results[idx] = output
+        if self.record:
+            for result in results:
+                if not isinstance(result, Exception):
+                    await ledger.record(result, self.name)
+        return results
+
+
+class JoinPolicy(StrEnum):
+    FIRST = "first"  # first successful branch wins, the others are cancelled
+    ALL = "all"  # every branch must succeed, texts are merged
+    MERGE = "merge"  # failed branches are tolerated, texts of the successful ones are merged
+
+
+class ParallelStep(BaseParser):
+    """
+    A pipeline step that runs several branches concurrently on the same input and joins their
+    outputs according to a JoinPolicy. Each branch is itself a linear Pipeline.
+    """
+
+    def __init__(self, branches: list[Pipeline], join: JoinPolicy = JoinPolicy.FIRST):
+        if len(branches) < 2:
+            raise ValueError("Parallel step must have at least two branches")
+        self.branches = branches
+        self.join = join
+        self.name = f"parallel[{join}]({'|'.join(branch.name for branch in branches)})"
+        input_type = branches[0].input_type
+        output_type = branches[0].output_type
+        for branch in branches[1:]:
+            if branch.input_type is not input_type:
+                raise TypeError(
+                    f"Branch '{branch.name}' expects input of type {branch.input_type.__name__}, "
+                    f"but other branches expect {input_type.__name__}"
+                )
+            if branch.output_type is not output_type:
+                raise TypeError(
+                    f"Branch '{branch.name}' produces {branch.output_type.__name__}, "
+                    f"but other branches produce {output_type.__name__}"
+                )
+        if join is not JoinPolicy.FIRST and not issubclass(output_type, RawText):
+            raise TypeError(f"Join policy '{join}' can only merge RawText outputs, got {output_type.__name__}")
+        self._input_type = input_type
+        self._output_type = output_type
+
+    @property
+    def input_type(self) -> type[ParserInput]:
+        return self._input_type
+
+    @property
+    def output_type(self) -> type[ParserOutput]:
+        return self._output_type
+
+    async def parse(self, input_data: ParserInput) -> ParserOutput:
+        tasks = {asyncio.create_task(branch.run(input_data)): branch for branch in self.branches}
+        results: dict[str, ParserOutput] = {}
+        errors: list[Exception] = []
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    branch = tasks[task]
+                    error = task.exception()
+                    if error is None:
+                        results[branch.name] = task.result()
+                        if self.join is JoinPolicy.FIRST:
+                            logger.debug(f"Branch '{branch.name}' won in {self.name}")
+                            return results[branch.name]
+                        continue
+                    logger.warning(f"Branch '{branch.name}' failed in {self.name}: {error}")
+                    if self.join is JoinPolicy.ALL:
+                        raise error
+                    errors.append(error)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        if not results:
+            raise ExceptionGroup(f"All branches of {self.name} failed", errors)
+        ordered = [results[branch.name] for branch in self.branches if branch.name in results]
+        return self._merge_texts(ordered)
+
+    @staticmethod
+    def _merge_texts(texts: list[RawText]) -> RawText:
+        """
+        Merge texts of several branches, keeping the order of the first branch and appending
+        lines that only the other branches recognized. The layout of the first branch is kept,
+        along with the boxes of the appended lines.
+        """
+        seen: set[str] = set()
+        lines: list[str] = []
+        layout: list[OcrLine] = []
+        for index, text in enumerate(texts):
+            added: set[str] = set()
+            for line in str(text).splitlines():
+                key = line.strip()
+                if key and key not in seen:
+                    seen.add(key)
+                    added.add(key)
+                    lines.append(line)
+            layout.extend(box for box in text.layout if index == 0 or box.text.strip() in added)
+        return RawText("\n".join(lines), layout=layout)
+
 
 class PipelineManager:
     def __init__(self, parser_manager: ParserManager):
@@ -48,15 +261,14 @@ class PipelineManager:
         for pipeline_name, config in pipeline_configs.items():
             logger.info(f"Loading pipeline '{pipeline_name}' with config: {config}")
             try:
-                step_names = config.get("steps", [])
-                steps = []
-                for step_name in step_names:
-                    try:
-                        parser = self.parser_manager.get_parser(step_name)
-                    except KeyError as e:
-                        raise ValueError(f"Parser '{step_name}' not found for pipeline '{pipeline_name}'") from e
-                    steps.append(parser)
-                pipeline = Pipeline(name=pipeline_name, steps=steps)
+                steps = self._build_steps(pipeline_name, config.get("steps", []))
+                timeout = config.get("timeout_seconds")
+                pipeline = Pipeline(
+                    name=pipeline_name,
+                    steps=steps,
+                    timeout=float(timeout) if timeout else None,
+                    record=bool(config.get("ledger", True)),
+                )
                 self.pipelines[pipeline_name] = pipeline
                 logger.info(
                     f"Successfully loaded pipeline '{pipeline_name}' with steps: {[step.name for step in steps]}"
@@ -64,6 +276,33 @@ class PipelineManager:
             except Exception as e:
                 logger.error(f"Failed to load pipeline '{pipeline_name}': {e}")
 
+    def _build_steps(self, pipeline_name: str, step_configs: list) -> list[BaseParser]:
+        """
+        Build the steps of a pipeline. A step is either a parser name, or a mapping
+        `{"parallel": [branch, ...], "join": "first" | "all" | "merge"}` where each branch is a
+        parser name or a list of steps.
+        """
+        steps: list[BaseParser] = []
+        for step_config in step_configs:
+            if isinstance(step_config, str):
+                try:
+                    steps.append(self.parser_manager.get_parser(step_config))
+                except KeyError as e:
+                    raise ValueError(f"Parser '{step_config}' not found for pipeline '{pipeline_name}'") from e
+                continue
+            if not hasattr(step_config, "get") or "parallel" not in step_config:
+                raise ValueError(f"Invalid step {step_config!r} in pipeline '{pipeline_name}'")
+            branches = []
+            for branch_config in step_config["parallel"]:
+                if isinstance(branch_config, str):
+                    branch_config = [branch_config]
+                branch_steps = self._build_steps(pipeline_name, branch_config)
+                branch_name = "+".join(step.name for step in branch_steps)
+                branches.append(Pipeline(name=branch_name, steps=branch_steps))
+            join = JoinPolicy(step_config.get("join", JoinPolicy.FIRST))
+            steps.append(ParallelStep(branches=branches, join=join))
+        return steps
+
     def get_pipeline(self, name: str) -> Pipeline | None:
         if name not in self.pipelines:
             self._load_pipelines()
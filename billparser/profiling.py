@@ -0,0 +1,154 @@
+import asyncio
+import cProfile
+import importlib.util
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from logging import getLogger
+from pathlib import Path
+from types import FrameType
+
+logger = getLogger(__name__)
+
+
+@contextmanager
+def profile_run(output: Path, engine: str = "cprofile", top: int = 30) -> Iterator[None]:
+    """
+    Profile the block and write, next to `output`:
+        - `<output>.prof` with the cProfile engine, readable with `python -m pstats` or snakeviz.
+        - `<output>.html` with the pyinstrument engine (requires pyinstrument), a sampling profile
+          that follows await points.
+        - `<output>.txt`: the top allocation sites recorded by tracemalloc, and the top functions
+          by cumulative time with the cProfile engine.
+    """
+    if engine not in ("cprofile", "pyinstrument"):
+        raise ValueError(f"Unknown profiling engine '{engine}', available: cprofile, pyinstrument")
+    if engine == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+        raise RuntimeError(
+            "The pyinstrument engine requires pyinstrument, install it with `uv pip install pyinstrument`"
+        )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    # Both engines hook the interpreter profiler, so only one of them runs at a time
+    if engine == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler(async_mode="enabled")
+    else:
+        profiler = cProfile.Profile()
+    tracemalloc.start()
+    if engine == "pyinstrument":
+        profiler.start()
+    else:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if engine == "pyinstrument":
+            profiler.stop()
+        else:
+            profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        with output.with_suffix(".txt").open("w", encoding="utf-8") as f:
+            f.write(f"Traced memory: current {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB\n\n")
+            f.write(f"Top {top} allocation sites:\n")
+            for stat in snapshot.statistics("lineno")[:top]:
+                f.write(f"{stat}\n")
+            if engine == "cprofile":
+                f.write(f"\nTop {top} functions by cumulative time:\n")
+                pstats.Stats(profiler, stream=f).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        if engine == "pyinstrument":
+            report = output.with_suffix(".html")
+            report.write_text(profiler.output_html(), encoding="utf-8")
+        else:
+            report = output.with_suffix(".prof")
+            profiler.dump_stats(report)
+        logger.info(f"Profile written to {report} and {output.with_suffix('.txt')}")
+
+
+def _frame_stack(frame: FrameType | None) -> str:
+    names: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_qualname} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    Samples the stack of a thread at a fixed interval from a background thread. Used on the event
+    loop thread, the stacks that show up most are the code blocking the loop (e.g. base64 encoding
+    of large images, pydantic validation).
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+
+    def sample(self, seconds: float) -> Counter[str]:
+        """
+        Sample for `seconds`, blocking the calling thread.
+
+        Returns:
+            Counter[str]: Number of samples per stack, in collapsed format ("outer;...;inner").
+        """
+        stacks: Counter[str] = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stacks[_frame_stack(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+        return stacks
+
+
+async def sample_event_loop(seconds: float, interval: float = 0.005, top: int = 50) -> dict:
+    """
+    Capture a sampling profile of the thread running the current event loop, without blocking it.
+
+    Returns:
+        dict: Number of samples, and the most frequent stacks with their share of the samples.
+    """
+    sampler = StackSampler(threading.get_ident(), interval)
+    stacks = await asyncio.to_thread(sampler.sample, seconds)
+    total = sum(stacks.values())
+    return {
+        "seconds": seconds,
+        "interval": interval,
+        "samples": total,
+        "stacks": [
+            {"stack": stack, "count": count, "ratio": count / total} for stack, count in stacks.most_common(top)
+        ],
+    }
+
+
+def dump_tasks(limit: int = 20) -> list[dict]:
+    """
+    Describe the pending asyncio tasks of the running loop with the stack they are suspended at.
+    """
+    tasks: list[dict] = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        frames = task.get_stack(limit=limit)
+        tasks.append(
+            {
+                "name": task.get_name(),
+                "coro": getattr(coro, "__qualname__", repr(coro)),
+                "done": task.done(),
+                "stack": [
+                    f"{frame.f_code.co_qualname} ({Path(frame.f_code.co_filename).name}:{frame.f_lineno})"
+                    for frame in frames
+                ],
+            }
+        )
+    return tasks
@@ -0,0 +1,211 @@
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from logging import getLogger
+
+from pydantic import BaseModel, Field
+
+from .config import settings
+from .metrics import metrics
+from .models import Bill
+
+logger = getLogger(__name__)
+
+
+class CacheProbe(BaseModel):
+    pipeline_name: str = Field("ocr_then_llm", description="Pipeline name")
+    sha256: str = Field(pattern=r"^[0-9a-f]{64}$", description="SHA-256 of the image bytes, lowercase hex")
+    phash: str | None = Field(
+        None, pattern=r"^[0-9a-f]{16}$", description="Optional 64-bit perceptual hash of the image, lowercase hex"
+    )
+
+
+@dataclass
+class UploadToken:
+    api_key: str
+    pipeline_name: str
+    sha256: str
+    phash: int | None
+    expires: float
+
+
+@dataclass
+class _Entry:
+    bill: Bill
+    phash: int | None
+    expires: float
+
+
+class TokenError(ValueError):
+    """
+    Raised when an upload token is unknown, expired, or does not match the uploaded image.
+    """
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    Bills parsed from images, keyed by API key, pipeline and SHA-256 of the image bytes, so that a
+    retried upload is answered without running the pipeline. Entries are partitioned by API key.
+
+    Clients can probe the cache with the hashes only (`probe`). On a miss they get a single-use
+    upload token carrying their perceptual hash, which is indexed with the bill once the upload is
+    parsed. Perceptual hashes are computed by the clients; the server only compares them (Hamming
+    distance), so it never decodes images.
+
+    Bills are only served on an exact SHA-256 match: receipts of the same app template differ by a
+    few digits and have perceptual hashes within a few bits of each other, so a perceptual neighbour
+    is only reported as a hint (`similar`), never as the bill of the probed image.
+    """
+
+    def __init__(
+        self,
+        enabled: bool | None = None,
+        max_entries: int | None = None,
+        ttl_seconds: float | None = None,
+        phash_max_distance: int | None = None,
+        token_ttl_seconds: float | None = None,
+        max_tokens: int | None = None,
+    ) -> None:
+        self._enabled = enabled
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._phash_max_distance = phash_max_distance
+        self._token_ttl_seconds = token_ttl_seconds
+        self._max_tokens = max_tokens
+        self._initialized = False
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        cache_settings = settings.get("result_cache", {}) or {}
+        if self._enabled is None:
+            self._enabled = bool(cache_settings.get("enabled", True))
+        if self._max_entries is None:
+            self._max_entries = int(cache_settings.get("max_entries", 10000))
+        if self._ttl_seconds is None:
+            self._ttl_seconds = float(cache_settings.get("ttl_seconds", 86400))
+        if self._phash_max_distance is None:
+            self._phash_max_distance = int(cache_settings.get("phash_max_distance", 4))
+        if self._token_ttl_seconds is None:
+            self._token_ttl_seconds = float(cache_settings.get("token_ttl_seconds", 600))
+        if self._max_tokens is None:
+            self._max_tokens = int(cache_settings.get("max_tokens", 10000))
+        self.entries: OrderedDict[tuple[str, str, str], _Entry] = OrderedDict()
+        # In issue order, hence in expiry order: every token has the same time to live
+        self.tokens: OrderedDict[str, UploadToken] = OrderedDict()
+        self._initialized = True
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return bool(self._enabled)
+
+    def get(self, api_key: str, pipeline_name: str, sha256: str) -> Bill | None:
+        if not self.enabled:
+            return None
+        key = (api_key, pipeline_name, sha256)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry.bill
+
+    def find_similar(self, api_key: str, pipeline_name: str, phash: int) -> int | None:
+        """
+        Hamming distance to the closest perceptual hash of an image of the same API key and
+        pipeline, None if none is within `phash_max_distance` bits.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        best: int | None = None
+        # A linear scan: a popcount per entry, well under a millisecond for the default size
+        for (entry_key, entry_pipeline, _), entry in self.entries.items():
+            if entry.phash is None or entry_key != api_key or entry_pipeline != pipeline_name or entry.expires < now:
+                continue
+            distance = (entry.phash ^ phash).bit_count()
+            if distance <= self._phash_max_distance and (best is None or distance < best):
+                best = distance
+        return best
+
+    def put(self, api_key: str, pipeline_name: str, sha256: str, bill: Bill, phash: int | None = None) -> None:
+        if not self.enabled:
+            return
+        key = (api_key, pipeline_name, sha256)
+        self.entries[key] = _Entry(bill, phash, time.monotonic() + self._ttl_seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self._max_entries:
+            self.entries.popitem(last=False)
+
+    def probe(self, api_key: str, probe: CacheProbe) -> dict:
+        """
+        Look up the bill of an image from its hashes.
+
+        Returns:
+            dict: `{"status": "hit", "bill": Bill}` for an image already parsed, or
+            `{"status": "miss", "upload_token": ..., "expires_in": ..., "similar": bool}` to pass to
+            /parse_image with the upload; `similar` tells whether an image with a close perceptual
+            hash was parsed (e.g. the same screenshot re-encoded), its bill is not served.
+        """
+        phash = int(probe.phash, 16) if probe.phash else None
+        bill = self.get(api_key, probe.pipeline_name, probe.sha256)
+        if bill is not None:
+            metrics.inc("result_cache_probes_total", outcome="hit")
+            return {"status": "hit", "bill": bill}
+        distance = self.find_similar(api_key, probe.pipeline_name, phash) if phash is not None else None
+        metrics.inc("result_cache_probes_total", outcome="miss" if distance is None else "miss_similar")
+        token = self.issue_token(api_key, probe.pipeline_name, probe.sha256, phash)
+        return {
+            "status": "miss",
+            "upload_token": token,
+            "expires_in": self._token_ttl_seconds,
+            "similar": distance is not None,
+        }
+
+    def issue_token(self, api_key: str, pipeline_name: str, sha256: str, phash: int | None) -> str:
+        self._initialize()
+        now = time.monotonic()
+        # Expired tokens are purged as new ones are issued, and the oldest ones once `max_tokens` are
+        # outstanding, so unused tokens do not pile up
+        while self.tokens and next(iter(self.tokens.values())).expires < now:
+            self.tokens.popitem(last=False)
+        token = secrets.token_urlsafe(24)
+        self.tokens[token] = UploadToken(api_key, pipeline_name, sha256, phash, now + self._token_ttl_seconds)
+        while len(self.tokens) > self._max_tokens:
+            self.tokens.popitem(last=False)
+        return token
+
+    def redeem(self, token: str, api_key: str, pipeline_name: str, sha256: str) -> UploadToken:
+        """
+        Consume an upload token.
+
+        Raises:
+            TokenError: If the token is unknown or expired, or was issued for another API key,
+            pipeline or image.
+        """
+        self._initialize()
+        upload = self.tokens.pop(token, None)
+        if upload is None or upload.expires < time.monotonic():
+            raise TokenError("Unknown or expired upload token")
+        if upload.api_key != api_key or upload.pipeline_name != pipeline_name:
+            raise TokenError("Upload token was issued for another API key or pipeline")
+        if upload.sha256 != sha256:
+            raise TokenError("Uploaded image does not match the hash of the upload token")
+        return upload
+
+    def clear(self) -> None:
+        self._initialize()
+        self.entries.clear()
+        self.tokens.clear()
+
+
+result_cache = ResultCache()
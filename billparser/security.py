@@ -8,6 +8,10 @@ api_keys = settings.get("API_KEYS", [])
 if isinstance(api_keys, str):
     api_keys = [api_keys]
 VALID_API_KEYS = set(api_keys)
+admin_api_keys = settings.get("ADMIN_API_KEYS", [])
+if isinstance(admin_api_keys, str):
+    admin_api_keys = [admin_api_keys]
+VALID_ADMIN_API_KEYS = set(admin_api_keys)
 
 
 async def get_api_key(api_key: str = Security(api_key_header)) -> str:
@@ -26,3 +30,27 @@ async def get_api_key(api_key: str = Security(api_key_header)) -> str:
         return api_key
     else:
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
+
+
+def is_valid_api_key(api_key: str | None) -> bool:
+    """Check an API key obtained outside of a header dependency, e.g. at a WebSocket handshake."""
+    return api_key in VALID_API_KEYS
+
+
+async def get_admin_api_key(api_key: str = Security(api_key_header)) -> str:
+    """Get the valid admin API key from the request header.
+
+    Args:
+        api_key :str: The API key from the request header.
+
+    Returns:
+        str: The valid admin API key.
+
+    Raises:
+        HTTPException: If the API key is missing or invalid, or is not an admin key.
+    """
+    if api_key in VALID_ADMIN_API_KEYS:
+        return api_key
+    if api_key in VALID_API_KEYS:
+        raise HTTPException(status_code=403, detail="Admin API key required")
+    raise HTTPException(status_code=401, detail="Invalid or missing API key")
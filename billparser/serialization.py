@@ -0,0 +1,23 @@
+from collections.abc import Iterable
+
+from pydantic import TypeAdapter
+
+from .models import Bill
+
+# Serializers are compiled once at import instead of going through `model_dump_json` per call.
+BILL_ADAPTER = TypeAdapter(Bill)
+BILLS_ADAPTER = TypeAdapter(list[Bill])
+
+
+def dump_bill_json(bill: Bill) -> bytes:
+    """
+    Serialize a bill to JSON, equivalent to `bill.model_dump_json()`.
+    """
+    return BILL_ADAPTER.dump_json(bill)
+
+
+def dump_bills_json(bills: Iterable[Bill]) -> bytes:
+    """
+    Serialize bills to a JSON array in a single pydantic-core call.
+    """
+    return BILLS_ADAPTER.dump_json(bills if isinstance(bills, list) else list(bills))
@@ -1,25 +1,381 @@
-from fastapi import Depends, FastAPI, File, Query, UploadFile
+import asyncio
+import json
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from logging import getLogger
 
-from .models import Bill, RawImage
-from .pipeline import pipeline_manager
-from .security import get_api_key
+from fastapi import Depends, FastAPI, File, Header, HTTPException, Query, Response, UploadFile, WebSocket
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
-app = FastAPI(title="Bill Parser Service")
+from .admission import AdmissionRejectedError, AdmissionTicket, Priority, admission_controller
+from .classification_memory import ClassificationCorrection, classification_memory
+from .config import settings
+from .deadline import DeadlineExceededError
+from .ledger import AGGREGATE_DIMENSIONS, ledger
+from .metrics import metrics, process_rss_bytes
+from .models import Bill, BillList, RawImage, raw_file_input
+from .parsers.manager import parser_manager
+from .pipeline import Pipeline, pipeline_manager
+from .profiling import dump_tasks, sample_event_loop
+from .result_cache import CacheProbe, TokenError, content_hash, result_cache
+from .security import get_admin_api_key, get_api_key, is_valid_api_key
+from .serialization import dump_bill_json
+from .shadow import shadow_mirror
+from .token_budget import Degradation, TokenBudgetExceededError, token_budget
+from .warmup import warm_up, warmup_state
+from .ws_ingest import POLICY_VIOLATION, IngestSession
 
+logger = getLogger(__name__)
 
-@app.post("/parse_image", tags=["Parsing"], dependencies=[Depends(get_api_key)])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Warm up in the background: the server accepts connections at once, `/ready` reports when it is warm."""
+    if (settings.get("warmup", {}) or {}).get("enabled", True):
+        task = asyncio.create_task(warm_up())
+    else:
+        warmup_state.ready = True
+        task = None
+    # Generating the OpenAPI schema builds the pydantic schemas of every endpoint
+    app.openapi()
+    yield
+    if task is not None and not task.done():
+        task.cancel()
+    await shadow_mirror.drain()
+    await parser_manager.aclose()
+    ledger.close()
+    token_budget.close()
+    classification_memory.save()
+
+
+app = FastAPI(title="Bill Parser Service", lifespan=lifespan)
+
+QUEUE_WAIT_HEADER = "X-Queue-Wait-Seconds"
+CACHE_HEADER = "X-Cache"
+TOKENS_HEADER = "X-LLM-Tokens"
+
+
+async def admit(api_key: str, priority: Priority | None) -> AdmissionTicket:
+    """Wait for an execution slot, rejecting the request with 429 when the server is overloaded."""
+    try:
+        return await admission_controller.acquire(api_key, priority)
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)}) from e
+
+
+def budget_exceeded(api_key: str, detail: str) -> HTTPException:
+    """429 answered when the token budget is exhausted and the bill needs an LLM call."""
+    retry_after = token_budget.retry_after(admission_controller.policy(api_key).name)
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": f"{retry_after:.0f}"})
+
+
+async def request_timeout(
+    timeout: float | None = Query(None, gt=0, description="Time budget of the request in seconds"),
+    x_request_timeout: float | None = Header(None, gt=0),
+) -> float | None:
+    """Time budget of the request, from the `timeout` query parameter or the `X-Request-Timeout` header."""
+    return timeout if timeout is not None else x_request_timeout
+
+
+def remaining_budget(timeout: float | None, pipeline: Pipeline, ticket: AdmissionTicket) -> float | None:
+    """Budget left for the pipeline once the request has been admitted, the queue wait is deducted."""
+    timeout = timeout if timeout is not None else pipeline.timeout
+    if timeout is None:
+        return None
+    left = timeout - ticket.wait_seconds
+    if left <= 0:
+        ticket.release()
+        metrics.inc("deadline_exceeded_total", step="queue")
+        raise HTTPException(status_code=504, detail="Deadline exceeded while waiting in the queue")
+    return left
+
+
+PRIORITY_QUERY = Query(None, description="Priority class, defaults to the class configured for the API key")
+
+
+@app.post("/parse_image", tags=["Parsing"], response_model=Bill)
 async def parse_image(
     image: UploadFile = File(...),
     pipeline_name: str = Query("ocr_then_llm", description="Pipeline name"),
-) -> Bill:
-    """Endpoint to parse an image of a bill.
+    priority: Priority | None = PRIORITY_QUERY,
+    timeout: float | None = Depends(request_timeout),
+    upload_token: str | None = Query(None, description="Token returned by /parse_image/probe on a cache miss"),
+    api_key: str = Depends(get_api_key),
+) -> Response:
+    """Endpoint to parse an image of a bill. Uploads of an image already parsed for the API key are
+    answered from the result cache.
 
     Returns:
-        dict: A placeholder response indicating successful parsing.
+        Response: The bill as JSON. `X-Cache` is "hit" when the bill comes from the result cache,
+        "miss" otherwise; parsed bills also carry `X-Queue-Wait-Seconds` (time spent waiting for
+        admission) and `X-LLM-Tokens` (LLM tokens used by the run).
     """
-    img_bytes = await image.read()
     pipeline = pipeline_manager.get_pipeline(pipeline_name)
     assert pipeline is not None, f"Pipeline '{pipeline_name}' not found"
-    result = await pipeline.run(RawImage(img_bytes))
+    # Refused before the run: its bills would be recorded, then booked again by the stream endpoint
+    if issubclass(pipeline.output_type, BillList):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pipeline '{pipeline_name}' produces several bills, use /parse_image_stream instead",
+        )
+    img_bytes = await image.read()
+    sha256 = content_hash(img_bytes)
+    phash = None
+    if upload_token is not None:
+        try:
+            phash = result_cache.redeem(upload_token, api_key, pipeline_name, sha256).phash
+        except TokenError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+    cached = result_cache.get(api_key, pipeline_name, sha256)
+    if cached is not None:
+        metrics.inc("result_cache_hits_total", pipeline=pipeline_name)
+        return Response(content=dump_bill_json(cached), media_type="application/json", headers={CACHE_HEADER: "hit"})
+    ticket = await admit(api_key, priority)
+    budget = remaining_budget(timeout, pipeline, ticket)
+    started = time.perf_counter()
+    try:
+        async with token_budget.metered(pipeline_name, admission_controller.policy(api_key).name) as usage:
+            result = await pipeline.run(RawImage(img_bytes), timeout=budget)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e)) from e
+    except TokenBudgetExceededError as e:
+        raise budget_exceeded(api_key, str(e)) from e
+    finally:
+        ticket.release()
+    seconds = time.perf_counter() - started
     assert isinstance(result, Bill), "Result is not of type Bill"
-    return result
+    result_cache.put(api_key, pipeline_name, sha256, result, phash)
+    return Response(
+        content=dump_bill_json(result),
+        media_type="application/json",
+        headers={
+            QUEUE_WAIT_HEADER: f"{ticket.wait_seconds:.3f}",
+            CACHE_HEADER: "miss",
+            TOKENS_HEADER: str(usage.total_tokens),
+        },
+        # Sampled requests are mirrored to the shadow pipeline once the response is sent
+        background=BackgroundTask(shadow_mirror.mirror, pipeline_name, RawImage(img_bytes), result, seconds, usage),
+    )
+
+
+@app.post("/parse_image/probe", tags=["Parsing"])
+async def probe_image(probe: CacheProbe, api_key: str = Depends(get_api_key)) -> Response:
+    """Endpoint to look up the bill of an image from its hashes, without uploading it.
+
+    Returns:
+        Response: The cached bill (`status` "hit", the SHA-256 matches), or an upload token to pass
+        to /parse_image with the image (`status` "miss").
+    """
+    if pipeline_manager.get_pipeline(probe.pipeline_name) is None:
+        raise HTTPException(status_code=404, detail=f"Pipeline '{probe.pipeline_name}' not found")
+    answer = result_cache.probe(api_key, probe)
+    if answer["status"] == "miss":
+        return Response(content=json.dumps(answer), media_type="application/json")
+    bill = answer.pop("bill")
+    # The bill JSON is spliced in as is, with the compiled serializer
+    header = json.dumps(answer)[:-1].encode()
+    return Response(content=header + b',"bill":' + dump_bill_json(bill) + b"}", media_type="application/json")
+
+
+@app.post("/parse_image_stream", tags=["Parsing"])
+async def parse_image_stream(
+    image: UploadFile = File(...),
+    pipeline_name: str = Query("ocr_then_multi_bill", description="Pipeline name"),
+    priority: Priority | None = PRIORITY_QUERY,
+    timeout: float | None = Depends(request_timeout),
+    api_key: str = Depends(get_api_key),
+) -> StreamingResponse:
+    """Endpoint to parse an image or a PDF holding several transactions (bill list screenshot, statement).
+
+    Returns:
+        StreamingResponse: Newline-delimited JSON, one bill per line, sent as soon as each bill is parsed.
+        A failure once the stream has started ends it with a `{"type": "error", "status", "detail"}`
+        line, the status being the one the request would have been answered with.
+    """
+    pipeline = pipeline_manager.get_pipeline(pipeline_name)
+    assert pipeline is not None, f"Pipeline '{pipeline_name}' not found"
+    # A stream cannot change its status once started: what can be checked is checked first
+    img_bytes = await image.read()
+    input_data = raw_file_input(img_bytes)
+    if not isinstance(input_data, pipeline.input_type):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pipeline '{pipeline_name}' expects {pipeline.input_type.__name__}, "
+            f"got {type(input_data).__name__}",
+        )
+    # Bill lists always need the LLM
+    if token_budget.degradation(admission_controller.policy(api_key).name) is Degradation.LOCAL_ONLY:
+        raise budget_exceeded(api_key, "Token budget exhausted, bill lists cannot be parsed")
+    # The slot is held while the bills are streamed, and released by the background task if the
+    # stream is never consumed
+    ticket = await admit(api_key, priority)
+    budget = remaining_budget(timeout, pipeline, ticket)
+
+    async def bill_lines() -> AsyncIterator[bytes]:
+        try:
+            async with token_budget.metered(pipeline_name, admission_controller.policy(api_key).name):
+                async for item in pipeline.stream(input_data, timeout=budget):
+                    for bill in item if isinstance(item, BillList) else [item]:
+                        assert isinstance(bill, Bill), "Result is not of type Bill"
+                        yield dump_bill_json(bill) + b"\n"
+        except Exception as e:
+            logger.error(f"Streaming pipeline '{pipeline_name}' failed: {e}", exc_info=True)
+            if isinstance(e, DeadlineExceededError):
+                status = 504
+            elif isinstance(e, TokenBudgetExceededError):
+                status = 429
+            else:
+                status = 500
+            yield json.dumps({"type": "error", "status": status, "detail": str(e)}).encode() + b"\n"
+        finally:
+            ticket.release()
+
+    return StreamingResponse(
+        bill_lines(),
+        media_type="application/x-ndjson",
+        headers={QUEUE_WAIT_HEADER: f"{ticket.wait_seconds:.3f}"},
+        background=BackgroundTask(ticket.release),
+    )
+
+
+@app.websocket("/ws/parse")
+async def parse_websocket(
+    websocket: WebSocket,
+    pipeline_name: str = Query("ocr_then_llm", description="Pipeline name"),
+    priority: Priority | None = PRIORITY_QUERY,
+) -> None:
+    """Endpoint parsing a stream of images over a single authenticated WebSocket session.
+
+    The API key is checked once, from the `X-API-Key` header or the `api_key` query parameter. See
+    `IngestSession` for the frame format, the answers and the flow-control credits.
+    """
+    api_key = websocket.headers.get("X-API-Key") or websocket.query_params.get("api_key")
+    if not is_valid_api_key(api_key):
+        await websocket.close(POLICY_VIOLATION, "Invalid or missing API key")
+        return
+    pipeline = pipeline_manager.get_pipeline(pipeline_name)
+    if pipeline is None:
+        await websocket.close(POLICY_VIOLATION, f"Pipeline '{pipeline_name}' not found")
+        return
+    await websocket.accept()
+    await IngestSession(websocket, pipeline, api_key, priority).run()
+
+
+@app.post("/classification/corrections", tags=["Parsing"], dependencies=[Depends(get_api_key)])
+async def correct_classification(correction: ClassificationCorrection) -> dict:
+    """Endpoint to correct the classification of a returned bill, so that the classification memory
+    classifies the receipts of the same merchant the corrected way. The memory is shared by all API
+    keys, a correction applies to the receipts parsed with any of them.
+
+    Returns:
+        dict: `{"learned": true}` once the memory is updated.
+    """
+    if not classification_memory.enabled:
+        raise HTTPException(
+            status_code=404,
+            detail="The classification memory is disabled, set classification_memory.enabled in settings.yaml",
+        )
+    if not correction.to_classification().is_configured():
+        raise HTTPException(status_code=400, detail="Unknown transaction type, category or account")
+    if not classification_memory.correct(correction):
+        raise HTTPException(status_code=404, detail="Bill not found in the classification memory, send its text")
+    return {"learned": True}
+
+
+def require_ledger() -> None:
+    if not ledger.enabled:
+        raise HTTPException(status_code=404, detail="The ledger is disabled, set ledger.enabled in settings.yaml")
+
+
+@app.get("/ledger/bills", tags=["Ledger"], dependencies=[Depends(get_api_key), Depends(require_ledger)])
+async def ledger_bills(
+    start: datetime | None = Query(None, description="Earliest bill time, inclusive"),
+    end: datetime | None = Query(None, description="Latest bill time, exclusive"),
+    catename: str | None = Query(None),
+    accountname: str | None = Query(None),
+    transaction_type: str | None = Query(None),
+    limit: int = Query(100, gt=0, le=1000),
+    after_id: int | None = Query(None, description="Id of the last bill of the previous page"),
+) -> list[dict]:
+    """Endpoint to list the recorded bills of a time range, ordered by time.
+
+    Returns:
+        list[dict]: The bills with their ledger id, pipeline and recording time.
+    """
+    return await asyncio.to_thread(
+        ledger.query_bills, start, end, catename, accountname, transaction_type, limit, after_id
+    )
+
+
+GROUP_BY_QUERY = Query(["catename"], description=f"Dimensions among {', '.join(AGGREGATE_DIMENSIONS)}")
+
+
+@app.get("/ledger/aggregates", tags=["Ledger"], dependencies=[Depends(get_api_key), Depends(require_ledger)])
+async def ledger_aggregates(
+    start: date | None = Query(None, description="First day, inclusive"),
+    end: date | None = Query(None, description="Last day, inclusive"),
+    period: str = Query("month", pattern="^(day|month|year|all)$"),
+    group_by: list[str] = GROUP_BY_QUERY,
+    catename: str | None = Query(None),
+    accountname: str | None = Query(None),
+    transaction_type: str | None = Query(None),
+) -> list[dict]:
+    """Endpoint to total the recorded bills per period and category/account, from the daily rollups.
+
+    Returns:
+        list[dict]: One row per period and key with the bill count, amount and fee.
+    """
+    try:
+        return await asyncio.to_thread(
+            ledger.aggregate, start, end, period, group_by, catename, accountname, transaction_type
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+@app.get("/ready", tags=["Monitoring"])
+async def ready(response: Response) -> dict:
+    """Readiness probe: 503 until the warm-up has completed, so that no traffic hits a cold instance."""
+    if not warmup_state.ready:
+        response.status_code = 503
+    return warmup_state.to_dict()
+
+
+@app.get("/metrics", tags=["Monitoring"], dependencies=[Depends(get_api_key)])
+async def get_metrics() -> dict:
+    """Endpoint to export the in-process metrics (counters, gauges and summaries)."""
+    rss = process_rss_bytes()
+    if rss is not None:
+        metrics.set("process_resident_memory_bytes", rss)
+    return metrics.snapshot()
+
+
+@app.get("/admin/token_usage", tags=["Monitoring"], dependencies=[Depends(get_admin_api_key)])
+async def get_token_usage() -> dict:
+    """Endpoint to report the LLM tokens used today and this month against the budgets.
+
+    Returns:
+        dict: Per scope (the service and each API key name), the tokens used and the budget of each
+        period, and the degradation its requests currently get.
+    """
+    return token_budget.snapshot()
+
+
+@app.get("/admin/profile", tags=["Monitoring"], dependencies=[Depends(get_admin_api_key)])
+async def profile_server(
+    seconds: float = Query(5, gt=0, le=60, description="Sampling duration in seconds"),
+    interval: float = Query(0.005, ge=0.001, le=1, description="Sampling interval in seconds"),
+    top: int = Query(50, gt=0, description="Number of stacks returned"),
+) -> dict:
+    """Endpoint to capture a sampling profile of the event loop thread and dump the asyncio tasks.
+
+    Returns:
+        dict: The most sampled stacks of the event loop thread (code blocking the loop shows up
+        here), and the pending tasks with the stack they are suspended at.
+    """
+    tasks = dump_tasks()
+    profile = await sample_event_loop(seconds, interval=interval, top=top)
+    return {"profile": profile, "tasks": tasks}
@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import random
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+
+from .config import settings
+from .metrics import metrics
+from .models import Bill, ParserInput
+from .parsers.helpers import BillHelper
+from .token_budget import Degradation, token_budget
+from .usage import TokenUsage
+
+logger = getLogger(__name__)
+
+COMPARED_FIELDS = (
+    "transaction_type",
+    "amount",
+    "time",
+    "catename",
+    "remark",
+    "accountname",
+    "accountname2",
+    "fee",
+)
+# Free text worded differently by every model, reported per field but left out of the overall match
+LOOSE_FIELDS = ("remark",)
+
+# Set while a shadow pipeline runs: its bills must not reach the ledger, the duplicate index or the
+# classification memory, nor be matched against the bills of the primary run
+_shadow_run: ContextVar[bool] = ContextVar("shadow_run", default=False)
+
+
+def is_shadow_run() -> bool:
+    return _shadow_run.get()
+
+
+@contextmanager
+def shadow_run() -> Iterator[None]:
+    token = _shadow_run.set(True)
+    try:
+        yield
+    finally:
+        _shadow_run.reset(token)
+
+
+def compare_fields(primary: Bill, shadow: Bill) -> dict[str, bool]:
+    """
+    Agreement of two bills field by field.
+    """
+    return {
+        field: BillHelper.compare_bill(
+            primary, shadow, **{f"skip_{other}": True for other in COMPARED_FIELDS if other != field}
+        )
+        for field in COMPARED_FIELDS
+    }
+
+
+class ShadowMirror:
+    """
+    Mirrors a sampled fraction of the /parse_image requests to a shadow pipeline (e.g. a new prompt
+    or model), once the primary response has been sent, and compares the bills field by field.
+
+    Shadow runs never delay a client: they are started after the response, in their own task, and
+    have their own concurrency budget. A sample arriving while `max_concurrency` shadow runs are in
+    flight is dropped rather than queued. Shadow runs use neither admission slots nor the request
+    deadline, their bills are not recorded and do not feed the duplicate index nor the
+    classification memory. Their tokens are accounted under the `shadow` key name, and no sample is
+    taken while the token budget of the service degrades it.
+
+    Metrics (labels `primary` and `shadow`):
+        - `shadow_requests_total{outcome}`: match, mismatch, error, dropped or degraded.
+        - `shadow_field_agreement_total{field, agree}`: per field comparisons.
+        - `shadow_latency_delta_seconds`, `shadow_token_delta`: shadow minus primary.
+    """
+
+    def __init__(
+        self,
+        enabled: bool | None = None,
+        sample_rate: float | None = None,
+        max_concurrency: int | None = None,
+        timeout: float | None = None,
+        pipelines: dict[str, str] | None = None,
+    ) -> None:
+        self._enabled = enabled
+        self._sample_rate = sample_rate
+        self._max_concurrency = max_concurrency
+        self._timeout = timeout
+        self._pipelines = pipelines
+        self._initialized = False
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        shadow_settings = settings.get("shadow", {}) or {}
+        if self._enabled is None:
+            self._enabled = bool(shadow_settings.get("enabled", False))
+        if self._sample_rate is None:
+            self._sample_rate = float(shadow_settings.get("sample_rate", 0.05))
+        if self._max_concurrency is None:
+            self._max_concurrency = int(shadow_settings.get("max_concurrency", 2))
+        if self._timeout is None and shadow_settings.get("timeout_seconds"):
+            self._timeout = float(shadow_settings["timeout_seconds"])
+        if self._pipelines is None:
+            self._pipelines = dict(shadow_settings.get("pipelines", {}) or {})
+        self.in_flight = 0
+        self._tasks: set[asyncio.Task] = set()
+        self._initialized = True
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return bool(self._enabled)
+
+    def shadow_of(self, primary: str) -> str | None:
+        """
+        Name of the pipeline shadowing the primary pipeline, None if it is not mirrored.
+        """
+        self._initialize()
+        if not self._enabled:
+            return None
+        return self._pipelines.get(primary)
+
+    async def mirror(
+        self,
+        primary: str,
+        input_data: ParserInput,
+        primary_bill: Bill,
+        primary_seconds: float,
+        primary_usage: TokenUsage | None = None,
+    ) -> bool:
+        """
+        Sample the request and start its shadow run. Meant to run once the primary response is
+        sent (as a response background task), it returns without waiting for the shadow run.
+
+        Returns:
+            bool: Whether a shadow run was started.
+        """
+        shadow = self.shadow_of(primary)
+        if shadow is None or random.random() >= self._sample_rate:
+            return False
+        if token_budget.degradation() is not Degradation.NONE:
+            metrics.inc("shadow_requests_total", primary=primary, shadow=shadow, outcome="degraded")
+            return False
+        if self.in_flight >= self._max_concurrency:
+            metrics.inc("shadow_requests_total", primary=primary, shadow=shadow, outcome="dropped")
+            return False
+        self.in_flight += 1
+        metrics.set("shadow_in_flight", self.in_flight)
+        primary_tokens = primary_usage.total_tokens if primary_usage is not None else None
+        # A fresh context: the shadow run must not inherit the deadline nor the token usage tracker
+        # of the request
+        task = asyncio.get_running_loop().create_task(
+            self._run(primary, shadow, input_data, primary_bill, primary_seconds, primary_tokens),
+            context=contextvars.Context(),
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return True
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self.in_flight -= 1
+        metrics.set("shadow_in_flight", self.in_flight)
+
+    async def _run(
+        self,
+        primary: str,
+        shadow: str,
+        input_data: ParserInput,
+        primary_bill: Bill,
+        primary_seconds: float,
+        primary_tokens: int | None,
+    ) -> None:
+        from .pipeline import pipeline_manager
+
+        labels = {"primary": primary, "shadow": shadow}
+        pipeline = pipeline_manager.get_pipeline(shadow)
+        if pipeline is None:
+            metrics.inc("shadow_requests_total", **labels, outcome="error")
+            return
+        started = time.perf_counter()
+        try:
+            with shadow_run():
+                async with token_budget.metered(shadow, "shadow") as usage:
+                    result = await pipeline.run(input_data, timeout=self._timeout)
+        except Exception as e:
+            logger.warning(f"Shadow pipeline '{shadow}' failed: {e}")
+            metrics.inc("shadow_requests_total", **labels, outcome="error")
+            return
+        seconds = time.perf_counter() - started
+        if not isinstance(result, Bill):
+            logger.warning(f"Shadow pipeline '{shadow}' produced {type(result).__name__}, expected Bill")
+            metrics.inc("shadow_requests_total", **labels, outcome="error")
+            return
+        agreement = compare_fields(primary_bill, result)
+        for field, agree in agreement.items():
+            metrics.inc("shadow_field_agreement_total", **labels, field=field, agree=str(agree).lower())
+        disagreements = [field for field, agree in agreement.items() if not agree and field not in LOOSE_FIELDS]
+        if disagreements:
+            logger.info(f"Shadow pipeline '{shadow}' disagrees with '{primary}' on {', '.join(disagreements)}")
+        metrics.inc("shadow_requests_total", **labels, outcome="mismatch" if disagreements else "match")
+        metrics.observe("shadow_latency_delta_seconds", seconds - primary_seconds, **labels)
+        if primary_tokens is not None:
+            metrics.observe("shadow_token_delta", usage.total_tokens - primary_tokens, **labels)
+
+    async def drain(self) -> None:
+        """
+        Wait for the shadow runs in flight.
+        """
+        self._initialize()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+shadow_mirror = ShadowMirror()
@@ -0,0 +1,314 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from enum import StrEnum
+from logging import getLogger
+from pathlib import Path
+
+from .config import ROOT_DIR, settings
+from .metrics import metrics
+from .usage import TokenUsage, track_usage
+
+logger = getLogger(__name__)
+
+
+class Degradation(StrEnum):
+    NONE = "none"
+    CHEAP_MODEL = "cheap_model"  # LLM parsers call their `cheap_model`
+    COMPACT_PROMPT = "compact_prompt"  # prompts keep only the `prompt.compact_top_k` best candidates
+    LOCAL_ONLY = "local_only"  # no LLM call, bills only come from the caches and the classification memory
+
+    @property
+    def rank(self) -> int:
+        return _LEVELS.index(self)
+
+
+_LEVELS = list(Degradation)
+# Share of the tightest budget used from which each degradation applies
+DEFAULT_DEGRADE_AT = {
+    Degradation.CHEAP_MODEL: 0.8,
+    Degradation.COMPACT_PROMPT: 0.9,
+    Degradation.LOCAL_ONLY: 1.0,
+}
+PERIODS = ("daily", "monthly")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_usage (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    day TEXT NOT NULL,
+    api_key TEXT NOT NULL,
+    pipeline TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    llm_requests INTEGER NOT NULL,
+    degradation TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS token_usage_day ON token_usage (day, api_key);
+"""
+_INSERT_USAGE = """
+INSERT INTO token_usage (
+    time, day, api_key, pipeline, prompt_tokens, completion_tokens, llm_requests, degradation
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Degradation decided for the current request, read by the LLM parsers
+_degradation: ContextVar[Degradation] = ContextVar("degradation", default=Degradation.NONE)
+
+
+def current_degradation() -> Degradation:
+    return _degradation.get()
+
+
+class TokenBudgetExceededError(Exception):
+    """
+    The token budget is exhausted and the bill could not be produced without an LLM call.
+    """
+
+
+class TokenBudget:
+    """
+    Accounts the LLM tokens used by each request, per pipeline and per API key (by its name in the
+    admission settings, never the key itself), and degrades the service as the daily or monthly
+    budgets run out.
+
+    Each metered request is appended to an embedded SQLite table; the totals of the current day and
+    month are kept in memory and reloaded from the table at startup. The degradation of a request is
+    decided once, when it starts, from the tightest of the service and key budgets:
+    `cheap_model`, then `compact_prompt`, then `local_only` from the shares set in `degrade_at`.
+    """
+
+    def __init__(
+        self,
+        path: Path | str | None = None,
+        enabled: bool | None = None,
+        daily_tokens: int | None = None,
+        monthly_tokens: int | None = None,
+        keys: dict[str, dict] | None = None,
+        degrade_at: dict[str, float | None] | None = None,
+    ) -> None:
+        self._path = Path(path) if path is not None else None
+        self._enabled = enabled
+        self._daily_tokens = daily_tokens
+        self._monthly_tokens = monthly_tokens
+        self._keys = keys
+        self._degrade_at = degrade_at
+        self._initialized = False
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _initialize(self):
+        if self._initialized:
+            return
+        budget_settings = settings.get("token_budget", {}) or {}
+        if self._enabled is None:
+            self._enabled = bool(budget_settings.get("enabled", False))
+        if self._path is None:
+            path = Path(budget_settings.get("path") or "data/token_usage.sqlite3")
+            self._path = path if path.is_absolute() else ROOT_DIR / path
+        if self._daily_tokens is None:
+            self._daily_tokens = int(budget_settings.get("daily_tokens", 0) or 0)
+        if self._monthly_tokens is None:
+            self._monthly_tokens = int(budget_settings.get("monthly_tokens", 0) or 0)
+        if self._keys is None:
+            self._keys = {name: dict(limits or {}) for name, limits in (budget_settings.get("keys", {}) or {}).items()}
+        degrade_at = self._degrade_at if self._degrade_at is not None else budget_settings.get("degrade_at")
+        if degrade_at is None:
+            thresholds = dict(DEFAULT_DEGRADE_AT)
+        else:
+            # Levels left out (or set to null) are skipped
+            thresholds = {Degradation(level): float(share) for level, share in degrade_at.items() if share is not None}
+        self.thresholds = sorted(thresholds.items(), key=lambda item: item[0].rank)
+        self._day, self._month = self._periods()
+        self.used: dict[str, Counter[str]] = {period: Counter() for period in PERIODS}
+        self._initialized = True
+        if self._enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        self._initialize()
+        return bool(self._enabled)
+
+    @staticmethod
+    def _periods() -> tuple[str, str]:
+        today = datetime.now().date().isoformat()
+        return today, today[:7]
+
+    def _connect(self) -> sqlite3.Connection:
+        self._initialize()
+        if self._connection is None:
+            assert self._path is not None
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _load(self) -> None:
+        """
+        Reload the totals of the current day and month from the table.
+        """
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT day, api_key, SUM(prompt_tokens + completion_tokens) FROM token_usage "
+                    "WHERE day >= ? GROUP BY day, api_key",
+                    (f"{self._month}-01",),
+                )
+                .fetchall()
+            )
+        for day, key_name, tokens in rows:
+            self._add(key_name, int(tokens), day)
+
+    def _add(self, key_name: str, tokens: int, day: str) -> None:
+        # Totals are kept per key name, and for the whole service under ""
+        for name in (key_name, ""):
+            self.used["monthly"][name] += tokens
+            if day == self._day:
+                self.used["daily"][name] += tokens
+
+    def _roll_over(self) -> None:
+        day, month = self._periods()
+        if day != self._day:
+            self.used["daily"].clear()
+            if month != self._month:
+                self.used["monthly"].clear()
+            self._day, self._month = day, month
+
+    def _limit(self, period: str, key_name: str) -> int:
+        if key_name == "":
+            return self._daily_tokens if period == "daily" else self._monthly_tokens
+        return int((self._keys.get(key_name) or {}).get(f"{period}_tokens", 0) or 0)
+
+    def ratios(self, key_name: str | None = None) -> dict[str, float]:
+        """
+        Share of each budget used, for the service and, with a key name, for the key. Budgets set to
+        0 are unlimited and left out.
+        """
+        self._initialize()
+        self._roll_over()
+        ratios = {}
+        for period in PERIODS:
+            for name in ("", key_name) if key_name else ("",):
+                limit = self._limit(period, name)
+                if limit > 0:
+                    ratios[f"{name or 'service'}:{period}"] = self.used[period][name] / limit
+        return ratios
+
+    def degradation(self, key_name: str | None = None) -> Degradation:
+        """
+        Degradation a request of the key gets, from the tightest of the budgets that apply to it.
+        """
+        if not self.enabled:
+            return Degradation.NONE
+        used = max(self.ratios(key_name).values(), default=0.0)
+        level = Degradation.NONE
+        for candidate, share in self.thresholds:
+            if used >= share:
+                level = candidate
+        return level
+
+    def retry_after(self, key_name: str | None = None) -> float:
+        """
+        Seconds until the exhausted budgets of the key are renewed.
+        """
+        now = datetime.now()
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        next_month = datetime.combine(
+            (now.date().replace(day=28) + timedelta(days=4)).replace(day=1), datetime.min.time()
+        )
+        exhausted = [name for name, ratio in self.ratios(key_name).items() if ratio >= 1]
+        reset = next_month if any(name.endswith(":monthly") for name in exhausted) else tomorrow
+        return (reset - now).total_seconds()
+
+    @asynccontextmanager
+    async def metered(self, pipeline: str, key_name: str) -> AsyncIterator[TokenUsage]:
+        """
+        Account the tokens used in the block for the pipeline and the key, whether the block
+        succeeds or not, and set the degradation of the request for the parsers.
+        """
+        level = self.degradation(key_name)
+        metrics.set("token_budget_degradation", level.rank, api_key=key_name)
+        if level is not Degradation.NONE:
+            metrics.inc("token_budget_degraded_requests_total", api_key=key_name, level=level.value)
+        token = _degradation.set(level)
+        try:
+            with track_usage() as usage:
+                yield usage
+        finally:
+            _degradation.reset(token)
+            await self.record(usage, pipeline, key_name, level)
+
+    async def record(self, usage: TokenUsage, pipeline: str, key_name: str, level: Degradation) -> None:
+        """
+        Account the usage of a request. Failures to persist it are logged, never raised.
+        """
+        labels = {"api_key": key_name, "pipeline": pipeline}
+        metrics.observe("llm_request_tokens", usage.total_tokens, **labels)
+        if usage.requests == 0:
+            return
+        metrics.inc("llm_tokens_total", usage.prompt_tokens, **labels, kind="prompt")
+        metrics.inc("llm_tokens_total", usage.completion_tokens, **labels, kind="completion")
+        if not self.enabled:
+            return
+        self._roll_over()
+        self._add(key_name, usage.total_tokens, self._day)
+        for name, ratio in self.ratios(key_name).items():
+            scope, period = name.split(":")
+            metrics.set("token_budget_used_ratio", ratio, scope=scope, period=period)
+        row = (
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            self._day,
+            key_name,
+            pipeline,
+            usage.prompt_tokens,
+            usage.completion_tokens,
+            usage.requests,
+            level.value,
+        )
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._append, row)
+        except Exception as e:
+            logger.error(f"Failed to record the token usage of a '{pipeline}' request: {e}", exc_info=True)
+            metrics.inc("token_budget_errors_total")
+            return
+        metrics.observe("token_budget_append_seconds", time.perf_counter() - start)
+
+    def _append(self, row: tuple) -> None:
+        with self._lock:
+            self._connect().execute(_INSERT_USAGE, row)
+
+    def snapshot(self) -> dict:
+        """
+        Tokens used and budgets of the service and of the keys with a budget or usage this month.
+        """
+        self._initialize()
+        self._roll_over()
+        names = sorted({""} | set(self.used["monthly"]) | set(self._keys))
+        scopes = {}
+        for name in names:
+            scopes[name or "service"] = {
+                period: {"used": self.used[period][name], "budget": self._limit(period, name)} for period in PERIODS
+            }
+            scopes[name or "service"]["degradation"] = self.degradation(name or None).value
+        return {"enabled": self.enabled, "day": self._day, "scopes": scopes}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+token_budget = TokenBudget()
@@ -0,0 +1,88 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+
+class TokenUsage:
+    """
+    LLM tokens consumed while a tracker is active. Trackers nest: the usage recorded in an inner
+    tracker (e.g. a pipeline run) is also added to the outer ones (e.g. the request).
+    """
+
+    def __init__(self, parent: "TokenUsage | None" = None) -> None:
+        self.parent = parent
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.requests = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens: int, completion_tokens: int, requests: int = 1) -> None:
+        usage: TokenUsage | None = self
+        while usage is not None:
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+            usage.requests += requests
+            usage = usage.parent
+
+    def to_dict(self) -> dict[str, int]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "requests": self.requests,
+        }
+
+
+# Tracker of the current request. Tasks created while it is set (parallel branches, batches of a
+# multi-bill parser) inherit it through their context copy.
+_usage: ContextVar[TokenUsage | None] = ContextVar("token_usage", default=None)
+
+
+def current_usage() -> TokenUsage | None:
+    return _usage.get()
+
+
+@contextmanager
+def track_usage() -> Iterator[TokenUsage]:
+    usage = TokenUsage(parent=_usage.get())
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def record_usage(response_usage: Any) -> None:
+    """
+    Add the `usage` of an OpenAI-compatible response to the active trackers, if any.
+    """
+    usage = _usage.get()
+    if usage is None or response_usage is None:
+        return
+    usage.add(
+        int(getattr(response_usage, "prompt_tokens", 0) or 0),
+        int(getattr(response_usage, "completion_tokens", 0) or 0),
+    )
+
+
+def split_usage(usage: TokenUsage, trackers: list[TokenUsage | None]) -> None:
+    """
+    Share the usage of a request made for several callers (e.g. a micro-batch) between their
+    trackers, as evenly as whole tokens allow.
+    """
+    if not trackers:
+        return
+    count = len(trackers)
+    prompt, prompt_rest = divmod(usage.prompt_tokens, count)
+    completion, completion_rest = divmod(usage.completion_tokens, count)
+    for idx, tracker in enumerate(trackers):
+        if tracker is not None:
+            tracker.add(
+                prompt + (idx < prompt_rest),
+                completion + (idx < completion_rest),
+                requests=usage.requests if idx == 0 else 0,
+            )
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from pathlib import Path
+
+from .config import ROOT_DIR, settings
+from .deadline import DeadlineExceededError, deadline_scope
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+# Set while the warm-up replays a sample through the pipelines, LLM parsers then answer locally
+_dry_run: ContextVar[bool] = ContextVar("dry_run", default=False)
+
+
+def is_dry_run() -> bool:
+    return _dry_run.get()
+
+
+@contextmanager
+def dry_run() -> Iterator[None]:
+    token = _dry_run.set(True)
+    try:
+        yield
+    finally:
+        _dry_run.reset(token)
+
+
+class WarmupState:
+    """
+    Progress of the warm-up, reported by the readiness endpoint.
+    """
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.durations: dict[str, float] = {}
+        self.errors: dict[str, str] = {}
+
+    def to_dict(self) -> dict:
+        return {"ready": self.ready, "durations": self.durations, "errors": self.errors}
+
+
+warmup_state = WarmupState()
+
+
+async def _timed(name: str, awaitable: Awaitable) -> None:
+    start = time.perf_counter()
+    try:
+        await awaitable
+    except Exception as e:
+        # A failed warm-up task only costs latency on the first request, it must not block readiness
+        logger.warning(f"Warm-up task '{name}' failed: {e}")
+        warmup_state.errors[name] = str(e)
+    finally:
+        duration = time.perf_counter() - start
+        warmup_state.durations[name] = duration
+        metrics.observe("warmup_task_seconds", duration, task=name)
+
+
+def _initialize_helpers() -> None:
+    from .parsers.helpers import asset_helper, category_helper
+    from .serialization import BILL_ADAPTER, BILLS_ADAPTER
+
+    category_helper._initialize()
+    asset_helper._initialize()
+    # Build the JSON schemas once, the serializers are already compiled at import
+    BILL_ADAPTER.json_schema()
+    BILLS_ADAPTER.json_schema()
+
+
+async def _replay_sample(sample_image: Path, pipeline_names: list[str]) -> None:
+    """
+    Run the sample image through the pipelines taking images, with the LLM parsers in dry-run
+    mode, so that every code path (OCR connection, prompt building, validation) is warm.
+    """
+    from .models import RawImage
+    from .pipeline import pipeline_manager
+
+    data = RawImage(sample_image.read_bytes())
+    names = pipeline_names or list(pipeline_manager.pipelines)
+    tasks = []
+    for name in names:
+        pipeline = pipeline_manager.get_pipeline(name)
+        if pipeline is None or not issubclass(RawImage, pipeline.input_type):
+            continue
+
+        async def run(pipeline=pipeline):
+            with dry_run():
+                await pipeline.run(data)
+
+        tasks.append(_timed(f"replay:{name}", run()))
+    await asyncio.gather(*tasks)
+
+
+async def warm_up() -> WarmupState:
+    """
+    Run the warm-up tasks concurrently:
+        - Initialize the category and asset helpers and build the pydantic schemas.
+        - Open the provider connections of every parser providing `warm_up` (TLS handshakes,
+          Qianfan access token).
+        - Optionally replay `warmup.sample_image` through the pipelines with a dry-run LLM.
+
+    Failures are logged and recorded, the state is marked ready once every task has finished or
+    `warmup.timeout_seconds` has elapsed.
+    """
+    from .parsers.manager import parser_manager
+
+    warmup_settings = settings.get("warmup", {}) or {}
+    start = time.perf_counter()
+    try:
+        async with deadline_scope(float(warmup_settings.get("timeout_seconds", 60)), "warmup"):
+            tasks = [_timed("helpers", asyncio.to_thread(_initialize_helpers))]
+            for name, parser in parser_manager.parsers.items():
+                parser_warm_up = getattr(parser, "warm_up", None)
+                if parser_warm_up is not None:
+                    tasks.append(_timed(f"connect:{name}", parser_warm_up()))
+            await asyncio.gather(*tasks)
+            # The replay needs the helpers, so it runs once they are initialized
+            sample_image = warmup_settings.get("sample_image")
+            if sample_image:
+                path = Path(sample_image)
+                path = path if path.is_absolute() else ROOT_DIR / path
+                await _replay_sample(path, warmup_settings.get("pipelines", []))
+    except DeadlineExceededError as e:
+        logger.warning(f"Warm-up did not complete in time: {e}")
+        warmup_state.errors["timeout"] = str(e)
+    warmup_state.ready = True
+    logger.info(f"Warm-up completed in {time.perf_counter() - start:.2f}s, errors: {warmup_state.errors or 'none'}")
+    return warmup_state
@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import json
+import time
+from collections.abc import Awaitable
+from logging import getLogger
+
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from .admission import AdmissionRejectedError, Priority, admission_controller
+from .config import settings
+from .deadline import DeadlineExceededError
+from .metrics import metrics
+from .models import Bill, BillList, raw_file_input
+from .pipeline import Pipeline
+from .serialization import dump_bill_json, dump_bills_json
+from .token_budget import TokenBudgetExceededError, token_budget
+
+logger = getLogger(__name__)
+
+# Close code sent to clients breaking the protocol (e.g. sending frames without credits)
+POLICY_VIOLATION = 1008
+_ID_LENGTH_BYTES = 2
+
+
+class FrameError(ValueError):
+    """
+    Raised when a binary frame does not follow the `<id length><id><image>` layout.
+    """
+
+
+def encode_frame(client_id: str, data: bytes) -> bytes:
+    """
+    Build an image frame: the length of the UTF-8 client id on two bytes (big-endian), the id, then
+    the image or PDF bytes.
+    """
+    encoded_id = client_id.encode("utf-8")
+    return len(encoded_id).to_bytes(_ID_LENGTH_BYTES, "big") + encoded_id + data
+
+
+def decode_frame(frame: bytes) -> tuple[str, bytes]:
+    """
+    Raises:
+        FrameError: If the frame is truncated, has an empty id or no payload.
+    """
+    if len(frame) < _ID_LENGTH_BYTES:
+        raise FrameError("Frame is shorter than its id length prefix")
+    id_length = int.from_bytes(frame[:_ID_LENGTH_BYTES], "big")
+    end = _ID_LENGTH_BYTES + id_length
+    if id_length == 0 or len(frame) <= end:
+        raise FrameError("Frame has an empty client id or no payload")
+    try:
+        client_id = frame[_ID_LENGTH_BYTES:end].decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise FrameError(f"Client id is not valid UTF-8: {e}") from e
+    return client_id, frame[end:]
+
+
+class IngestSession:
+    """
+    A long-lived parsing session over a WebSocket, authenticated once at the handshake.
+
+    Protocol:
+        - The server starts with `{"type": "ready", "credits": n, "max_frame_bytes": m}`.
+        - Each binary frame from the client carries one image (see `encode_frame`) and consumes a
+          credit. Frames are parsed concurrently, each through the admission controller like an
+          HTTP request.
+        - Each frame gets exactly one answer as soon as its pipeline run finishes, in any order:
+          `{"type": "result", "id": ..., "bill": {...}}` (`"bills": [...]` for multi-bill pipelines)
+          or `{"type": "error", "id": ..., "status": ..., "detail": ...}`. Every answer returns its
+          credit to the client once it is sent.
+        - A frame sent without a credit left closes the session with code 1008.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        pipeline: Pipeline,
+        api_key: str,
+        priority: Priority | None = None,
+        credits: int | None = None,
+        max_frame_bytes: int | None = None,
+    ) -> None:
+        ws_settings = settings.get("websocket", {}) or {}
+        self.websocket = websocket
+        self.pipeline = pipeline
+        self.api_key = api_key
+        self.priority = priority
+        self.credits = int(credits if credits is not None else ws_settings.get("credits", 8))
+        self.max_frame_bytes = int(
+            max_frame_bytes if max_frame_bytes is not None else ws_settings.get("max_frame_bytes", 10 * 2**20)
+        )
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._rejected_ids = itertools.count()
+        self._send_lock = asyncio.Lock()
+
+    async def run(self) -> None:
+        await self._send({"type": "ready", "credits": self.credits, "max_frame_bytes": self.max_frame_bytes})
+        metrics.inc("ws_sessions_total")
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                frame = message.get("bytes")
+                if frame is None:
+                    await self._send_text(self._error(None, 400, "Only binary image frames are accepted"))
+                    continue
+                # Answers not sent yet still hold their credit
+                if len(self._in_flight) >= self.credits:
+                    metrics.inc("ws_frames_total", outcome="credit_exceeded")
+                    await self.websocket.close(POLICY_VIOLATION, "Flow control credits exceeded")
+                    break
+                self._accept(frame)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            tasks = list(self._in_flight.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _accept(self, frame: bytes) -> None:
+        try:
+            client_id, data = decode_frame(frame)
+        except FrameError as e:
+            self._spawn(None, self._immediate(self._error(None, 400, str(e))))
+            return
+        if client_id in self._in_flight:
+            error = self._error(client_id, 409, f"Frame '{client_id}' is already being parsed")
+            self._spawn(None, self._immediate(error))
+        elif len(data) > self.max_frame_bytes:
+            error = self._error(client_id, 413, f"Frame is larger than {self.max_frame_bytes} bytes")
+            self._spawn(None, self._immediate(error))
+        else:
+            self._spawn(client_id, self._parse(client_id, data))
+
+    def _spawn(self, client_id: str | None, answer: Awaitable[str]) -> None:
+        # Rejected frames hold their credit until the error is sent, under a key no frame can use
+        key = client_id if client_id is not None else f"\0rejected-{next(self._rejected_ids)}"
+        self._in_flight[key] = asyncio.create_task(self._answer(key, answer))
+
+    async def _answer(self, key: str, answer: Awaitable[str]) -> None:
+        try:
+            await self._send_text(await answer)
+        finally:
+            # The credit is given back once the answer is sent: a client that does not read its
+            # answers runs out of credits instead of piling them up on the server
+            self._in_flight.pop(key, None)
+
+    @staticmethod
+    async def _immediate(text: str) -> str:
+        return text
+
+    async def _parse(self, client_id: str, data: bytes) -> str:
+        start = time.perf_counter()
+        key_name = admission_controller.policy(self.api_key).name
+        try:
+            async with admission_controller.slot(self.api_key, self.priority) as ticket:
+                timeout = self.pipeline.timeout
+                if timeout is not None:
+                    timeout -= ticket.wait_seconds
+                    if timeout <= 0:
+                        raise DeadlineExceededError("Deadline exceeded while waiting in the queue")
+                async with token_budget.metered(self.pipeline.name, key_name):
+                    result = await self.pipeline.run(raw_file_input(data), timeout=timeout)
+        except AdmissionRejectedError as e:
+            return self._error(client_id, 429, str(e), retry_after=e.retry_after)
+        except TokenBudgetExceededError as e:
+            return self._error(client_id, 429, str(e), retry_after=round(token_budget.retry_after(key_name)))
+        except DeadlineExceededError as e:
+            return self._error(client_id, 504, str(e))
+        except Exception as e:
+            logger.error(f"Failed to parse frame '{client_id}' with pipeline '{self.pipeline.name}': {e}")
+            return self._error(client_id, 500, str(e))
+        metrics.observe("ws_frame_seconds", time.perf_counter() - start, pipeline=self.pipeline.name)
+        metrics.inc("ws_frames_total", outcome="ok")
+        # The bill JSON is spliced in as is instead of being decoded and dumped again
+        if isinstance(result, BillList):
+            body = b'"bills":' + dump_bills_json(result)
+        else:
+            assert isinstance(result, Bill), "Result is not of type Bill"
+            body = b'"bill":' + dump_bill_json(result)
+        header = f'{{"type":"result","id":{json.dumps(client_id, ensure_ascii=False)},'.encode()
+        return (header + body + b"}").decode("utf-8")
+
+    @staticmethod
+    def _error(client_id: str | None, status: int, detail: str, **extra) -> str:
+        metrics.inc("ws_frames_total", outcome="error" if status == 500 else str(status))
+        message = {"type": "error", "id": client_id, "status": status, "detail": detail, **extra}
+        return json.dumps(message, ensure_ascii=False)
+
+    async def _send(self, message: dict) -> None:
+        await self._send_text(json.dumps(message, ensure_ascii=False))
+
+    async def _send_text(self, text: str) -> None:
+        # Answers are produced by concurrent tasks, the socket must see one message at a time
+        async with self._send_lock:
+            if self.websocket.application_state is not WebSocketState.CONNECTED:
+                return
+            try:
+                await self.websocket.send_text(text)
+            except (WebSocketDisconnect, RuntimeError) as e:
+                logger.debug(f"Dropping an answer, the client is gone: {e}")
@@ -0,0 +1,84 @@
+"""
+Bills and LLM parser doubles shared by the tests.
+"""
+
+import datetime
+import json
+from types import SimpleNamespace
+
+from billparser.models import Bill, TransactionType
+from billparser.parsers.ds_parsers import OpenAICompatibleLLMParser
+from billparser.parsers.helpers import asset_helper, category_helper
+
+# Payment time of the 盒马 receipt used across the tests
+BILL_TIME = datetime.datetime(2025, 10, 26, 17, 27, 53)
+
+
+def make_bill(
+    amount: float = 53.7,
+    catename: str = "外卖",
+    time: datetime.datetime = BILL_TIME,
+    accountname: str = "招商银行信用卡",
+    **fields,
+) -> Bill:
+    """
+    An expense bill, paid by credit card for a takeaway meal unless told otherwise.
+    """
+    return Bill(
+        transaction_type=TransactionType.EXPENSE,
+        amount=amount,
+        time=time,
+        catename=category_helper.get_category(TransactionType.EXPENSE, catename),
+        accountname=asset_helper.get_asset(accountname),
+        **fields,
+    )
+
+
+def bill_json(amount: float = 53.7, catename: str | None = "外卖", time: str = "2025-10-26 17:27:53", **fields) -> dict:
+    """
+    The answer of an LLM for the bill of `make_bill`, extra fields (id, confidence, ...) included.
+    """
+    return {
+        "transaction_type": "支出",
+        "amount": amount,
+        "time": time,
+        "catename": catename,
+        "remark": None,
+        "accountname": "招商银行信用卡",
+        "accountname2": None,
+        "fee": None,
+        **fields,
+    }
+
+
+class FakeLLMParser(OpenAICompatibleLLMParser):
+    """
+    An OpenAI-compatible parser answering canned responses in order (dicts are sent as JSON,
+    exceptions are raised as provider errors), recording the prompts it is sent.
+    """
+
+    name = "fake_llm"
+
+    def __init__(self, responses: list[str | dict | Exception]):
+        self.responses = [
+            json.dumps(response, ensure_ascii=False) if isinstance(response, dict) else response
+            for response in responses
+        ]
+        self.prompts: list[str] = []
+        self._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._create)))
+
+    async def _create(self, model: str, messages: list[dict]):
+        self.prompts.append(messages[-1]["content"])
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        message = SimpleNamespace(content=response)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def model(self) -> str:
+        return "fake"
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from billparser.admission import AdmissionController, AdmissionRejectedError, KeyPolicy, Priority
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_fifo():
+    controller = AdmissionController(max_in_flight=1, max_queue=2, queue_timeout_seconds=5)
+    first = await controller.acquire()
+    order: list[int] = []
+
+    async def worker(idx: int):
+        async with controller.slot() as ticket:
+            order.append(idx)
+            return ticket.wait_seconds
+
+    tasks = [asyncio.create_task(worker(idx)) for idx in range(2)]
+    await asyncio.sleep(0)
+    assert len(controller.waiters) == 2
+    first.release()
+    first.release()  # releasing twice is a no-op
+    waits = await asyncio.gather(*tasks)
+    assert order == [0, 1]
+    assert all(wait >= 0 for wait in waits)
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_rejects_when_queue_full():
+    controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout_seconds=5)
+    ticket = await controller.acquire()
+    with pytest.raises(AdmissionRejectedError) as e:
+        await controller.acquire()
+    assert e.value.reason == "queue_full"
+    assert e.value.retry_after >= 1
+    ticket.release()
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_rejects_on_timeout():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout_seconds=0.01)
+    ticket = await controller.acquire()
+    with pytest.raises(AdmissionRejectedError) as e:
+        await controller.acquire()
+    assert e.value.reason == "timeout"
+    assert not controller.waiters
+    ticket.release()
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_cancelled_waiter_keeps_slots():
+    controller = AdmissionController(max_in_flight=1, max_queue=2, queue_timeout_seconds=5)
+    ticket = await controller.acquire()
+    waiter = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    ticket.release()
+    assert controller.in_flight == 0
+    assert not controller.waiters
+
+
+@pytest.mark.asyncio
+async def test_admission_retry_after_from_throughput():
+    controller = AdmissionController(max_in_flight=2, max_queue=10, queue_timeout_seconds=5)
+    ticket = await controller.acquire()
+    ticket.started -= 3.5  # the request took 3.5 seconds
+    ticket.release()
+    assert controller.throughput == pytest.approx(2 / 3.5, rel=0.01)
+    assert controller.retry_after() == 2
+
+
+@pytest.mark.asyncio
+async def test_admission_fair_share_between_keys():
+    controller = AdmissionController(
+        max_in_flight=1,
+        max_queue=10,
+        queue_timeout_seconds=5,
+        key_policies={"bulk": KeyPolicy(name="bulk", priority=Priority.BULK), "phone": KeyPolicy(name="phone")},
+    )
+    blocker = await controller.acquire("bulk")
+    order: list[str] = []
+
+    async def worker(key: str):
+        async with controller.slot(key):
+            order.append(key)
+            await asyncio.sleep(0)
+
+    tasks = [asyncio.create_task(worker("bulk")) for _ in range(4)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(worker("phone")))
+    await asyncio.sleep(0)
+    blocker.release()
+    await asyncio.gather(*tasks)
+    # The interactive request queued last overtakes the bulk backlog
+    assert order[0] == "phone"
+    assert order[1:] == ["bulk"] * 4
+
+
+@pytest.mark.asyncio
+async def test_admission_per_key_caps():
+    controller = AdmissionController(
+        max_in_flight=2,
+        max_queue=10,
+        queue_timeout_seconds=5,
+        max_queue_per_key=1,
+        key_policies={"a": KeyPolicy(name="a", max_in_flight=1)},
+    )
+    ticket = await controller.acquire("a")
+    waiter = asyncio.create_task(controller.acquire("a"))
+    await asyncio.sleep(0)
+    # The key is at its own cap, the free slot goes to another key
+    assert controller.in_flight == 1
+    with pytest.raises(AdmissionRejectedError) as e:
+        await controller.acquire("a")
+    assert e.value.reason == "key_queue_full"
+    other = await controller.acquire("b")
+    ticket.release()
+    (await waiter).release()
+    other.release()
+    assert controller.in_flight == 0
@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from billparser.balancer import Endpoint, EndpointBalancer, EndpointError
+from billparser.http_client import LoopBoundClient
+from billparser.models import RawImage
+from billparser.parsers.pp_parsers import PpEndpoint, PPOCRV5Parser
+
+
+def _balancer(count: int = 2, **kwargs) -> EndpointBalancer:
+    return EndpointBalancer("test", [Endpoint(f"e{idx}", idx) for idx in range(count)], **kwargs)
+
+
+async def _fail(balancer: EndpointBalancer, error: Exception) -> Endpoint:
+    with pytest.raises(type(error)):
+        async with balancer.request() as endpoint:
+            raise error
+    return endpoint
+
+
+@pytest.mark.asyncio
+async def test_least_outstanding():
+    balancer = _balancer(3)
+    started = asyncio.Event()
+    picked: list[str] = []
+
+    async def hold():
+        async with balancer.request() as endpoint:
+            picked.append(endpoint.name)
+            await started.wait()
+
+    tasks = [asyncio.create_task(hold()) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert sorted(picked) == ["e0", "e1", "e2"]
+    started.set()
+    await asyncio.gather(*tasks)
+    assert all(endpoint.outstanding == 0 for endpoint in balancer.endpoints)
+
+
+@pytest.mark.asyncio
+async def test_ewma_prefers_fast_endpoint():
+    balancer = _balancer(2, strategy="ewma")
+    balancer.endpoints[0].ewma_seconds = 2.0
+    balancer.endpoints[1].ewma_seconds = 0.2
+    assert {balancer.pick().name for _ in range(4)} == {"e1"}
+    # Until the fast endpoint has enough requests in flight to be slower
+    balancer.endpoints[1].outstanding = 10
+    assert balancer.pick().name == "e0"
+
+
+@pytest.mark.asyncio
+async def test_ejection_and_readmission():
+    balancer = _balancer(2, failure_threshold=2, ejection_seconds=0.05)
+    failing = balancer.endpoints[0]
+    # Errors caused by the request do not count against the endpoint
+    for _ in range(3):
+        await _fail(balancer, ValueError("bad image"))
+    assert failing.consecutive_failures == 0
+    for _ in range(2):
+        balancer._record_failure(failing, EndpointError("quota exhausted"))
+    assert failing.ejected_until > 0
+    assert {balancer.pick().name for _ in range(4)} == {"e1"}
+    await asyncio.sleep(0.06)
+    assert {balancer.pick().name for _ in range(4)} == {"e0", "e1"}
+
+
+@pytest.mark.asyncio
+async def test_fail_open_and_health_check():
+    checked: list[int] = []
+    healthy = False
+
+    async def health_check(target: int) -> None:
+        checked.append(target)
+        if not healthy:
+            raise httpx.ConnectError("refused")
+
+    balancer = _balancer(1, failure_threshold=1, ejection_seconds=0.02, health_check=health_check)
+    await _fail(balancer, httpx.ConnectError("refused"))
+    # Every endpoint is ejected: the parser keeps working with the one readmitted first
+    assert balancer.pick().name == "e0"
+    await asyncio.sleep(0.03)
+    balancer.pick()
+    await asyncio.sleep(0)
+    assert checked == [0]
+    assert balancer.endpoints[0].ejected_until > 0
+    healthy = True
+    await asyncio.sleep(0.05)
+    balancer.pick()
+    await asyncio.sleep(0)
+    assert checked == [0, 0]
+    assert balancer.endpoints[0].ejected_until == 0
+
+
+@pytest.mark.asyncio
+async def test_pp_parser_balances_endpoints():
+    seen: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.url.host)
+        if request.url.host == "down":
+            return httpx.Response(503)
+        result = {"ocrResults": [{"prunedResult": {"rec_texts": ["北京盒马", "-53.70"]}}]}
+        return httpx.Response(200, json={"result": result})
+
+    parser = PPOCRV5Parser()
+    parser.http = LoopBoundClient(transport=httpx.MockTransport(handler))
+    parser.balancer = EndpointBalancer(
+        parser.name,
+        [Endpoint(host, PpEndpoint(f"http://{host}/predict", "token")) for host in ("up", "down")],
+        failure_threshold=1,
+        ejection_seconds=60,
+    )
+    results = []
+    for _ in range(4):
+        try:
+            results.append(await parser.parse(RawImage(b"image")))
+        except httpx.HTTPStatusError:
+            results.append(None)
+    assert seen.count("down") == 1
+    assert results.count(None) == 1
+    assert all(result == "北京盒马\n-53.70" for result in results if result is not None)
+
+
+@pytest.mark.asyncio
+async def test_backoff_grows_while_flapping():
+    balancer = _balancer(2, failure_threshold=1, ejection_seconds=0.02, recovery_successes=3)
+    flapping = balancer.endpoints[0]
+
+    def eject_and_readmit() -> float:
+        balancer._record_failure(flapping, EndpointError("overloaded"))
+        period = flapping.ejected_until - time.monotonic()
+        flapping.ejected_until = time.monotonic() - 1
+        balancer.pick()
+        return period
+
+    first = eject_and_readmit()
+    # A single success after the readmission does not reset the backoff
+    balancer._record_success(flapping, 0.01)
+    second = eject_and_readmit()
+    assert flapping.ejections == 2
+    assert second > 1.5 * first
+    for _ in range(3):
+        balancer._record_success(flapping, 0.01)
+    assert flapping.ejections == 0
+    assert eject_and_readmit() < second
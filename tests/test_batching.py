@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from billparser import batching
+from billparser.batching import MicroBatcher
+from billparser.deadline import DeadlineExceededError
+from billparser.models import RawText
+from billparser.parsers.base import BaseParser
+from billparser.pipeline import Pipeline
+from billparser.usage import TokenUsage, record_usage, track_usage
+from billparser.warmup import dry_run
+
+
+class UpperParser(BaseParser[RawText, RawText]):
+    name = "upper"
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.batches: list[list[str]] = []
+        self.single_calls = 0
+
+    async def parse(self, input_data: RawText) -> RawText:
+        self.single_calls += 1
+        return RawText(input_data.upper())
+
+    async def parse_batch(self, inputs: list[RawText]) -> list[RawText | Exception]:
+        self.batches.append(list(inputs))
+        await asyncio.sleep(self.delay)
+        return [ValueError(f"cannot parse {text}") if text == "bad" else RawText(text.upper()) for text in inputs]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_coalesces_concurrent_calls():
+    parser = UpperParser()
+    batcher = MicroBatcher(parser, max_size=2, window_seconds=0.02)
+    results = await asyncio.gather(
+        *(batcher.submit(RawText(text)) for text in ("a", "b", "bad", "c", "d")), return_exceptions=True
+    )
+    assert results[:2] == ["A", "B"]
+    assert isinstance(results[2], ValueError)
+    assert results[3:] == ["C", "D"]
+    # Two full batches at once, the last input alone after the window
+    assert [len(batch) for batch in parser.batches] == [2, 2, 1]
+    assert parser.single_calls == 0
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_dry_run_bypass():
+    parser = UpperParser()
+    batcher = MicroBatcher(parser, max_size=4, window_seconds=0.01)
+    with dry_run():
+        assert await batcher.submit(RawText("a")) == "A"
+    assert parser.batches == []
+    assert parser.single_calls == 1
+
+
+@pytest.mark.asyncio
+async def test_pipeline_run_uses_micro_batcher(monkeypatch: pytest.MonkeyPatch):
+    parser = UpperParser(delay=0.05)
+    monkeypatch.setitem(batching._batchers, parser, MicroBatcher(parser, max_size=8, window_seconds=0.01))
+    pipeline = Pipeline(name="upper", steps=[parser])
+
+    results = await asyncio.gather(
+        pipeline.run(RawText("a")),
+        pipeline.run(RawText("b"), timeout=0.02),
+        pipeline.run(RawText("c")),
+        return_exceptions=True,
+    )
+    assert results[0] == "A" and results[2] == "C"
+    # The caller with the shortest budget gives up, the batch still serves the others
+    assert isinstance(results[1], DeadlineExceededError)
+    assert parser.batches == [["a", "b", "c"]]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_splits_token_usage():
+    class CountingParser(UpperParser):
+        async def parse_batch(self, inputs: list[RawText]) -> list[RawText | Exception]:
+            record_usage(SimpleNamespace(prompt_tokens=101, completion_tokens=20))
+            return await super().parse_batch(inputs)
+
+    batcher = MicroBatcher(CountingParser(), max_size=2, window_seconds=0.01)
+
+    async def submit(text: str) -> TokenUsage:
+        with track_usage() as usage:
+            await batcher.submit(RawText(text))
+        return usage
+
+    first, second = await asyncio.gather(submit("a"), submit("b"))
+    assert (first.prompt_tokens, second.prompt_tokens) == (51, 50)
+    assert first.completion_tokens == second.completion_tokens == 10
+    assert first.requests + second.requests == 1
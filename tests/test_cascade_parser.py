@@ -0,0 +1,51 @@
+import pytest
+
+from billparser.metrics import metrics
+from billparser.models import Bill, RawText
+from billparser.parsers.cascade_parser import CascadeLLMParser
+from tests.factories import FakeLLMParser, bill_json, make_bill
+
+
+class StrongTier:
+    name = "strong"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def parse(self, input_data: RawText) -> Bill:
+        self.calls += 1
+        return make_bill(99.0)
+
+
+@pytest.mark.parametrize(
+    ("answer", "reason"),
+    [
+        ((53.7, 0.95, "外卖"), None),
+        ((53.7, 0.3, "外卖"), "low_confidence"),
+        ((53.7, None, "外卖"), "low_confidence"),
+        ((-1, 0.99, None), "no_bill"),
+        ((53.7, 0.99, "不存在的分类"), "error"),
+    ],
+)
+@pytest.mark.asyncio
+async def test_CascadeLLMParser(monkeypatch: pytest.MonkeyPatch, answer, reason: str | None):  # noqa: N802
+    metrics.reset()
+    amount, confidence, catename = answer
+    # A real LLM parser as the cheap tier, so that its answers go through the parser validation
+    cheap, strong = FakeLLMParser([bill_json(amount, catename, confidence=confidence)]), StrongTier()
+    monkeypatch.setattr(CascadeLLMParser, "tiers", [cheap, strong])
+    parser = CascadeLLMParser()
+    escalated = reason is not None
+    bill = await parser.parse(RawText(f"北京盒马\n-53.70\n{answer!r}"))
+    assert len(cheap.prompts) == 1
+    assert strong.calls == int(escalated)
+    assert bill.amount == (99.0 if escalated else 53.7)
+    snapshot = metrics.snapshot()
+    assert snapshot["gauges"]['cascade_escalation_rate{parser="llm_cascade"}'] == int(escalated)
+    escalations = {key: value for key, value in snapshot["counters"].items() if key.startswith("cascade_escalations")}
+    if escalated:
+        assert escalations == {
+            f'cascade_escalations_total{{parser="llm_cascade",reason="{reason}",tier="fake_llm"}}': 1
+        }
+    else:
+        assert escalations == {}
@@ -0,0 +1,122 @@
+import datetime
+
+import pytest
+
+from billparser.classification_memory import ClassificationCorrection, ClassificationMemory
+from billparser.metrics import metrics
+from billparser.models import RawText, TransactionType
+from billparser.parsers import ds_parsers
+from billparser.parsers.helpers import category_helper
+from tests.factories import BILL_TIME, FakeLLMParser, bill_json, make_bill
+
+
+def _hema_text(product: str, amount: str = "53.70", day: int = 26) -> RawText:
+    return RawText(
+        f"账单详情\n盒马鲜生\n-{amount}\n交易成功\n商品说明\n{product}\n支付时间\n2025-10-{day} 17:27:53\n"
+        "付款方式\n招商银行信用卡(1564)"
+    )
+
+
+didi_text = RawText("账单详情\n滴滴出行\n-23.00\n交易成功\n商品说明\n快车行程\n支付时间\n2025-10-26 08:12:03")
+
+
+def test_memory_match():
+    memory = ClassificationMemory(enabled=True, min_support=2)
+    memory.learn(make_bill(), _hema_text("双汁白切鸡"))
+    # A single bill is not enough support
+    assert memory.match(_hema_text("鲜榨橙汁")) is None
+    memory.learn(make_bill(time=BILL_TIME.replace(day=27)), _hema_text("香煎鸡胸肉", day=27))
+    match = memory.match(_hema_text("鲜榨橙汁", amount="18.90"))
+    assert match is not None
+    assert match.classification.catename == "外卖"
+    assert match.classification.accountname == "招商银行信用卡"
+    assert match.support == 2
+    assert 0 < match.confidence <= 1
+    assert memory.match(didi_text) is None
+
+
+def test_memory_correction():
+    memory = ClassificationMemory(enabled=True, min_support=2, correction_weight=3)
+    for day in (26, 27):
+        memory.learn(make_bill(time=BILL_TIME.replace(day=day)), _hema_text("双汁白切鸡", day=day))
+    correction = ClassificationCorrection(
+        amount=53.7,
+        time=datetime.datetime(2025, 10, 27, 17, 27, 53),
+        transaction_type=TransactionType.EXPENSE,
+        catename="零食",
+        accountname="招商银行信用卡",
+    )
+    assert memory.correct(correction)
+    match = memory.match(_hema_text("双汁白切鸡", day=28))
+    assert match is not None
+    assert match.classification.catename == "零食"
+    unknown = correction.model_copy(update={"amount": 1.0})
+    assert not memory.correct(unknown)
+    assert memory.correct(unknown.model_copy(update={"text": "滴滴出行 快车行程"}))
+
+
+def test_memory_save_and_load(tmp_path):
+    memory = ClassificationMemory(enabled=True, min_support=1, path=tmp_path / "memory.json")
+    memory.learn(make_bill(), _hema_text("双汁白切鸡"))
+    memory.save()
+    loaded = ClassificationMemory(enabled=True, min_support=1, path=tmp_path / "memory.json")
+    match = loaded.match(_hema_text("双汁白切鸡", day=27))
+    assert match is not None
+    assert match.classification.catename == "外卖"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("local_extraction", [False, True])
+async def test_parser_memory_fast_path(monkeypatch: pytest.MonkeyPatch, local_extraction: bool):
+    memory = ClassificationMemory(enabled=True, min_support=2, local_extraction=local_extraction)
+    monkeypatch.setattr(ds_parsers, "classification_memory", memory)
+    amount_answer = {"amount": 18.9, "time": "2025-10-28 09:00:00", "remark": "鲜榨橙汁", "fee": None}
+    parser = FakeLLMParser([bill_json(), bill_json(42.5, time="2025-10-27 17:27:53"), amount_answer])
+    await parser.parse(_hema_text("双汁白切鸡"))
+    await parser.parse(_hema_text("香煎鸡胸肉", amount="42.50", day=27))
+    assert all("以下为交易类别列表" in prompt for prompt in parser.prompts)
+
+    bill = await parser.parse(_hema_text("鲜榨橙汁", amount="18.90", day=28))
+    assert bill.amount == 18.9
+    assert bill.catename == category_helper.get_category(TransactionType.EXPENSE, "外卖")
+    if local_extraction:
+        # A single amount and time in the text: no LLM call at all
+        assert len(parser.prompts) == 2
+        assert bill.time == datetime.datetime(2025, 10, 28, 17, 27, 53)
+    else:
+        assert len(parser.prompts) == 3
+        assert "以下为交易类别列表" not in parser.prompts[-1]
+        assert bill.remark == "鲜榨橙汁"
+
+
+@pytest.mark.asyncio
+async def test_parser_memory_falls_back_to_full_prompt(monkeypatch: pytest.MonkeyPatch):
+    metrics.reset()
+    memory = ClassificationMemory(enabled=True, min_support=2)
+    monkeypatch.setattr(ds_parsers, "classification_memory", memory)
+    no_amount = {"amount": -1, "time": None, "remark": None, "fee": None}
+    parser = FakeLLMParser(
+        [
+            bill_json(),
+            bill_json(42.5, time="2025-10-27 17:27:53"),
+            no_amount,
+            bill_json(18.9, time="2025-10-28 17:27:53"),
+        ]
+    )
+    await parser.parse(_hema_text("双汁白切鸡"))
+    await parser.parse(_hema_text("香煎鸡胸肉", amount="42.50", day=27))
+
+    bill = await parser.parse(_hema_text("鲜榨橙汁", amount="18.90", day=28))
+    assert bill.amount == 18.9
+    assert len(parser.prompts) == 4
+    assert "以下为交易类别列表" not in parser.prompts[2]
+    assert "以下为交易类别列表" in parser.prompts[3]
+
+    counters = metrics.snapshot()["counters"]
+    assert counters['classification_memory_bills_total{extraction="fallback",parser="fake_llm"}'] == 1
+    # One lookup per parse, learning does not count as a lookup
+    lookups = {key: value for key, value in counters.items() if key.startswith("classification_memory_lookups_total")}
+    assert lookups == {
+        'classification_memory_lookups_total{outcome="untrusted"}': 1,
+        'classification_memory_lookups_total{outcome="hit"}': 1,
+    }
@@ -0,0 +1,37 @@
+import pytest
+
+from billparser.models import OcrLine, RawText
+from billparser.parsers.compaction_parser import TextCompactionParser
+
+raw_text_sample = RawText(
+    "10:291\nl5G\n90\n账单详情\n北京盒马\n-53.70\n交易成功\n支付时间\n2025-10-26 17:27:53\n付款方式\n招商银行信用卡(1564)>\n商品说明\n盒马工坊双汁白切鸡(姜蓉汁+酱油汁)24\n0g等多件\n支付奖励\n已领取4积分>\n服务详情\n盒马\n盒马\n进入小程序>\nY\n订单号\n202510501m610617070\n商家订单号\nT200P486HC{K11\n账单管理\n账单分类\n餐饮美食\n标签和备注\n添加>\n计入收支\nAAA收款\n回\n联系商家\n申请电子回单\n对此订单有疑问"  # noqa: E501
+)
+
+
+@pytest.mark.asyncio
+async def test_TextCompactionParser():  # noqa: N802
+    compacted = await TextCompactionParser().parse(raw_text_sample)
+    lines = compacted.splitlines()
+    for expected in ["北京盒马", "-53.70", "2025-10-26 17:27:53", "招商银行信用卡(1564)>"]:
+        assert expected in lines
+    for dropped in ["10:291", "l5G", "90", "账单详情", "对此订单有疑问", "Y"]:
+        assert dropped not in lines
+    assert lines.count("盒马") == 1
+
+
+@pytest.mark.asyncio
+async def test_TextCompactionParser_layout_and_budget():  # noqa: N802
+    layout = [
+        OcrLine(text="10:29", left=20, top=5, width=60, height=20),
+        OcrLine(text="支付时间", left=20, top=500, width=100, height=30),
+        OcrLine(text="2025-10-26 17:27:53", left=400, top=502, width=300, height=30),
+        OcrLine(text="商品说明", left=20, top=600, width=100, height=30),
+        OcrLine(text="盒马工坊双汁白切鸡等多件", left=400, top=598, width=300, height=30),
+    ]
+    parser = TextCompactionParser()
+    compacted = await parser.parse(RawText("\n".join(line.text for line in layout), layout=layout))
+    assert compacted.splitlines() == ["支付时间 2025-10-26 17:27:53", "商品说明 盒马工坊双汁白切鸡等多件"]
+
+    parser.max_tokens = 15
+    compacted = await parser.parse(RawText("\n".join(line.text for line in layout), layout=layout))
+    assert compacted.splitlines() == ["支付时间 2025-10-26 17:27:53"]
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from billparser import compiled_config, config
+from billparser.compiled_config import ConfigError, compile_config, read_snapshot, write_snapshot
+from billparser.models import TransactionType
+
+
+def test_compile_config():
+    compiled = compile_config()
+    assert "外卖" in compiled.categories[TransactionType.EXPENSE]
+    assert "招商银行信用卡" in compiled.assets
+    assert compiled.asset_index.search("招商银行信用卡 尾号1564", top_k=1)[0][0] == "招商银行信用卡"
+
+
+def test_compile_config_errors():
+    settings = {
+        "categories": [
+            {"transaction_type": "未知", "items": []},
+            {"transaction_type": "支出", "items": [{"l1_name": "三餐"}, {"l1_name": "三餐"}]},
+        ],
+        "assets": [{"account_name": "现金", "desc": "typo"}],
+        "parsers": {"qianfan_ocr": {}},
+        "pipelines": {"ocr_then_llm": {"steps": ["Qianfan_OCR", "deepseek_chat"]}},
+    }
+    with pytest.raises(ConfigError) as e:
+        compile_config(settings, sources={})
+    errors = "\n".join(e.value.errors)
+    assert "categories[0].transaction_type" in errors
+    assert "duplicate category '三餐'" in errors
+    assert "assets[0].desc" in errors
+    # Pipelines do not block the categories and assets
+    assert "pipelines" not in errors
+
+
+def test_compile_config_pipeline_warnings():
+    settings = {
+        "categories": [{"transaction_type": "支出", "items": [{"l1_name": "三餐"}]}],
+        "assets": [{"account_name": "现金"}],
+        "parsers": {"qianfan_ocr": {}},
+        "pipelines": {
+            "ocr_then_llm": {"steps": ["Qianfan_OCR", "deepseek_chat"]},
+            "broken": {"timeout_seconds": 5},
+        },
+    }
+    compiled = compile_config(settings, sources={})
+    assert "三餐" in compiled.categories[TransactionType.EXPENSE]
+    assert compiled.warnings == [
+        "pipelines.ocr_then_llm: parser 'deepseek_chat' is not configured in parsers",
+        "pipelines.broken: Field required",
+    ]
+
+
+def test_snapshot_rebuilt_when_sources_change(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "assets.yaml"
+    source.write_text("assets: []\n", encoding="utf-8")
+    snapshot = tmp_path / "config.snapshot"
+    monkeypatch.setattr(config, "to_load_yaml_files", [str(source)])
+    monkeypatch.setattr(config, "SNAPSHOT_PATH", snapshot)
+    monkeypatch.setattr(config, "snapshot_enabled", True)
+    monkeypatch.setattr(compiled_config, "_compiled", None)
+
+    write_snapshot(compile_config(), snapshot)
+    assert read_snapshot(snapshot).sources == {str(source): source.stat().st_mtime_ns}
+    assert compiled_config.load_compiled_config().sources == read_snapshot(snapshot).sources
+
+    os.utime(source, ns=(source.stat().st_atime_ns, source.stat().st_mtime_ns + 10**9))
+    monkeypatch.setattr(compiled_config, "_compiled", None)
+    reloaded = compiled_config.load_compiled_config()
+    assert reloaded.sources == {str(source): source.stat().st_mtime_ns}
+    assert read_snapshot(snapshot).sources == reloaded.sources
+
+
+def test_read_snapshot_ignores_other_versions(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    snapshot = tmp_path / "config.snapshot"
+    write_snapshot(compile_config(sources={}), snapshot)
+    monkeypatch.setattr(compiled_config, "SNAPSHOT_VERSION", compiled_config.SNAPSHOT_VERSION + 1)
+    assert read_snapshot(snapshot) is None
+    assert read_snapshot(tmp_path / "missing.snapshot") is None
+
+
+def test_snapshot_path_setting(tmp_path):
+    assert config._snapshot_path({}) == config.ROOT_DIR / "config" / ".compiled" / "config.snapshot"
+    assert config._snapshot_path({"config_snapshot": {"path": "data/config.snapshot"}}) == (
+        config.ROOT_DIR / "data" / "config.snapshot"
+    )
+    snapshot = tmp_path / "config.snapshot"
+    assert config._snapshot_path({"config_snapshot": {"path": str(snapshot)}}) == snapshot
@@ -1,10 +1,14 @@
 import datetime
+import json
 
+import httpx
 import pytest
 
 from billparser.models import Bill, RawText, TransactionType
-from billparser.parsers.ds_parsers import DeepSeekParser
+from billparser.parsers.ds_parsers import DeepSeekParser, NoBillFoundError
 from billparser.parsers.helpers import asset_helper, bill_helper, category_helper
+from billparser.warmup import dry_run
+from tests.factories import FakeLLMParser, bill_json
 
 
 @pytest.mark.asyncio
@@ -26,3 +30,85 @@ async def test_DeepSeekParser():  # noqa: N802
     parser = DeepSeekParser()
     bill = await parser.parse(raw_text_sample)
     bill_helper.compare_bill(bill, expected_bill, skip_remark=True, raise_on_mismatch=True)
+
+
+@pytest.mark.asyncio
+async def test_parse_batch_retries_invalid_items():
+    texts = [RawText(f"北京盒马\n-{amount}") for amount in (10.5, 20.5, 30.5)]
+    batch_response = [
+        bill_json(10.5, "外卖", id=0),
+        bill_json(20.5, "不存在的分类", id=1),
+        bill_json(30.5, "外卖", id=2),
+    ]
+    parser = FakeLLMParser([json.dumps(batch_response), bill_json(20.5, "零食")])
+    results = await parser.parse_batch(texts)
+    assert len(parser.prompts) == 2
+    assert "id=2" in parser.prompts[0]
+    assert [bill.amount for bill in results] == [10.5, 20.5, 30.5]
+    assert results[1].catename == category_helper.get_category(TransactionType.EXPENSE, "零食")
+
+
+@pytest.mark.asyncio
+async def test_parse_batch_splits_unparsable_batch():
+    texts = [RawText(f"北京盒马\n-{amount}") for amount in (10.5, 20.5)]
+    parser = FakeLLMParser(["not json", bill_json(10.5, "外卖"), "still not json"])
+    results = await parser.parse_batch(texts)
+    assert results[0].amount == 10.5
+    assert isinstance(results[1], json.JSONDecodeError)
+
+
+@pytest.mark.asyncio
+async def test_parse_batch_does_not_retry_rows_without_bill():
+    texts = [RawText(row) for row in ("支出¥1,234.00", "北京盒马\n-10.50", "收入¥0.00", "本月账单")]
+    batch_response = [
+        bill_json(-1, None, id=0),
+        bill_json(10.5, "外卖", id=1),
+        bill_json(-1, None, id=2),
+        bill_json(-1, None, id=3),
+    ]
+    parser = FakeLLMParser([json.dumps(batch_response, ensure_ascii=False)])
+    results = await parser.parse_batch(texts)
+    assert len(parser.prompts) == 1
+    assert results[1].amount == 10.5
+    assert all(isinstance(results[idx], NoBillFoundError) for idx in (0, 2, 3))
+
+
+@pytest.mark.asyncio
+async def test_parse_batch_does_not_split_on_provider_errors():
+    texts = [RawText(f"北京盒马\n-{amount}") for amount in (10.5, 20.5, 30.5, 40.5)]
+    error = httpx.ConnectError("provider unreachable")
+    parser = FakeLLMParser([error])
+    results = await parser.parse_batch(texts)
+    assert len(parser.prompts) == 1
+    assert results == [error] * 4
+
+
+@pytest.mark.asyncio
+async def test_dry_run_skips_provider():
+    parser = FakeLLMParser([])
+    with dry_run():
+        bill = await parser.parse(RawText("北京盒马\n-53.70"))
+        results = await parser.parse_batch([RawText("北京盒马\n-53.70"), RawText("滴滴出行\n-23.00")])
+    assert bill.catename == category_helper.get_default_category()
+    assert all(isinstance(result, Bill) for result in results)
+    assert parser.prompts == []
+
+
+@pytest.mark.asyncio
+async def test_parse_with_confidence():
+    parser = FakeLLMParser([bill_json(53.7, "外卖", confidence=1.7), bill_json(53.7, "外卖", confidence="high")])
+    bill, confidence = await parser.parse_with_confidence(RawText("北京盒马\n-53.70"))
+    assert bill.amount == 53.7
+    assert confidence == 1.0
+    assert '"confidence"' in parser.prompts[0]
+    _, confidence = await parser.parse_with_confidence(RawText("北京盒马\n-53.70"))
+    assert confidence is None
+
+
+def test_default_category_only_for_expenses():
+    parser = FakeLLMParser([])
+    bill = parser._build_bill(bill_json(12.0, "其它"))
+    assert bill.catename == category_helper.get_default_category()
+    # "其它" is an expense category, an income answer carrying it is rejected
+    with pytest.raises(AssertionError):
+        parser._build_bill(bill_json(12.0, "其它", transaction_type="收入"))
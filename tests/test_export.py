@@ -0,0 +1,61 @@
+import csv
+import json
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import pytest
+
+from billparser.export import get_exporter
+from billparser.models import Bill
+from tests.factories import make_bill
+
+
+async def _bills(n: int) -> AsyncIterator[Bill]:
+    for i in range(n):
+        yield make_bill(amount=53.70 + i, remark="盒马工坊双汁白切鸡")
+
+
+@pytest.mark.asyncio
+async def test_csv_and_jsonl_export(tmp_path: Path):
+    csv_path = tmp_path / "bills.csv"
+    assert await get_exporter(csv_path).export(_bills(3)) == 3
+    with csv_path.open(encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 3
+    assert rows[0]["catename"] == "外卖"
+    assert rows[0]["accountname"] == "招商银行信用卡"
+    assert rows[0]["time"] == "2025-10-26T17:27:53"
+
+    jsonl_path = tmp_path / "bills.jsonl"
+    assert await get_exporter(jsonl_path).export(_bills(2)) == 2
+    lines = jsonl_path.read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[1])["amount"] == 54.70
+
+
+@pytest.mark.asyncio
+async def test_qianji_export(tmp_path: Path):
+    path = tmp_path / "bills.qianji.csv"
+    exporter = get_exporter(path)
+    assert exporter.format == "qianji"
+    await exporter.export(_bills(1))
+    with path.open(encoding="utf-8") as f:
+        row = next(csv.DictReader(f))
+    assert row["时间"] == "2025-10-26 17:27:53"
+    assert (row["分类"], row["二级分类"], row["类型"], row["账户1"]) == ("三餐", "外卖", "支出", "招商银行信用卡")
+
+
+@pytest.mark.asyncio
+async def test_parquet_export(tmp_path: Path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "bills.parquet"
+    exporter = get_exporter(path)
+    exporter.row_group_size = 2
+    assert await exporter.export(_bills(5)) == 5
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_rows == 5
+    assert parquet_file.metadata.num_row_groups == 3
+
+
+def test_unknown_export_format(tmp_path: Path):
+    with pytest.raises(ValueError):
+        get_exporter(tmp_path / "bills.xlsx")
@@ -0,0 +1,63 @@
+import datetime
+
+from billparser.fingerprint import BillIndex, extract_fingerprints, extract_main_amount
+from billparser.models import RawText
+from tests.factories import make_bill
+
+alipay_text = RawText(
+    "账单详情\n北京盒马\n-53.70\n交易成功\n支付时间\n2025-10-26 17:27:53\n付款方式\n招商银行信用卡(1564)>"
+)
+sms_text = RawText("【招商银行】您账户1564于10月26日17:28在北京盒马消费人民币53.70元。尾号1564")
+
+
+def test_extract_fingerprints():
+    fingerprints = extract_fingerprints(alipay_text)
+    assert len(fingerprints) == 1
+    assert fingerprints[0].amount_cents == 5370
+    assert fingerprints[0].time == datetime.datetime(2025, 10, 26, 17, 27, 53)
+    assert fingerprints[0].card_tail == "1564"
+
+
+def test_bill_index_lookup():
+    bill = make_bill()
+    index = BillIndex(enabled=True, time_window_seconds=300)
+    assert index.lookup(alipay_text) is None
+    index.add(bill, alipay_text)
+    duplicate = index.lookup(RawText(alipay_text.replace("2025-10-26", "2025-10-27")))
+    assert duplicate is None
+    duplicate = index.lookup(RawText(sms_text.replace("10月26日", "2025年10月26日")))
+    assert duplicate is not None
+    assert duplicate.is_duplicate
+    assert duplicate.amount == bill.amount
+    assert index.lookup(RawText(alipay_text.replace("(1564)", "(9999)"))) is None
+
+
+def test_bill_index_disabled():
+    index = BillIndex(enabled=False)
+    index.add(make_bill(), alipay_text)
+    assert index.lookup(alipay_text) is None
+
+
+def _alipay_text(merchant: str, amount: str, time: str, goods: str = "") -> RawText:
+    return RawText(
+        f"账单详情\n{merchant}\n-{amount}\n交易成功\n商品说明\n{goods}\n支付时间\n2025-10-26 {time}\n付款方式\n余额宝"
+    )
+
+
+def test_extract_main_amount():
+    assert extract_main_amount(_alipay_text("美团外卖", "18.50", "08:31:00", "原价 25.00")) == 1850
+    assert extract_main_amount("商品 2 件 原价25.00 实付款 ¥18.50") == 1850
+    assert extract_main_amount(sms_text) == 5370
+
+
+def test_bill_index_false_positives():
+    index = BillIndex(enabled=True, time_window_seconds=300)
+    luckin = _alipay_text("瑞幸咖啡", "25.00", "08:30:00", "生椰拿铁")
+    index.add(make_bill(25.0, time=datetime.datetime(2025, 10, 26, 8, 30), accountname="余额宝"), luckin)
+    # Same amount two minutes later, another merchant, no card tail to tell them apart
+    assert index.lookup(_alipay_text("滴滴出行", "25.00", "08:32:00", "快车行程")) is None
+    # The amount of the bill only appears as a list price
+    assert index.lookup(_alipay_text("美团外卖", "18.50", "08:31:00", "原价 25.00")) is None
+    duplicate = index.lookup(RawText("瑞幸咖啡订单\n实付 ¥25.00\n下单时间 2025-10-26 08:30:04"))
+    assert duplicate is not None
+    assert duplicate.is_duplicate
@@ -0,0 +1,46 @@
+from billparser.models import RawText
+from billparser.parsers.helpers import (
+    DEFAULT_ASSET,
+    DEFAULT_CATEGORY,
+    LexicalIndex,
+    asset_helper,
+    bill_helper,
+    category_helper,
+)
+from tests.factories import make_bill
+
+raw_text_sample = RawText(
+    "账单详情\n北京盒马\n-53.70\n交易成功\n支付时间\n2025-10-26 17:27:53\n付款方式\n招商银行信用卡(1564)>\n商品说明\n盒马工坊双汁白切鸡(姜蓉汁+酱油汁)240g等多件"  # noqa: E501
+)
+
+
+def test_lexical_index_search():
+    index = LexicalIndex({"a": "盒马 外卖 美团", "b": "地铁 公交", "c": "招商银行信用卡 尾号 1564"})
+    results = index.search("北京盒马 招商银行信用卡(1564)")
+    assert [key for key, _ in results] == ["c", "a"]
+    assert index.search("北京盒马", keys=["b"]) == []
+
+
+def test_dump_categories_to_prompt_top_k():
+    full_prompt = category_helper.dump_categories_to_prompt()
+    prompt = category_helper.dump_categories_to_prompt(raw_text_sample, top_k=3)
+    assert "二级分类: 外卖" in prompt
+    assert "二级分类: 其它" in prompt
+    assert len(prompt) < len(full_prompt)
+    asset_prompt = asset_helper.dump_assets_to_prompt(raw_text_sample, top_k=2)
+    assert "账户名称: 招商银行信用卡" in asset_prompt
+    assert "账户名称: 无" in asset_prompt
+
+
+def test_retrieval_recall():
+    expected_bill = make_bill()
+    recall = bill_helper.retrieval_recall([(raw_text_sample, expected_bill)], category_top_k=3, asset_top_k=2)
+    assert recall == {"category_recall": 1.0, "asset_recall": 1.0}
+
+
+def test_retrieval_recall_counts_defaults():
+    # The prompt always offers 其它/无, whatever the retrieval selects
+    expected_bill = make_bill(catename=DEFAULT_CATEGORY.l2_name, accountname=DEFAULT_ASSET.account_name)
+    assert category_helper.select_categories(raw_text_sample, 3)[DEFAULT_CATEGORY.transaction_type].get("其它") is None
+    recall = bill_helper.retrieval_recall([(raw_text_sample, expected_bill)], category_top_k=3, asset_top_k=2)
+    assert recall == {"category_recall": 1.0, "asset_recall": 1.0}
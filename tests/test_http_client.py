@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import httpx
+
+from billparser.http_client import LoopBoundClient
+
+
+async def _get(http: LoopBoundClient) -> httpx.AsyncClient:
+    return http.get()
+
+
+def test_client_of_another_loop_is_closed():
+    http = LoopBoundClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+    other = asyncio.new_event_loop()
+    thread = threading.Thread(target=other.run_forever)
+    thread.start()
+    try:
+        stale = asyncio.run_coroutine_threadsafe(_get(http), other).result()
+
+        async def main() -> None:
+            client = http.get()
+            assert client is not stale
+            assert http.get() is client
+            await http.aclose()
+            assert client.is_closed
+
+        asyncio.run(main())
+        # Closed on its own loop
+        for _ in range(100):
+            if stale.is_closed:
+                break
+            asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), other).result()
+        assert stale.is_closed
+    finally:
+        other.call_soon_threadsafe(other.stop)
+        thread.join()
+        other.close()
+
+
+def test_client_of_a_stopped_loop_is_dropped():
+    http = LoopBoundClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+    stale = asyncio.run(_get(http))
+    fresh = asyncio.run(_get(http))
+    assert fresh is not stale
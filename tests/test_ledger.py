@@ -0,0 +1,72 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from billparser import ledger as ledger_module
+from billparser.ledger import Ledger
+from billparser.models import Bill, BillList, RawText
+from billparser.parsers.base import BaseParser
+from billparser.pipeline import Pipeline
+from billparser.warmup import dry_run
+from tests.factories import make_bill
+
+
+def _bill(day: str, amount: float, catename: str, accountname: str = "招商银行信用卡", **extra) -> Bill:
+    return make_bill(amount, catename, datetime.datetime.fromisoformat(f"{day} 12:00:00"), accountname, **extra)
+
+
+@pytest.fixture
+def ledger(tmp_path: Path):
+    ledger = Ledger(tmp_path / "ledger.sqlite3", enabled=True)
+    yield ledger
+    ledger.close()
+
+
+def test_aggregates_follow_inserts(ledger: Ledger):
+    ledger.append([_bill("2025-01-05", 10.1, "外卖"), _bill("2025-01-05", 20.2, "外卖", fee=0.1)])
+    ledger.append([_bill("2025-01-20", 5, "打车", "微信钱包"), _bill("2025-02-01", 7.5, "外卖")], pipeline="p")
+    by_category = ledger.aggregate(period="month", group_by=["catename"])
+    # ORDER BY period, catename: "外卖" (U+5916) sorts before "打车" (U+6253)
+    assert by_category == [
+        {"period": "2025-01", "catename": "外卖", "count": 2, "amount": 30.3, "fee": 0.1},
+        {"period": "2025-01", "catename": "打车", "count": 1, "amount": 5.0, "fee": 0.0},
+        {"period": "2025-02", "catename": "外卖", "count": 1, "amount": 7.5, "fee": 0.0},
+    ]
+    totals = ledger.aggregate(datetime.date(2025, 1, 1), datetime.date(2025, 1, 31), period="all", group_by=[])
+    assert totals == [{"count": 3, "amount": 35.3, "fee": 0.1}]
+    by_account = ledger.aggregate(period="year", group_by=["accountname"], catename="外卖")
+    assert by_account == [{"period": "2025", "accountname": "招商银行信用卡", "count": 3, "amount": 37.8, "fee": 0.1}]
+    with pytest.raises(ValueError):
+        ledger.aggregate(group_by=["remark"])
+
+
+def test_query_bills_pages(ledger: Ledger):
+    ledger.append([_bill(f"2025-03-{day:02d}", day, "外卖") for day in range(1, 11)])
+    first = ledger.query_bills(start=datetime.datetime(2025, 3, 3), limit=3)
+    assert [row["bill"]["amount"] for row in first] == [3, 4, 5]
+    second = ledger.query_bills(start=datetime.datetime(2025, 3, 3), limit=3, after_id=first[-1]["id"])
+    assert [row["bill"]["amount"] for row in second] == [6, 7, 8]
+    assert ledger.query_bills(catename="打车") == []
+
+
+@pytest.mark.asyncio
+async def test_pipeline_records_bills(ledger: Ledger, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ledger_module, "ledger", ledger)
+    monkeypatch.setattr("billparser.pipeline.ledger", ledger)
+
+    class ListParser(BaseParser[RawText, BillList]):
+        name = "list"
+
+        def __init__(self):
+            pass
+
+        async def parse(self, input_data: RawText) -> BillList:
+            return BillList([_bill("2025-04-01", 1, "外卖"), _bill("2025-04-01", 2, "外卖", is_duplicate=True)])
+
+    pipeline = Pipeline(name="records", steps=[ListParser()], record=True)
+    await pipeline.run(RawText("x"))
+    with dry_run():
+        await pipeline.run(RawText("x"))
+    await Pipeline(name="silent", steps=[ListParser()]).run(RawText("x"))
+    assert [row["pipeline"] for row in ledger.query_bills()] == ["records"]
@@ -0,0 +1,86 @@
+import json
+import random
+
+import httpx
+import pytest
+from fastapi import FastAPI, Response
+from openai import AsyncOpenAI
+
+from billparser.loadtest import (
+    LatencyDistribution,
+    LoadConfig,
+    LoadGenerator,
+    MockProviders,
+    create_mock_app,
+    format_report,
+    synthetic_png,
+)
+
+
+def test_latency_distribution():
+    rng = random.Random(0)
+    assert LatencyDistribution.parse("0.2").sample(rng) == 0.2
+    uniform = LatencyDistribution.parse("uniform:0.1,0.5")
+    assert all(0.1 <= uniform.sample(rng) <= 0.5 for _ in range(100))
+    assert LatencyDistribution.parse("lognormal:0.3,0.5").sample(rng) > 0
+    with pytest.raises(ValueError):
+        LatencyDistribution.parse("pareto:1")
+    with pytest.raises(ValueError):
+        LatencyDistribution.parse("uniform:0.1")
+
+
+@pytest.mark.asyncio
+async def test_mock_providers():
+    app = create_mock_app(
+        MockProviders(
+            ocr_latency=LatencyDistribution("const", (0.0,)), llm_latency=LatencyDistribution("const", (0.0,))
+        )
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://mock") as client:
+        responses = [await client.post("/ocr", json={"file": "", "fileType": 1}) for _ in range(2)]
+    texts = [response.json()["result"]["ocrResults"][0]["prunedResult"]["rec_texts"] for response in responses]
+    assert texts[0] != texts[1]
+
+    llm = AsyncOpenAI(api_key="mock", base_url="http://mock/v1", http_client=httpx.AsyncClient(transport=transport))
+    completion = await llm.chat.completions.create(
+        model="mock", messages=[{"role": "user", "content": "### 账单 id=0\na\n\n### 账单 id=1\nb"}]
+    )
+    answer = json.loads(completion.choices[0].message.content)
+    assert [item["id"] for item in answer] == [0, 1]
+    assert completion.usage.total_tokens > 0
+
+
+def _target_app() -> FastAPI:
+    app = FastAPI()
+    calls = {"count": 0}
+
+    @app.post("/parse_image")
+    async def parse_image() -> Response:
+        calls["count"] += 1
+        return Response(status_code=500 if calls["count"] % 3 == 0 else 200)
+
+    @app.get("/metrics")
+    async def get_metrics() -> dict:
+        return {"gauges": {"process_resident_memory_bytes": 64 * 2**20}}
+
+    return app
+
+
+@pytest.mark.parametrize("mode", ["closed", "open"])
+@pytest.mark.asyncio
+async def test_LoadGenerator(mode: str):  # noqa: N802
+    config = LoadConfig(
+        url="http://server", api_key="key", mode=mode, concurrency=2, rate=50, duration=0.3, sample_interval=0.1
+    )
+    report = (await LoadGenerator(config, transport=httpx.ASGITransport(app=_target_app())).run()).to_dict()
+    assert report["requests"] == report["ok"] + report["errors"]["http_500"]
+    assert report["ok"] > 0
+    assert report["server_rss_mib"]["peak"] == 64
+    assert report["timeline"]
+    assert "p95" in format_report(report)
+
+
+def test_synthetic_png():
+    assert synthetic_png(1).startswith(b"\x89PNG")
+    assert synthetic_png(1) != synthetic_png(2)
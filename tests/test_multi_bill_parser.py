@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+
+from billparser.models import Bill, BillList, OcrLine, RawText
+from billparser.parsers.multi_bill_parser import MultiBillParser, segment_rows
+
+list_text = RawText(
+    "账单\n2025年10月\n支出¥1,234.00\n北京盒马\n-53.70\n10月26日17:27\n滴滴出行\n-23.00\n10月26日09:10\n工资\n+8,000.00\n10月25日"
+)
+
+
+def test_segment_rows_text():
+    rows, header = segment_rows(list_text)
+    assert header == ["账单"]
+    assert rows[0] == "2025年10月\n支出¥1,234.00"
+    assert rows[1:] == [
+        "北京盒马\n-53.70\n10月26日17:27",
+        "滴滴出行\n-23.00\n10月26日09:10",
+        "工资\n+8,000.00\n10月25日",
+    ]
+
+
+def test_segment_rows_layout():
+    layout = [
+        OcrLine(text="招商银行信用卡 尾号1564", left=10, top=10, width=300, height=30),
+        OcrLine(text="北京盒马", left=10, top=100, width=100, height=30),
+        OcrLine(text="-53.70", left=500, top=102, width=80, height=30),
+        OcrLine(text="10-26 17:27", left=10, top=140, width=100, height=20),
+        OcrLine(text="滴滴出行", left=10, top=200, width=100, height=30),
+        OcrLine(text="-23.00", left=500, top=198, width=80, height=30),
+    ]
+    rows, header = segment_rows(RawText("\n".join(line.text for line in layout), layout=layout))
+    assert header == ["招商银行信用卡 尾号1564"]
+    assert rows == ["北京盒马 -53.70\n10-26 17:27", "滴滴出行 -23.00"]
+
+
+class FakeBatchLLM:
+    def __init__(self):
+        self.batches: list[list[RawText]] = []
+
+    async def parse_batch(self, inputs: list[RawText]) -> list[Bill | Exception]:
+        self.batches.append(inputs)
+        return [ValueError("total") if "支出¥" in text else SimpleNamespace(text=text) for text in inputs]
+
+
+@pytest.mark.asyncio
+async def test_MultiBillParser(monkeypatch: pytest.MonkeyPatch):  # noqa: N802
+    fake_llm = FakeBatchLLM()
+    monkeypatch.setattr(MultiBillParser, "llm", fake_llm)
+    monkeypatch.setattr("billparser.parsers.multi_bill_parser.Bill", SimpleNamespace)
+    result = await MultiBillParser().parse(list_text)
+    assert isinstance(result, BillList)
+    assert len(result) == 3
+    assert [len(batch) for batch in fake_llm.batches] == [2, 2]
@@ -0,0 +1,102 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from billparser.models import OcrLine, RawImage, RawPdf, RawText, raw_file_input
+from billparser.parsers import pdf_parser
+from billparser.parsers.pdf_parser import PdfStatementParser, split_pdf_pages
+
+
+def make_pdf(n_pages: int) -> bytes:
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(n_pages):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def test_raw_file_input():
+    assert isinstance(raw_file_input(b"%PDF-1.7\n"), RawPdf)
+    assert isinstance(raw_file_input(b"\x89PNG\r\n"), RawImage)
+
+
+def test_split_pdf_pages(tmp_path):
+    pytest.importorskip("pypdf")
+    path = tmp_path / "statement.pdf"
+    path.write_bytes(make_pdf(5))
+    pages = split_pdf_pages(str(path), 1, 4)
+    assert len(pages) == 3
+    assert all(page.startswith(b"%PDF-") for page in pages)
+
+
+class FakeOcr:
+    def __init__(self):
+        self.calls = 0
+
+    async def parse_pdf(self, input_data: bytes) -> RawText:
+        self.calls += 1
+        return RawText(f"page {self.calls}")
+
+
+class FakeBillParser:
+    async def parse_stream(self, input_data: RawText):
+        yield str(input_data)
+
+
+@pytest.mark.asyncio
+async def test_PdfStatementParser(monkeypatch: pytest.MonkeyPatch):  # noqa: N802
+    pytest.importorskip("pypdf")
+    fake_ocr = FakeOcr()
+    monkeypatch.setattr(PdfStatementParser, "_get_parsers", lambda self: (fake_ocr, FakeBillParser()))
+    result = await PdfStatementParser().parse(RawPdf(make_pdf(5)))
+    assert fake_ocr.calls == 5
+    assert sorted(result) == [f"page {idx}" for idx in range(1, 6)]
+
+
+@pytest.mark.asyncio
+async def test_PdfStatementParser_aclose():  # noqa: N802
+    parser = PdfStatementParser()
+    executor = parser.executor
+    assert executor.submit(abs, -1).result() == 1
+    await parser.aclose()
+    with pytest.raises(RuntimeError):
+        executor.submit(abs, -1)
+    # Started again on demand
+    assert parser.executor is not executor
+    await parser.aclose()
+
+
+class LayoutOcr:
+    async def parse_pdf(self, input_data: bytes) -> RawText:
+        return RawText(
+            input_data.decode(), layout=[OcrLine(text=input_data.decode(), left=0, top=0, width=100, height=20)]
+        )
+
+
+class LayoutBillParser:
+    def __init__(self):
+        self.layouts: list[tuple[OcrLine, ...]] = []
+
+    async def parse_stream(self, input_data: RawText):
+        self.layouts.append(input_data.layout)
+        yield str(input_data)
+
+
+@pytest.mark.asyncio
+async def test_PdfStatementParser_keeps_page_layout(monkeypatch: pytest.MonkeyPatch):  # noqa: N802
+    # Pages split in a thread with fake pypdf helpers
+    monkeypatch.setattr(pdf_parser.importlib.util, "find_spec", lambda name: object())
+    monkeypatch.setattr(pdf_parser, "count_pdf_pages", lambda path: 2)
+    monkeypatch.setattr(pdf_parser, "split_pdf_pages", lambda path, start, end: [b"page"] * (end - start))
+    bill_parser = LayoutBillParser()
+    monkeypatch.setattr(PdfStatementParser, "_get_parsers", lambda self: (LayoutOcr(), bill_parser))
+    parser = PdfStatementParser()
+    parser._executor = ThreadPoolExecutor(max_workers=1)
+    result = await parser.parse(RawPdf(b"%PDF-1.7\n"))
+    assert result == ["page", "page"]
+    assert [layout[0].text for layout in bill_parser.layouts] == ["page", "page"]
+    await parser.aclose()
@@ -1,11 +1,16 @@
+import asyncio
 import datetime
+from collections.abc import Sequence
 from pathlib import Path
 
 import pytest
 
-from billparser.models import Bill, TransactionType
+from billparser.deadline import DeadlineExceededError, deadline_scope, step_timeout
+from billparser.models import Bill, OcrLine, RawImage, RawText, TransactionType
+from billparser.parsers.base import BaseParser
 from billparser.parsers.helpers import asset_helper, bill_helper, category_helper
-from billparser.pipeline import pipeline_manager
+from billparser.pipeline import JoinPolicy, ParallelStep, Pipeline, pipeline_manager
+from tests.factories import FakeLLMParser
 
 test_image_path = Path(__file__).parent / "images" / "alipay" / "1.png"
 
@@ -41,3 +46,114 @@ async def test_ocr_then_llm():
         fee=None,
     )
     bill_helper.compare_bill(bill, expected_bill, raise_on_mismatch=True, skip_remark=True)
+
+
+class FakeOcrParser(BaseParser[RawImage, RawText]):
+    def __init__(self, name: str, text: str, delay: float = 0, fail: bool = False, layout: Sequence[OcrLine] = ()):
+        self.name = name
+        self.text = text
+        self.layout = layout
+        self.delay = delay
+        self.fail = fail
+        self.cancelled = False
+
+    async def parse(self, input_data: RawImage) -> RawText:
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        return RawText(self.text, layout=self.layout)
+
+
+def _parallel(join: JoinPolicy, *parsers: BaseParser) -> Pipeline:
+    branches = [Pipeline(name=parser.name, steps=[parser]) for parser in parsers]
+    return Pipeline(name="parallel", steps=[ParallelStep(branches=branches, join=join)])
+
+
+@pytest.mark.asyncio
+async def test_parallel_first_cancels_losing_branches():
+    fast = FakeOcrParser("fast", "fast text", delay=0.01)
+    slow = FakeOcrParser("slow", "slow text", delay=5)
+    failing = FakeOcrParser("failing", "", fail=True)
+    result = await _parallel(JoinPolicy.FIRST, failing, slow, fast).run(RawImage(b""))
+    assert result == "fast text"
+    assert slow.cancelled
+
+
+@pytest.mark.asyncio
+async def test_parallel_merge_and_all():
+    first = FakeOcrParser("first", "盒马\n-53.70", delay=0.01)
+    second = FakeOcrParser("second", "-53.70\n招商银行信用卡(1564)")
+    failing = FakeOcrParser("failing", "", fail=True)
+    result = await _parallel(JoinPolicy.MERGE, first, second, failing).run(RawImage(b""))
+    assert result == "盒马\n-53.70\n招商银行信用卡(1564)"
+    with pytest.raises(RuntimeError):
+        await _parallel(JoinPolicy.ALL, first, second, failing).run(RawImage(b""))
+    with pytest.raises(ExceptionGroup):
+        await _parallel(JoinPolicy.MERGE, failing, FakeOcrParser("failing2", "", fail=True)).run(RawImage(b""))
+
+
+@pytest.mark.asyncio
+async def test_parallel_merge_keeps_layout():
+    first_layout = [
+        OcrLine(text="盒马", left=10, top=10, width=40, height=20),
+        OcrLine(text="-53.70", left=10, top=40, width=60, height=20),
+    ]
+    second_layout = [
+        OcrLine(text="-53.70", left=12, top=41, width=58, height=20),
+        OcrLine(text="招商银行信用卡(1564)", left=10, top=70, width=160, height=20),
+    ]
+    first = FakeOcrParser("first", "盒马\n-53.70", delay=0.01, layout=first_layout)
+    second = FakeOcrParser("second", "-53.70\n招商银行信用卡(1564)", layout=second_layout)
+    result = await _parallel(JoinPolicy.MERGE, first, second).run(RawImage(b""))
+    assert result == "盒马\n-53.70\n招商银行信用卡(1564)"
+    assert result.layout == (*first_layout, second_layout[1])
+
+
+def test_parallel_type_checking():
+    ocr = Pipeline(name="ocr", steps=[FakeOcrParser("ocr", "")])
+    llm = Pipeline(name="llm", steps=[FakeLLMParser([])])
+    with pytest.raises(TypeError):
+        ParallelStep(branches=[ocr, llm])
+    with pytest.raises(TypeError):
+        Pipeline(name="wrong_order", steps=[FakeLLMParser([]), FakeOcrParser("ocr", "")])
+
+
+class BudgetProbeParser(BaseParser[RawText, RawText]):
+    name = "budget_probe"
+
+    def __init__(self):
+        self.timeouts: list[float | None] = []
+
+    async def parse(self, input_data: RawText) -> RawText:
+        self.timeouts.append(step_timeout(10))
+        return input_data
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancels_running_step():
+    slow = FakeOcrParser("slow", "slow text", delay=5)
+    probe = BudgetProbeParser()
+    pipeline = Pipeline(name="slow", steps=[slow, probe], timeout=0.05)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    with pytest.raises(DeadlineExceededError):
+        await pipeline.run(RawImage(b""))
+    assert loop.time() - start < 1
+    assert slow.cancelled
+    assert probe.timeouts == []
+
+
+@pytest.mark.asyncio
+async def test_deadline_caps_step_timeouts():
+    probe = BudgetProbeParser()
+    pipeline = Pipeline(name="probe", steps=[FakeOcrParser("ocr", "text"), probe])
+    await pipeline.run(RawImage(b""))
+    assert probe.timeouts == [10]
+    # The caller deadline wins over a longer pipeline timeout
+    async with deadline_scope(2):
+        await pipeline.run(RawImage(b""), timeout=30)
+    assert 0 < probe.timeouts[-1] <= 2
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+from billparser.profiling import dump_tasks, profile_run, sample_event_loop
+
+
+def test_profile_run(tmp_path):
+    with profile_run(tmp_path / "run"):
+        data = [bytes(1024) for _ in range(1000)]
+    assert data
+    assert (tmp_path / "run.prof").stat().st_size > 0
+    summary = (tmp_path / "run.txt").read_text(encoding="utf-8")
+    assert "Top 30 allocation sites" in summary
+    assert "cumulative time" in summary
+    with pytest.raises(ValueError):
+        with profile_run(tmp_path / "run", engine="unknown"):
+            pass
+
+
+def blocking_call():
+    time.sleep(0.2)
+
+
+@pytest.mark.asyncio
+async def test_sample_event_loop():
+    async def block_loop():
+        await asyncio.sleep(0.02)
+        blocking_call()
+
+    task = asyncio.create_task(block_loop())
+    profile = await sample_event_loop(0.1, interval=0.005)
+    await task
+    assert profile["samples"] > 0
+    assert any("blocking_call" in item["stack"] for item in profile["stacks"])
+
+
+@pytest.mark.asyncio
+async def test_dump_tasks():
+    async def sleeper():
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(sleeper(), name="sleeper")
+    await asyncio.sleep(0)
+    tasks = {item["name"]: item for item in dump_tasks()}
+    task.cancel()
+    assert "sleeper" in tasks["sleeper"]["coro"]
+    assert any("sleeper" in frame for frame in tasks["sleeper"]["stack"])
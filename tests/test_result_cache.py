@@ -0,0 +1,52 @@
+import pytest
+
+from billparser.result_cache import CacheProbe, ResultCache, TokenError, content_hash
+from tests.factories import make_bill
+
+
+def test_probe_miss_then_hit():
+    cache = ResultCache(enabled=True, max_entries=10, ttl_seconds=60, phash_max_distance=4, token_ttl_seconds=60)
+    sha256 = content_hash(b"screenshot")
+    probe = CacheProbe(pipeline_name="ocr_then_llm", sha256=sha256, phash="f0f0f0f0f0f0f0f0")
+    miss = cache.probe("key", probe)
+    assert miss["status"] == "miss"
+
+    with pytest.raises(TokenError):
+        cache.redeem(miss["upload_token"], "key", "ocr_then_llm", content_hash(b"another screenshot"))
+    # Tokens are single use, even when the upload does not match
+    with pytest.raises(TokenError):
+        cache.redeem(miss["upload_token"], "key", "ocr_then_llm", sha256)
+
+    token = cache.probe("key", probe)["upload_token"]
+    upload = cache.redeem(token, "key", "ocr_then_llm", sha256)
+    cache.put("key", "ocr_then_llm", sha256, make_bill(53.7), upload.phash)
+
+    hit = cache.probe("key", probe)
+    assert (hit["status"], hit["bill"].amount) == ("hit", 53.7)
+    # Perceptual hash 2 bits away: maybe the same screenshot re-encoded, maybe another receipt of the
+    # same template, only reported as similar
+    similar = CacheProbe(pipeline_name="ocr_then_llm", sha256=content_hash(b"resized"), phash="f0f0f0f0f0f0f0f3")
+    answer = cache.probe("key", similar)
+    assert (answer["status"], answer["similar"]) == ("miss", True)
+    assert "bill" not in answer
+    far = CacheProbe(pipeline_name="ocr_then_llm", sha256=content_hash(b"other"), phash="0f0f0f0f0f0f0f0f")
+    assert cache.probe("key", far)["similar"] is False
+    # Entries of an API key are never served to another one
+    assert cache.probe("other-key", probe)["status"] == "miss"
+    assert cache.probe("other-key", similar)["similar"] is False
+
+
+def test_upload_tokens_are_capped():
+    cache = ResultCache(enabled=True, max_entries=10, ttl_seconds=60, phash_max_distance=4, max_tokens=2)
+    tokens = [cache.issue_token("key", "p", content_hash(bytes([idx])), None) for idx in range(3)]
+    assert list(cache.tokens) == tokens[1:]
+    with pytest.raises(TokenError):
+        cache.redeem(tokens[0], "key", "p", content_hash(bytes([0])))
+
+
+def test_lru_eviction():
+    cache = ResultCache(enabled=True, max_entries=2, ttl_seconds=60, phash_max_distance=4, token_ttl_seconds=60)
+    for idx in range(3):
+        cache.put("key", "p", str(idx), make_bill(idx + 1))
+    assert cache.get("key", "p", "0") is None
+    assert cache.get("key", "p", "2").amount == 3
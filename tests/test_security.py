@@ -2,7 +2,7 @@ from fastapi import Depends, FastAPI
 from fastapi.testclient import TestClient
 from pytest import MonkeyPatch
 
-from billparser.security import get_api_key
+from billparser.security import get_admin_api_key, get_api_key
 
 app = FastAPI()
 
@@ -35,3 +35,16 @@ def test_secure_endpoint_without_api_key():
     response = client.get("/secure-test")
     assert response.status_code == 401
     assert response.json() == {"detail": "Invalid or missing API key"}
+
+
+@app.get("/admin-test")
+def admin_test_endpoint(api_key: str = Depends(get_admin_api_key)):
+    return {"status": "ok"}
+
+
+def test_admin_endpoint_requires_admin_key(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr("billparser.security.VALID_API_KEYS", {"user-key"})
+    monkeypatch.setattr("billparser.security.VALID_ADMIN_API_KEYS", {"admin-key"})
+    assert client.get("/admin-test", headers={"X-API-Key": "admin-key"}).status_code == 200
+    assert client.get("/admin-test", headers={"X-API-Key": "user-key"}).status_code == 403
+    assert client.get("/admin-test").status_code == 401
@@ -0,0 +1,36 @@
+import datetime
+import json
+
+from billparser.models import Bill, TransactionType
+from billparser.parsers.helpers import asset_helper, category_helper
+from billparser.serialization import dump_bill_json, dump_bills_json
+from tests.factories import make_bill
+
+
+def _make_bills() -> list[Bill]:
+    return [
+        make_bill(remark="盒马工坊双汁白切鸡"),
+        Bill(
+            transaction_type=TransactionType.CREDIT_CARD_REPAYMENT,
+            amount=1000,
+            time=datetime.datetime(2025, 10, 27, 9, 0, 0),
+            accountname=asset_helper.get_asset("百度工资卡"),
+            accountname2=asset_helper.get_asset("招商银行信用卡"),
+            fee=1.5,
+        ),
+    ]
+
+
+def test_dump_bill_json_matches_model_dump():
+    bills = _make_bills()
+    for bill in bills:
+        assert json.loads(dump_bill_json(bill)) == json.loads(bill.model_dump_json())
+    assert json.loads(dump_bills_json(bills)) == [json.loads(bill.model_dump_json()) for bill in bills]
+
+
+def test_default_items_are_interned():
+    assert category_helper.get_default_category() is category_helper.get_default_category()
+    assert asset_helper.get_asset("不存在的账户") is asset_helper.get_default_asset()
+    assert category_helper.get_category(TransactionType.EXPENSE, "外卖") is category_helper.get_category(
+        TransactionType.EXPENSE, "外卖"
+    )
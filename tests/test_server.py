@@ -0,0 +1,135 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from billparser.deadline import DeadlineExceededError
+from billparser.models import Bill, BillList, RawImage
+from billparser.parsers.base import BaseParser
+from billparser.pipeline import Pipeline
+from billparser.token_budget import TokenBudget, TokenBudgetExceededError
+from tests.factories import make_bill
+
+API_KEY_HEADER = {"X-API-Key": "test-key"}
+
+
+class ExhaustedParser(BaseParser[RawImage, Bill]):
+    name = "exhausted"
+
+    def __init__(self):
+        pass
+
+    async def parse(self, input_data: RawImage) -> Bill:
+        raise TokenBudgetExceededError("Token budget exhausted, exhausted is not called")
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch: pytest.MonkeyPatch) -> TestClient:
+    # Imported once the test settings are loaded, the server builds its pipelines at import
+    from billparser import security, server
+
+    monkeypatch.setitem(
+        server.pipeline_manager.pipelines, "exhausted", Pipeline(name="exhausted", steps=[ExhaustedParser()])
+    )
+    budget = TokenBudget(path=tmp_path / "usage.sqlite3", enabled=True, daily_tokens=1000)
+    monkeypatch.setattr(server, "token_budget", budget)
+    monkeypatch.setattr(security, "VALID_API_KEYS", {"test-key"})
+    # Without the lifespan: no warm-up
+    return TestClient(server.app)
+
+
+def test_parse_image_budget_exhausted(client: TestClient):
+    response = client.post(
+        "/parse_image",
+        params={"pipeline_name": "exhausted"},
+        files={"image": ("bill.png", b"budget screenshot")},
+        headers=API_KEY_HEADER,
+    )
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+
+def test_parse_image_stream_budget_exhausted(client: TestClient):
+    from billparser import server
+
+    assert server.token_budget.enabled
+    server.token_budget.used["daily"][""] = 1000
+    response = client.post(
+        "/parse_image_stream",
+        params={"pipeline_name": "exhausted"},
+        files={"image": ("bills.png", b"bill list screenshot")},
+        headers=API_KEY_HEADER,
+    )
+    # Refused before the stream starts
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 86400
+
+
+class StatementParser(BaseParser[RawImage, BillList]):
+    name = "statement"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def parse(self, input_data: RawImage) -> BillList:
+        self.calls += 1
+        return BillList([make_bill(12.5), make_bill(53.7)])
+
+
+def test_parse_image_refuses_bill_lists_before_running(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    from billparser import server
+
+    parser = StatementParser()
+    monkeypatch.setitem(
+        server.pipeline_manager.pipelines, "statement", Pipeline(name="statement", steps=[parser], record=True)
+    )
+    response = client.post(
+        "/parse_image",
+        params={"pipeline_name": "statement"},
+        files={"image": ("bills.png", b"bill list screenshot")},
+        headers=API_KEY_HEADER,
+    )
+    assert response.status_code == 400
+    assert "/parse_image_stream" in response.json()["detail"]
+    assert parser.calls == 0
+
+
+class FailingStatementParser(StatementParser):
+    async def parse_stream(self, input_data: RawImage):
+        yield make_bill(12.5)
+        raise DeadlineExceededError("Deadline exceeded in statement")
+
+
+@pytest.fixture
+def failing_stream(monkeypatch: pytest.MonkeyPatch) -> None:
+    from billparser import server
+
+    monkeypatch.setitem(
+        server.pipeline_manager.pipelines, "statement", Pipeline(name="statement", steps=[FailingStatementParser()])
+    )
+
+
+@pytest.mark.usefixtures("failing_stream")
+def test_parse_image_stream_input_mismatch(client: TestClient):
+    response = client.post(
+        "/parse_image_stream",
+        params={"pipeline_name": "statement"},
+        files={"image": ("statement.pdf", b"%PDF-1.7\n")},
+        headers=API_KEY_HEADER,
+    )
+    assert response.status_code == 400
+    assert "RawPdf" in response.json()["detail"]
+
+
+@pytest.mark.usefixtures("failing_stream")
+def test_parse_image_stream_reports_errors(client: TestClient):
+    response = client.post(
+        "/parse_image_stream",
+        params={"pipeline_name": "statement"},
+        files={"image": ("bills.png", b"bill list screenshot")},
+        headers=API_KEY_HEADER,
+    )
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line.get("amount") for line in lines] == [12.5, None]
+    assert lines[-1] == {"type": "error", "status": 504, "detail": "Deadline exceeded in statement"}
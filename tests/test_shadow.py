@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from billparser import batching
+from billparser.batching import MicroBatcher
+from billparser.metrics import metrics
+from billparser.models import Bill, RawText
+from billparser.parsers.base import BaseParser
+from billparser.pipeline import Pipeline, pipeline_manager
+from billparser.shadow import ShadowMirror, compare_fields, is_shadow_run
+from billparser.usage import TokenUsage, record_usage
+from tests.factories import make_bill
+
+
+class ShadowParser(BaseParser[RawText, Bill]):
+    name = "shadow_llm"
+
+    def __init__(self, catename: str, delay: float = 0):
+        self.catename = catename
+        self.delay = delay
+        self.shadow_flags: list[bool] = []
+
+    async def parse(self, input_data: RawText) -> Bill:
+        self.shadow_flags.append(is_shadow_run())
+        await asyncio.sleep(self.delay)
+        record_usage(SimpleNamespace(prompt_tokens=300, completion_tokens=50))
+        return make_bill(float(input_data), self.catename)
+
+
+def test_compare_fields():
+    agreement = compare_fields(make_bill(12.5), make_bill(12.5, "超市"))
+    assert not agreement["catename"]
+    assert all(agree for field, agree in agreement.items() if field != "catename")
+
+
+@pytest.mark.asyncio
+async def test_mirror_compares_shadowmake_bill(monkeypatch: pytest.MonkeyPatch):
+    metrics.reset()
+    parser = ShadowParser("超市")
+    monkeypatch.setitem(pipeline_manager.pipelines, "shadow_test", Pipeline(name="shadow_test", steps=[parser]))
+    mirror = ShadowMirror(enabled=True, sample_rate=1, max_concurrency=2, pipelines={"primary_test": "shadow_test"})
+    primary_usage = TokenUsage()
+    primary_usage.add(1000, 50)
+
+    assert await mirror.mirror("primary_test", RawText("12.5"), make_bill(12.5), 2.0, primary_usage)
+    await mirror.drain()
+
+    assert parser.shadow_flags == [True]
+    snapshot = metrics.snapshot()
+    labels = 'primary="primary_test",shadow="shadow_test"'
+    assert snapshot["counters"][f'shadow_requests_total{{outcome="mismatch",{labels}}}'] == 1
+    assert snapshot["counters"][f'shadow_field_agreement_total{{agree="false",field="catename",{labels}}}'] == 1
+    assert snapshot["counters"][f'shadow_field_agreement_total{{agree="true",field="amount",{labels}}}'] == 1
+    assert snapshot["summaries"][f"shadow_token_delta{{{labels}}}"]["sum"] == -700
+    assert snapshot["summaries"][f"shadow_latency_delta_seconds{{{labels}}}"]["max"] < 0
+    # Pipelines that are not mirrored are left alone
+    assert not await mirror.mirror("other", RawText("12.5"), make_bill(12.5), 2.0)
+
+
+@pytest.mark.asyncio
+async def test_mirror_drops_samples_over_budget(monkeypatch: pytest.MonkeyPatch):
+    metrics.reset()
+    parser = ShadowParser("外卖", delay=0.05)
+    monkeypatch.setitem(pipeline_manager.pipelines, "shadow_test", Pipeline(name="shadow_test", steps=[parser]))
+    mirror = ShadowMirror(enabled=True, sample_rate=1, max_concurrency=1, pipelines={"primary_test": "shadow_test"})
+
+    started = [await mirror.mirror("primary_test", RawText("12.5"), make_bill(12.5), 1.0) for _ in range(3)]
+    assert started == [True, False, False]
+    await mirror.drain()
+    assert mirror.in_flight == 0
+    counters = metrics.snapshot()["counters"]
+    labels = 'primary="primary_test",shadow="shadow_test"'
+    assert counters[f'shadow_requests_total{{outcome="dropped",{labels}}}'] == 2
+    assert counters[f'shadow_requests_total{{outcome="match",{labels}}}'] == 1
+
+
+class BatchedShadowParser(ShadowParser):
+    def __init__(self, catename: str):
+        super().__init__(catename)
+        self.batches: list[list[RawText]] = []
+
+    async def parse_batch(self, inputs: list[RawText]) -> list[Bill | Exception]:
+        self.batches.append(list(inputs))
+        return [await self.parse(input_data) for input_data in inputs]
+
+
+@pytest.mark.asyncio
+async def test_shadow_run_bypasses_micro_batching(monkeypatch: pytest.MonkeyPatch):
+    parser = BatchedShadowParser("外卖")
+    monkeypatch.setitem(batching._batchers, parser, MicroBatcher(parser, max_size=4, window_seconds=0.01))
+    monkeypatch.setitem(pipeline_manager.pipelines, "shadow_test", Pipeline(name="shadow_test", steps=[parser]))
+    mirror = ShadowMirror(enabled=True, sample_rate=1, max_concurrency=2, pipelines={"primary_test": "shadow_test"})
+
+    assert await mirror.mirror("primary_test", RawText("12.5"), make_bill(12.5), 1.0)
+    await mirror.drain()
+    # Parsed in the shadow context, not in a batch task where the flag is lost
+    assert parser.batches == []
+    assert parser.shadow_flags == [True]
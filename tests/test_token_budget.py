@@ -0,0 +1,105 @@
+import json
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from billparser.metrics import metrics
+from billparser.models import RawText
+from billparser.parsers import ds_parsers
+from billparser.parsers.ds_parsers import OpenAICompatibleLLMParser
+from billparser.token_budget import Degradation, TokenBudget, TokenBudgetExceededError, current_degradation
+from billparser.usage import record_usage
+from tests.factories import bill_json
+
+
+class MeteredLLMParser(OpenAICompatibleLLMParser):
+    name = "metered_llm"
+
+    def __init__(self):
+        self.calls: list[tuple[str, str]] = []
+        self._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._create)))
+
+    async def _create(self, model: str, messages: list[dict]):
+        self.calls.append((model, messages[-1]["content"]))
+        message = SimpleNamespace(content=json.dumps(bill_json(), ensure_ascii=False))
+        usage = SimpleNamespace(prompt_tokens=len(messages[-1]["content"]), completion_tokens=60)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def model(self) -> str:
+        return "large"
+
+    @property
+    def cheap_model(self) -> str | None:
+        return "small"
+
+
+@pytest.mark.asyncio
+async def test_usage_is_persisted_and_degrades(tmp_path):
+    path = tmp_path / "token_usage.sqlite3"
+    budget = TokenBudget(path=path, enabled=True, daily_tokens=10000, keys={"phone": {"daily_tokens": 500}})
+    async with budget.metered("ocr_then_llm", "phone") as usage:
+        assert current_degradation() is Degradation.NONE
+        record_usage(SimpleNamespace(prompt_tokens=400, completion_tokens=50))
+    assert usage.total_tokens == 450
+    # 90% of the key budget used, the service budget is far from exhausted
+    assert budget.degradation("phone") is Degradation.COMPACT_PROMPT
+    assert budget.degradation("other") is Degradation.NONE
+
+    reloaded = TokenBudget(path=path, enabled=True, daily_tokens=10000, keys={"phone": {"daily_tokens": 500}})
+    assert reloaded.snapshot()["scopes"]["phone"]["daily"] == {"used": 450, "budget": 500}
+    async with reloaded.metered("ocr_then_llm", "phone"):
+        assert current_degradation() is Degradation.COMPACT_PROMPT
+        record_usage(SimpleNamespace(prompt_tokens=100, completion_tokens=0))
+    assert reloaded.degradation("phone") is Degradation.LOCAL_ONLY
+    assert 0 < reloaded.retry_after("phone") <= 86400
+    budget.close()
+    reloaded.close()
+
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT api_key, pipeline, prompt_tokens, degradation FROM token_usage").fetchall()
+    assert rows == [("phone", "ocr_then_llm", 400, "none"), ("phone", "ocr_then_llm", 100, "compact_prompt")]
+
+
+@pytest.mark.asyncio
+async def test_parser_degradation(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    metrics.reset()
+    monkeypatch.setattr(ds_parsers.bill_index, "_enabled", False)
+    parser = MeteredLLMParser()
+    text = RawText("盒马 外卖 招商银行信用卡 -53.70 2025-10-26 17:27:53")
+    degrade_at = {"cheap_model": 0.1, "compact_prompt": 0.5, "local_only": 1.0}
+    budget = TokenBudget(path=tmp_path / "usage.sqlite3", enabled=True, daily_tokens=100000, degrade_at=degrade_at)
+
+    async with budget.metered("p", "phone") as usage:
+        await parser.parse(text)
+    assert parser.calls[-1][0] == "large"
+    full_prompt = parser.calls[-1][1]
+
+    budget.used["daily"][""] = 20000
+    async with budget.metered("p", "phone"):
+        await parser.parse(text)
+    assert parser.calls[-1][0] == "small"
+
+    budget.used["daily"][""] = 60000
+    async with budget.metered("p", "phone"):
+        await parser.parse(text)
+    assert parser.calls[-1][0] == "small"
+    assert len(parser.calls[-1][1]) < len(full_prompt)
+
+    budget.used["daily"][""] = 100000
+    with pytest.raises(TokenBudgetExceededError):
+        async with budget.metered("p", "phone"):
+            await parser.parse(text)
+    assert len(parser.calls) == 3
+
+    counters = metrics.snapshot()["counters"]
+    assert counters['llm_degraded_calls_total{mode="cheap_model",parser="metered_llm"}'] == 2
+    assert counters['llm_degraded_calls_total{mode="local_only",parser="metered_llm"}'] == 1
+    assert counters['token_budget_degraded_requests_total{api_key="phone",level="local_only"}'] == 1
+    assert counters['llm_tokens_total{api_key="phone",kind="completion",pipeline="p"}'] == 180
+    assert usage.requests == 1
@@ -0,0 +1,29 @@
+import pytest
+
+from billparser import warmup
+from billparser.parsers.manager import parser_manager
+
+
+class WarmParser:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.warmed = False
+
+    async def warm_up(self) -> None:
+        if self.fail:
+            raise ConnectionError("unreachable")
+        self.warmed = True
+
+
+@pytest.mark.asyncio
+async def test_warm_up(monkeypatch: pytest.MonkeyPatch):
+    state = warmup.WarmupState()
+    monkeypatch.setattr(warmup, "warmup_state", state)
+    parsers = {"ok": WarmParser(), "down": WarmParser(fail=True), "plain": object()}
+    monkeypatch.setattr(type(parser_manager), "parsers", property(lambda self: parsers))
+    assert not state.ready
+    await warmup.warm_up()
+    assert state.ready
+    assert parsers["ok"].warmed
+    assert set(state.durations) == {"helpers", "connect:ok", "connect:down"}
+    assert state.errors == {"connect:down": "unreachable"}
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect, WebSocketState
+
+from billparser.models import Bill, RawImage
+from billparser.parsers.base import BaseParser
+from billparser.pipeline import Pipeline
+from billparser.ws_ingest import FrameError, IngestSession, decode_frame, encode_frame
+from tests.factories import make_bill
+
+
+class SleepyParser(BaseParser[RawImage, Bill]):
+    name = "sleepy"
+
+    def __init__(self):
+        pass
+
+    async def parse(self, input_data: RawImage) -> Bill:
+        if input_data == b"fail":
+            raise RuntimeError("unreadable screenshot")
+        await asyncio.sleep(0.3 if input_data == b"slow" else 0)
+        return make_bill()
+
+
+app = FastAPI()
+pipeline = Pipeline(name="sleepy", steps=[SleepyParser()])
+
+
+@app.websocket("/ws")
+async def ws(websocket: WebSocket):
+    await websocket.accept()
+    await IngestSession(websocket, pipeline, "key", credits=2, max_frame_bytes=16).run()
+
+
+client = TestClient(app)
+
+
+def test_frames():
+    assert decode_frame(encode_frame("截图-1", b"png")) == ("截图-1", b"png")
+    for frame in (b"\x00", b"\x00\x00png", b"\x00\x05abc"):
+        with pytest.raises(FrameError):
+            decode_frame(frame)
+
+
+def test_results_out_of_order():
+    with client.websocket_connect("/ws") as websocket:
+        assert websocket.receive_json() == {"type": "ready", "credits": 2, "max_frame_bytes": 16}
+        websocket.send_bytes(encode_frame("a", b"slow"))
+        websocket.send_bytes(encode_frame("b", b"fast"))
+        first, second = websocket.receive_json(), websocket.receive_json()
+        assert (first["id"], second["id"]) == ("b", "a")
+        assert first["type"] == "result"
+        assert first["bill"]["catename"] == "外卖"
+        # Both credits are back
+        websocket.send_bytes(encode_frame("c", b"fail"))
+        websocket.send_bytes(encode_frame("d", b"x" * 17))
+        errors = {message["id"]: message for message in (websocket.receive_json(), websocket.receive_json())}
+        assert errors["c"]["status"] == 500
+        assert errors["d"]["status"] == 413
+
+
+def test_credits_exceeded():
+    with client.websocket_connect("/ws") as websocket:
+        websocket.receive_json()
+        for client_id in "abc":
+            websocket.send_bytes(encode_frame(client_id, b"slow"))
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            websocket.receive_json()
+        assert exc_info.value.code == 1008
+
+
+class StalledWebSocket:
+    """
+    A client sending frames without reading its answers: every send but the ready message blocks
+    until `read` is set.
+    """
+
+    application_state = WebSocketState.CONNECTED
+
+    def __init__(self, frames: list[bytes]):
+        self.frames = frames
+        self.read = asyncio.Event()
+        self.sent: list[str] = []
+        self.close_code: int | None = None
+
+    async def receive(self) -> dict:
+        if not self.frames:
+            await self.read.wait()
+            return {"type": "websocket.disconnect"}
+        # Let the frames received so far be parsed
+        await asyncio.sleep(0.05)
+        return {"type": "websocket.receive", "bytes": self.frames.pop(0)}
+
+    async def send_text(self, text: str) -> None:
+        if self.sent:
+            await self.read.wait()
+        self.sent.append(text)
+
+    async def close(self, code: int, reason: str = "") -> None:
+        self.close_code = code
+        self.read.set()
+
+
+@pytest.mark.asyncio
+async def test_unsent_answers_hold_their_credit():
+    websocket = StalledWebSocket([encode_frame(client_id, b"fast") for client_id in "abc"])
+    session = IngestSession(websocket, pipeline, "key", credits=2, max_frame_bytes=16)
+    await asyncio.wait_for(session.run(), timeout=5)
+    # The two first frames are parsed but their answers are not sent: the third frame has no credit
+    assert websocket.close_code == 1008